@@ -0,0 +1,306 @@
+import functools
+import json
+import sys
+import threading
+from concurrent.futures import Future
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Import configuration
+import config
+import metrics
+import nutrition_agent
+from llm_client import LLMError
+from plan_cache import PlanCache, plan_fingerprint
+from plan_validator import PlanValidationError
+from subscribers import merge_preferences
+
+_LIST_FIELDS = ("allergies", "excluded_foods")
+# Text preferences and the values each may take
+_TEXT_FIELDS = {
+    "diet_type": ("balanced", "keto", "vegan", "vegetarian", "paleo", "mediterranean"),
+    "meal_complexity": ("simple", "medium", "complex"),
+    "protein_focus": ("high", "balanced", "low"),
+}
+_MAX_BODY_BYTES = 64 * 1024
+
+def parse_preferences(fields):
+    """Preferences from query parameters or a JSON body, over the configured defaults.
+
+    Lists may be given as JSON arrays or comma-separated strings. Raises
+    ValueError for unknown fields and values that cannot be used in a prompt.
+    """
+    overrides = {}
+    for name, value in fields.items():
+        if name == "calories_per_day":
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"calories_per_day must be a whole number, not {value!r}") from None
+            if not 800 <= value <= 6000:
+                raise ValueError("calories_per_day must be between 800 and 6000")
+        elif name in _LIST_FIELDS:
+            if isinstance(value, str):
+                value = [item.strip() for item in value.split(",") if item.strip()]
+            elif not (isinstance(value, list) and all(isinstance(item, str) for item in value)):
+                raise ValueError(f"{name} must be a list of strings")
+        elif name in _TEXT_FIELDS:
+            allowed = _TEXT_FIELDS[name]
+            if not isinstance(value, str) or value.strip().lower() not in allowed:
+                raise ValueError(f"{name} must be one of {', '.join(allowed)}, not {value!r}")
+            value = value.strip().lower()
+        else:
+            raise ValueError(f"unknown preference {name!r}")
+        overrides[name] = value
+    return merge_preferences(overrides)
+
+def parse_date(value):
+    """The plan date from an ISO `YYYY-MM-DD` string, today when empty"""
+    if not value:
+        return date.today()
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"date must be YYYY-MM-DD, not {value!r}") from None
+
+class Coalescer:
+    """Runs one call per key at a time; callers arriving while it is in flight wait for and share its result"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def run(self, key, function):
+        """`function()` for the first caller of `key`, its result (or exception) for concurrent ones.
+
+        Returns (result, shared), where `shared` tells whether another
+        caller's run was reused.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            metrics.API_COALESCED.inc()
+            return future.result(), True
+        try:
+            result = function()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+def _section_json(sections):
+    """Parsed plan sections as JSON-friendly dicts"""
+    converted = []
+    for title, icon, content in sections:
+        items = []
+        for kind, value in content:
+            if kind == nutrition_agent.MACROS:
+                protein, carbs, fiber = map(int, value)
+                items.append({"kind": kind, "protein": protein, "carbs": carbs, "fiber": fiber})
+            elif kind == nutrition_agent.CALORIES:
+                items.append({"kind": kind, "kcal": int(value)})
+            else:
+                items.append({"kind": kind, "text": value})
+        converted.append({"title": title, "icon": icon, "items": items})
+    return converted
+
+@functools.lru_cache(maxsize=config.API_RESPONSE_CACHE_SIZE)
+def _render(diet_plan, fmt, calories, diet_type, plan_date, *theme):
+    """Encoded response body for one plan, shared by every request with the same targets, date and format"""
+    preferences = {"calories_per_day": calories, "diet_type": diet_type}
+    current_date = plan_date.strftime("%A, %B %d, %Y")
+    sections = nutrition_agent.plan_sections(diet_plan)
+    if fmt == "html":
+        return nutrition_agent.get_html_template(current_date, diet_plan, preferences, sections).encode("utf-8")
+    return json.dumps({
+        "date": plan_date.isoformat(),
+        "calories_per_day": calories,
+        "diet_type": diet_type,
+        "plan": diet_plan,
+        "sections": _section_json(sections),
+    }, ensure_ascii=False).encode("utf-8")
+
+def render_response(diet_plan, preferences, plan_date, fmt="html"):
+    """A plan as an HTML page (the email body) or a JSON document, as bytes"""
+    return _render(diet_plan, fmt, preferences["calories_per_day"], preferences["diet_type"], plan_date,
+                   config.EMAIL_COLOR_PRIMARY, config.EMAIL_COLOR_SECONDARY)
+
+class PlanService:
+    """Plans on demand: from the plan cache, else one generation per profile and day however many ask at once.
+
+    The model client is shared across requests and warmed with
+    API_WARM_AGENTS agents up front; each pooled agent keeps its model
+    client, and with it its HTTP connections, between requests. Pass
+    `agent_instance` (e.g. a stub) to replace it, and `cache=False` to
+    always generate.
+    """
+
+    def __init__(self, agent_instance=None, cache=None, warm_agents=None):
+        self.agent = agent_instance or nutrition_agent.get_agent()
+        warm = getattr(self.agent, "warm", None)
+        if warm is not None:
+            warm(config.API_WARM_AGENTS if warm_agents is None else warm_agents)
+        self.owns_cache = cache is None and config.PLAN_CACHE_ENABLED
+        if self.owns_cache:
+            cache = PlanCache()
+        self.cache = cache or None
+        self.coalescer = Coalescer()
+
+    def close(self):
+        if self.owns_cache:
+            self.cache.close()
+
+    def _load(self, key, preferences, plan_date):
+        if self.cache is not None:
+            diet_plan = self.cache.get(key)
+            if diet_plan is not None:
+                return diet_plan, "cache"
+        diet_plan = nutrition_agent.generate_diet_plan(preferences, self.agent, plan_date)
+        if self.cache is not None:
+            self.cache.put(key, diet_plan)
+        return diet_plan, "generated"
+
+    def plan_for(self, preferences, plan_date=None):
+        """The plan text for a profile and day, and its source: "cache", "generated", or "shared" with a concurrent request"""
+        plan_date = plan_date or date.today()
+        key = plan_fingerprint(preferences, plan_date)
+        (diet_plan, source), shared = self.coalescer.run(key, lambda: self._load(key, preferences, plan_date))
+        return diet_plan, "shared" if shared else source
+
+def _make_handler(service):
+    class PlanHandler(BaseHTTPRequestHandler):
+        # Keep-alive, so clients reuse their connection across requests
+        protocol_version = "HTTP/1.1"
+        # Buffer each response into a single write (flushed after every request); headers and
+        # body sent separately stall keep-alive clients on Nagle's algorithm and delayed ACKs
+        wbufsize = 64 * 1024
+
+        def _send(self, route, status, body, content_type, headers=()):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+            metrics.API_REQUESTS.inc(route=route, status=str(status))
+
+        def _send_json(self, route, status, document):
+            self._send(route, status, json.dumps(document).encode("utf-8"), "application/json")
+
+        def _plan(self, fields):
+            fmt = fields.pop("format", None)
+            if fmt is None:
+                fmt = "json" if "application/json" in self.headers.get("Accept", "") else "html"
+            if fmt not in ("html", "json"):
+                raise ValueError('format must be "html" or "json"')
+            plan_date = parse_date(fields.pop("date", None))
+            preferences = parse_preferences(fields)
+            diet_plan, source = service.plan_for(preferences, plan_date)
+            body = render_response(diet_plan, preferences, plan_date, fmt)
+            content_type = "text/html; charset=utf-8" if fmt == "html" else "application/json"
+            self._send("/plan", 200, body, content_type, (("X-Plan-Source", source),))
+
+        def _handle(self, fields):
+            try:
+                self._plan(fields)
+            except PlanValidationError as e:
+                # A ValueError too, but the request was fine: no generated plan passed validation
+                self._send_json("/plan", 503, {"error": f"no safe plan could be generated: {e}"})
+            except ValueError as e:
+                self._send_json("/plan", 400, {"error": str(e)})
+            except LLMError as e:
+                self._send_json("/plan", 503, {"error": f"plan generation unavailable: {e}"})
+            except Exception as e:
+                print(f"Error serving {self.path}: {e}")
+                self._send_json("/plan", 500, {"error": "internal error"})
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/plan":
+                with metrics.API_SECONDS.time(route="/plan"):
+                    self._handle({name: values[-1] for name, values in parse_qs(url.query).items()})
+            elif url.path == "/healthz":
+                self._send_json("/healthz", 200, {"status": "ok"})
+            elif url.path == "/metrics":
+                body = metrics.REGISTRY.render().encode("utf-8")
+                self._send("/metrics", 200, body, "text/plain; version=0.0.4; charset=utf-8")
+            else:
+                self._send_json("other", 404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            if url.path != "/plan":
+                # The body is left unread, so the connection cannot carry another request
+                self.close_connection = True
+                self._send_json("other", 404, {"error": "not found"})
+                return
+            with metrics.API_SECONDS.time(route="/plan"):
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    self.close_connection = True
+                    self._send_json("/plan", 400, {"error": "invalid Content-Length"})
+                    return
+                if length > _MAX_BODY_BYTES:
+                    self.close_connection = True
+                    self._send_json("/plan", 413, {"error": "request body too large"})
+                    return
+                try:
+                    fields = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    fields = None
+                if not isinstance(fields, dict):
+                    self._send_json("/plan", 400, {"error": "body must be a JSON object of preferences"})
+                    return
+                fields.update({name: values[-1] for name, values in parse_qs(url.query).items()})
+                self._handle(fields)
+
+        def log_message(self, *args):
+            pass
+
+    return PlanHandler
+
+def create_server(service=None, host=None, port=None):
+    """An HTTP server for `service` (a new PlanService by default), bound but not yet serving.
+
+    GET /plan takes the preferences as query parameters, POST /plan as a
+    JSON object; `date` (YYYY-MM-DD) and `format` (html or json, else from
+    the Accept header) are optional. /healthz and /metrics are also served.
+    """
+    service = service or PlanService()
+    server = ThreadingHTTPServer((host or config.API_HOST, config.API_PORT if port is None else port),
+                                 _make_handler(service))
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+def start_server(service=None, host=None, port=None):
+    """Serve on a daemon thread; returns the server (`server_address` has the bound port)"""
+    server = create_server(service, host, port)
+    threading.Thread(target=server.serve_forever, name="plan-api", daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    # Usage: python app.py [port]
+    server = create_server(port=int(sys.argv[1]) if len(sys.argv) > 1 else None)
+    host, port = server.server_address[:2]
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Serving plans on http://{host}:{port}/plan")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.close()
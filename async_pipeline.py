@@ -0,0 +1,332 @@
+import asyncio
+import time
+from datetime import datetime
+
+# Import configuration
+import config
+import metrics
+import nutrition_agent
+from fanout import percentile
+from meal_library import harvest, plan_from_library
+from mime_batch import render_message
+from plan_cache import PlanCache, plan_fingerprint
+from plan_history import record_delivery
+from plan_validator import validate_and_repair
+from smtp_pool import SMTPConnectionPool
+from timer_scheduler import DeliveryScheduler, TimerScheduler
+
+try:
+    import aiosmtplib
+except ImportError:  # Deliver through the threaded connection pool instead
+    aiosmtplib = None
+
+class AsyncRateLimiter:
+    """Spaces awaited calls out so no more than `max_per_second` go through"""
+
+    def __init__(self, max_per_second):
+        self.interval = 1.0 / max_per_second if max_per_second else 0.0
+        self._next_slot = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+class AsyncSMTPConnection:
+    """One persistent, authenticated aiosmtplib connection owned by a delivery worker"""
+
+    def __init__(self, host=None, port=None, username=None, password=None, use_ssl=None):
+        self.host = host or config.SMTP_HOST
+        self.port = port or config.SMTP_PORT
+        self.username = username if username is not None else config.EMAIL_SENDER
+        self.password = password if password is not None else config.EMAIL_PASSWORD
+        self.use_ssl = config.SMTP_USE_SSL if use_ssl is None else use_ssl
+        self.client = None
+
+    async def _connect(self):
+        self.client = aiosmtplib.SMTP(hostname=self.host, port=self.port, use_tls=self.use_ssl,
+                                      start_tls=False)
+        await self.client.connect()
+        if self.username:
+            await self.client.login(self.username, self.password)
+
+    async def sendmail(self, from_addr, to_addr, message):
+        """Send over the open connection, reconnecting once if it went stale"""
+        for attempt in range(2):
+            if self.client is None:
+                await self._connect()
+            try:
+                await self.client.sendmail(from_addr, [to_addr], message)
+                return
+            except (aiosmtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+                self.client = None
+                if attempt:
+                    raise
+
+    async def close(self):
+        if self.client is not None:
+            try:
+                await self.client.quit()
+            except Exception:
+                self.client.close()
+            self.client = None
+
+class _ThreadedSMTPConnection:
+    """Adapter running the blocking connection pool off the event loop"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def sendmail(self, from_addr, to_addr, message):
+        await asyncio.to_thread(self.pool.sendmail, from_addr, to_addr, message)
+
+    async def close(self):
+        pass
+
+async def agenerate_diet_plan(preferences=None, agent_instance=None, plan_date=None):
+    """Generate a diet plan without blocking the event loop"""
+    if config.MEAL_LIBRARY_ENABLED:
+        diet_plan = await asyncio.to_thread(plan_from_library, preferences, plan_date)
+        if diet_plan is not None:
+            return diet_plan
+    prompt = await asyncio.to_thread(nutrition_agent.plan_prompt, preferences, plan_date)
+    agent_instance = agent_instance or nutrition_agent.get_agent()
+    if hasattr(agent_instance, "arun"):
+        response = await agent_instance.arun(prompt)
+    else:
+        response = await asyncio.to_thread(agent_instance.run, prompt)
+    diet_plan = response.content
+    if config.VALIDATE_PLANS:
+        # Checking is cheap, but a failing meal is regenerated with a blocking call
+        diet_plan = await asyncio.to_thread(validate_and_repair, diet_plan, preferences, agent_instance,
+                                            plan_date)
+    if config.MEAL_LIBRARY_ENABLED:
+        await asyncio.to_thread(harvest, diet_plan, preferences)
+    return diet_plan
+
+async def run_async_fanout(subscribers, agent_instance=None, generation_concurrency=None,
+                           delivery_concurrency=None, deliver=None, cache=None, plan_date=None):
+    """Generate and send plans with generation and delivery overlapping.
+
+    Up to `generation_concurrency` LLM calls run at once and feed a bounded
+    queue drained by `delivery_concurrency` workers, each holding its own SMTP
+    connection, so delivery of one plan proceeds while later ones generate.
+    `deliver`, if given, is an async callable replacing SMTP delivery and
+    `cache` and `plan_date` behave as in `run_fanout`. Returns
+    throughput/latency stats.
+    """
+    generation_concurrency = generation_concurrency or config.ASYNC_GENERATION_CONCURRENCY
+    delivery_concurrency = delivery_concurrency or config.ASYNC_DELIVERY_CONCURRENCY
+    owns_cache = cache is None and config.PLAN_CACHE_ENABLED
+    if owns_cache:
+        cache = PlanCache()
+    elif not cache:
+        cache = None
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Async fan-out to {len(subscribers)} subscribers "
+          f"({generation_concurrency} generating, {delivery_concurrency} delivering)...")
+
+    # The agent pool doubles as the generation concurrency limit
+    agents = asyncio.Queue()
+    for _ in range(generation_concurrency):
+        agents.put_nowait(agent_instance or nutrition_agent.get_agent())
+    in_flight = {}
+    ready = asyncio.Queue(maxsize=delivery_concurrency * 2)
+    rate_limiter = AsyncRateLimiter(config.SMTP_MAX_PER_SECOND)
+    current_date = plan_date.strftime("%A, %B %d, %Y") if plan_date else None
+    threaded_pool = None
+    if deliver is None and aiosmtplib is None:
+        threaded_pool = SMTPConnectionPool(size=delivery_concurrency)
+    generation_times = []
+    delivery_times = []
+    counts = {"succeeded": 0, "failed": 0}
+
+    async def generate(preferences):
+        pooled_agent = await agents.get()
+        try:
+            return await agenerate_diet_plan(preferences, pooled_agent, plan_date)
+        finally:
+            agents.put_nowait(pooled_agent)
+
+    async def plan_for(preferences):
+        if cache is None:
+            return await generate(preferences)
+        key = plan_fingerprint(preferences, plan_date)
+        if key in in_flight:
+            cache.hits += 1
+            metrics.CACHE_LOOKUPS.inc(result="hit")
+            return await asyncio.shield(in_flight[key])
+        plan = cache.get(key)
+        if plan is not None:
+            return plan
+        task = asyncio.ensure_future(generate(preferences))
+        in_flight[key] = task
+        try:
+            plan = await task
+            cache.put(key, plan)
+            return plan
+        finally:
+            del in_flight[key]
+
+    async def produce(subscriber):
+        started = time.perf_counter()
+        try:
+            diet_plan = await plan_for(subscriber["preferences"])
+        except Exception as e:
+            print(f"Error generating plan for {subscriber['email']}: {e}")
+            metrics.DELIVERIES.inc(result="failed")
+            counts["failed"] += 1
+            return
+        generation_times.append(time.perf_counter() - started)
+        await ready.put((subscriber, diet_plan))
+
+    async def consume():
+        if deliver is not None:
+            connection = None
+        elif threaded_pool is not None:
+            connection = _ThreadedSMTPConnection(threaded_pool)
+        else:
+            connection = AsyncSMTPConnection()
+        try:
+            while True:
+                item = await ready.get()
+                if item is None:
+                    return
+                subscriber, diet_plan = item
+                started = time.perf_counter()
+                try:
+                    if deliver is not None:
+                        success = await deliver(diet_plan, subscriber["email"], subscriber["preferences"])
+                    else:
+                        message = render_message(diet_plan, subscriber["email"], subscriber["preferences"], current_date)
+                        await rate_limiter.wait()
+                        await connection.sendmail(config.EMAIL_SENDER, subscriber["email"], message)
+                        success = True
+                except Exception as e:
+                    print(f"Error sending email to {subscriber['email']}: {e}")
+                    success = False
+                delivery_times.append(time.perf_counter() - started)
+                metrics.DELIVERIES.inc(result="sent" if success else "failed")
+                if success and config.PLAN_HISTORY_ENABLED:
+                    await asyncio.to_thread(record_delivery, subscriber["email"], plan_date, diet_plan,
+                                            subscriber["preferences"])
+                counts["succeeded" if success else "failed"] += 1
+        finally:
+            if connection is not None:
+                await connection.close()
+
+    started = time.perf_counter()
+    consumers = [asyncio.create_task(consume()) for _ in range(delivery_concurrency)]
+    await asyncio.gather(*(produce(subscriber) for subscriber in subscribers))
+    for _ in consumers:
+        await ready.put(None)
+    await asyncio.gather(*consumers)
+    elapsed = time.perf_counter() - started
+
+    cache_stats = cache.stats() if cache is not None else {"hits": 0, "misses": 0, "hit_rate": 0.0}
+    if owns_cache:
+        cache.close()
+    if threaded_pool is not None:
+        threaded_pool.close()
+
+    stats = {
+        "subscribers": len(subscribers),
+        "succeeded": counts["succeeded"],
+        "failed": counts["failed"],
+        "elapsed_s": elapsed,
+        "throughput_per_s": len(subscribers) / elapsed if elapsed else 0.0,
+        "generation_p50_s": percentile(generation_times, 50),
+        "generation_p95_s": percentile(generation_times, 95),
+        "delivery_p50_s": percentile(delivery_times, 50),
+        "delivery_p95_s": percentile(delivery_times, 95),
+        "cache_hits": cache_stats["hits"],
+        "cache_misses": cache_stats["misses"],
+        "cache_hit_rate": cache_stats["hit_rate"],
+    }
+    print(
+        f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Async batch finished: "
+        f"{stats['succeeded']} delivered, {stats['failed']} failed in {elapsed:.1f}s "
+        f"({stats['throughput_per_s']:.2f}/s, generation p50 {stats['generation_p50_s']:.2f}s "
+        f"p95 {stats['generation_p95_s']:.2f}s, cache hit rate {stats['cache_hit_rate']:.0%})"
+    )
+    return stats
+
+async def deliver_async(subscribers, plan_date=None):
+    """Deliver `plan_date`'s plans to `subscribers` without blocking the event loop.
+
+    With DELIVERY_QUEUE_ENABLED the run goes through the durable delivery
+    queue on a worker thread, as `run_queued` does for the threaded
+    scheduler, so a rerun or a crash mid-run never sends twice. Otherwise
+    plans are generated and sent by `run_async_fanout`.
+    """
+    if config.DELIVERY_QUEUE_ENABLED:
+        from delivery_queue import run_queued
+        return await asyncio.to_thread(run_queued, subscribers, plan_date=plan_date)
+    return await run_async_fanout(subscribers, plan_date=plan_date)
+
+async def async_nutrition_job():
+    """Async counterpart of `nutrition_job` covering every registered subscriber"""
+    from subscribers import SubscriberRegistry, merge_preferences
+    with SubscriberRegistry() as registry:
+        subscribers = registry.list_subscribers()
+    if not subscribers:
+        subscribers = [{"email": config.EMAIL_RECEIVER, "preferences": merge_preferences()}]
+    return await deliver_async(subscribers)
+
+async def run_scheduler_async(timer=None, load_subscribers=None):
+    """Event-loop version of `setup_scheduler` that never blocks on a running job.
+
+    Subscribers are grouped by send time and timezone exactly as in
+    `setup_scheduler`; each group's delivery runs as its own task through
+    `deliver_async`, after its plans were pregenerated on a worker thread.
+    """
+    from batch_generation import pregenerate
+    loop = asyncio.get_running_loop()
+    running = set()
+
+    def start(coroutine):
+        task = loop.create_task(coroutine)
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+    async def deliver_group(subscribers, plan_date):
+        with metrics.job("scheduled"):
+            metrics.SUBSCRIBERS.set(len(subscribers))
+            await deliver_async(subscribers, plan_date)
+
+    async def pregenerate_group(subscribers, plan_date):
+        try:
+            await asyncio.to_thread(pregenerate, subscribers, start_date=plan_date, days=1)
+        except Exception as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Pregeneration failed: {e}")
+
+    # Callbacks only start tasks, so a long batch never delays the next deadline
+    timer = TimerScheduler() if timer is None else timer
+    deliveries = DeliveryScheduler(
+        timer,
+        load_subscribers or nutrition_agent.scheduled_subscribers,
+        deliver=lambda subscribers, plan_date: start(deliver_group(subscribers, plan_date)),
+        # Pregenerated plans only reach deliveries through the plan cache
+        pregenerate=(lambda subscribers, plan_date: start(pregenerate_group(subscribers, plan_date)))
+        if config.PLAN_CACHE_ENABLED else None,
+    )
+    groups = deliveries.start()
+    metrics.start_http_server()
+    if config.DELIVERY_QUEUE_ENABLED:
+        # Retry failed deliveries once their backoff has passed, and resume any left by a crash
+        from delivery_queue import process_queue
+        timer.schedule_every(config.DELIVERY_POLL_SECONDS, lambda due: start(asyncio.to_thread(process_queue)))
+    if config.PLAN_HISTORY_ENABLED:
+        from plan_history import get_history
+        timer.schedule_every(24 * 3600, lambda due: start(asyncio.to_thread(get_history().prune)))
+    first = datetime.fromtimestamp(timer.next_due()).strftime('%Y-%m-%d %H:%M')
+    print(f"Nutrition agent scheduled {groups} send time group(s); next job at {first} (async)")
+
+    if config.RUN_TEST_ON_START:
+        print("Running initial nutrition plan now for testing...")
+        start(async_nutrition_job())
+
+    await timer.run_forever_async()
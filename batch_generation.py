@@ -0,0 +1,203 @@
+import re
+from datetime import date, datetime, time, timedelta
+
+# Import configuration
+import config
+import nutrition_agent
+import prompt_builder
+from meal_library import harvest, plan_from_library
+from plan_cache import PlanCache, plan_fingerprint, profile_fingerprint
+from plan_validator import PlanValidationError, validate_and_repair
+
+# Each plan in a batched response starts with a delimiter line like "=== DAY 3 ===" or "=== PROFILE 2 ==="
+_DELIMITER_RE = re.compile(r'^\s*=+\s*(?:DAY|PROFILE)\s+(\d+)\b[^\n]*$', re.IGNORECASE | re.MULTILINE)
+
+def _display_date(plan_date):
+    return plan_date.strftime("%A, %B %d, %Y")
+
+def _recent_dishes(preferences, plan_date):
+    """Dishes the profile was served before `plan_date`, when plan history is on"""
+    if not config.PLAN_HISTORY_ENABLED:
+        return None
+    from plan_history import recently_served
+    return recently_served(preferences, plan_date)
+
+def build_week_prompt(preferences, dates, avoid_dishes=None):
+    """Prompt for one profile's plans over several dates, one delimited block per day"""
+    day_list = "".join(f"DAY {number}: {_display_date(plan_date)}\n" for number, plan_date in enumerate(dates, 1))
+    recent = f"Recently served: {'; '.join(avoid_dishes)}\n" if avoid_dishes else ""
+    return prompt_builder.instruction_prefix() + (
+        f"Profile: {prompt_builder.profile_line(preferences)}\n"
+        f"{recent}"
+        f"Produce {len(dates)} complete daily menus, one for each of these days, without repeating main dishes:\n"
+        f"{day_list}"
+        'Start each day\'s menu with a line containing only "=== DAY <number> ===" and put nothing before the first one.\n'
+    )
+
+def build_profiles_prompt(preferences_list, plan_date, avoid_lists=None):
+    """Prompt for one date's plans for several profiles, one delimited block per profile.
+
+    `avoid_lists` holds each profile's recently served dishes, in order.
+    """
+    avoid_lists = avoid_lists or [None] * len(preferences_list)
+    profile_list = "".join(
+        f"PROFILE {number}: {prompt_builder.profile_line(preferences)}"
+        + (f"; recently served: {'; '.join(avoid_dishes)}" if avoid_dishes else "") + "\n"
+        for number, (preferences, avoid_dishes) in enumerate(zip(preferences_list, avoid_lists), 1)
+    )
+    return prompt_builder.instruction_prefix() + (
+        f"Date: {_display_date(plan_date)}\n"
+        f"Produce {len(preferences_list)} complete daily menus, one for each of these profiles:\n"
+        f"{profile_list}"
+        'Start each profile\'s menu with a line containing only "=== PROFILE <number> ===" and put nothing before the first one.\n'
+    )
+
+def split_batch(text, expected):
+    """Split a batched response into {number: plan text}; missing or empty blocks are left out"""
+    matches = list(_DELIMITER_RE.finditer(text))
+    plans = {}
+    for index, match in enumerate(matches):
+        number = int(match.group(1))
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(text)
+        body = text[match.end():end].strip()
+        if 1 <= number <= expected and body:
+            plans[number] = body
+    return plans
+
+def _run(prompt, agent_instance):
+    return (agent_instance or nutrition_agent.get_agent()).run(prompt).content
+
+def generate_week(preferences, start_date=None, days=None, agent_instance=None):
+    """Generate `days` consecutive plans for one profile in a single model call.
+
+    Returns {date: plan text}. Days the response is missing are regenerated
+    one at a time so the result is always complete.
+    """
+    start_date = start_date or date.today()
+    return _week_plans(preferences, [start_date + timedelta(days=offset) for offset in range(days or config.BATCH_DAYS)],
+                       agent_instance)
+
+def _week_plans(preferences, dates, agent_instance):
+    """{date: plan text} for one profile over `dates`, in one call when there are several"""
+    avoid_dishes = _recent_dishes(preferences, dates[0])
+    if len(dates) == 1:
+        return {dates[0]: _run(prompt_builder.build_prompt(preferences, _display_date(dates[0]), avoid_dishes),
+                               agent_instance)}
+    plans = split_batch(_run(build_week_prompt(preferences, dates, avoid_dishes), agent_instance), len(dates))
+    result = {}
+    for number, plan_date in enumerate(dates, 1):
+        if number not in plans:
+            print(f"Batch response missing {_display_date(plan_date)}, generating it separately")
+            plans[number] = _run(prompt_builder.build_prompt(preferences, _display_date(plan_date), avoid_dishes),
+                                 agent_instance)
+        result[plan_date] = plans[number]
+    return result
+
+def generate_profiles(preferences_list, plan_date=None, agent_instance=None):
+    """Generate one date's plans for several profiles in a single model call, in input order"""
+    plan_date = plan_date or date.today()
+    avoid_lists = [_recent_dishes(preferences, plan_date) for preferences in preferences_list]
+    if len(preferences_list) == 1:
+        return [_run(prompt_builder.build_prompt(preferences_list[0], _display_date(plan_date), avoid_lists[0]),
+                     agent_instance)]
+    plans = split_batch(_run(build_profiles_prompt(preferences_list, plan_date, avoid_lists), agent_instance),
+                        len(preferences_list))
+    result = []
+    for number, (preferences, avoid_dishes) in enumerate(zip(preferences_list, avoid_lists), 1):
+        if number not in plans:
+            print(f"Batch response missing profile {number}, generating it separately")
+            plans[number] = _run(prompt_builder.build_prompt(preferences, _display_date(plan_date), avoid_dishes),
+                                 agent_instance)
+        result.append(plans[number])
+    return result
+
+def _cache_checked(cache, preferences, plan_date, plan, agent_instance):
+    """Cache a plan (and add its meals to the library) once it passes validation.
+
+    A plan that cannot be repaired is left for delivery to regenerate.
+    """
+    if config.VALIDATE_PLANS:
+        try:
+            plan = validate_and_repair(plan, preferences, agent_instance, plan_date)
+        except PlanValidationError as e:
+            print(f"Not caching the plan for {_display_date(plan_date)}: {e}")
+            return
+    if config.MEAL_LIBRARY_ENABLED:
+        harvest(plan, preferences)
+    cache.put(plan_fingerprint(preferences, plan_date), plan, _ttl_until_stale(plan_date))
+
+def _ttl_until_stale(plan_date):
+    """Keep a pregenerated plan until PLAN_CACHE_TTL_HOURS after its day starts"""
+    day_start = datetime.combine(plan_date, time.min)
+    return (day_start - datetime.now()).total_seconds() + config.PLAN_CACHE_TTL_HOURS * 3600
+
+def pregenerate(subscribers, start_date=None, days=None, agent_instance=None, cache=None):
+    """Fill the plan cache ahead of time for every distinct profile among `subscribers`.
+
+    Plans already cached are skipped, and with MEAL_LIBRARY_ENABLED each
+    missing day is first assembled from the meal library, as at send time.
+    The model covers the rest: with `days` > 1 each profile gets one call
+    for its remaining dates; with `days` == 1 up to BATCH_PROFILES_PER_CALL
+    profiles share a call. Generated plans are validated and harvested into
+    the library. Delivery later finds the plans in the cache, so without
+    one (PLAN_CACHE_ENABLED off and no `cache` given) nothing is generated.
+    Returns the number of model calls made.
+    """
+    start_date = start_date or date.today()
+    days = days or config.BATCH_DAYS
+    dates = [start_date + timedelta(days=offset) for offset in range(days)]
+    owns_cache = cache is None and config.PLAN_CACHE_ENABLED
+    if owns_cache:
+        cache = PlanCache()
+    elif not cache:
+        # Deliveries would not find the plans, so generating them now would only double the calls
+        print("Plan cache is disabled; nothing to pregenerate")
+        return 0
+    calls = 0
+    try:
+        # The dates each profile still needs from the model, once cached and library plans are accounted for
+        profiles = {}
+        assembled = 0
+        for subscriber in subscribers:
+            preferences = subscriber["preferences"]
+            key = profile_fingerprint(preferences)
+            if key in profiles:
+                continue
+            profiles[key] = (preferences, [])
+            for plan_date in dates:
+                plan_key = plan_fingerprint(preferences, plan_date)
+                if cache.get(plan_key) is not None:
+                    continue
+                plan = plan_from_library(preferences, plan_date) if config.MEAL_LIBRARY_ENABLED else None
+                if plan is not None:
+                    cache.put(plan_key, plan, _ttl_until_stale(plan_date))
+                    assembled += 1
+                else:
+                    profiles[key][1].append(plan_date)
+        missing = [(preferences, pending_dates) for preferences, pending_dates in profiles.values() if pending_dates]
+
+        if days > 1:
+            for preferences, pending_dates in missing:
+                for plan_date, plan in _week_plans(preferences, pending_dates, agent_instance).items():
+                    _cache_checked(cache, preferences, plan_date, plan, agent_instance)
+                calls += 1
+        else:
+            pending = [preferences for preferences, _ in missing]
+            for offset in range(0, len(pending), config.BATCH_PROFILES_PER_CALL):
+                chunk = pending[offset:offset + config.BATCH_PROFILES_PER_CALL]
+                for preferences, plan in zip(chunk, generate_profiles(chunk, start_date, agent_instance)):
+                    _cache_checked(cache, preferences, start_date, plan, agent_instance)
+                calls += 1
+    finally:
+        if owns_cache:
+            cache.close()
+    print(f"✓ Pregenerated {days} day(s) for {len(profiles)} profile(s): {assembled} plan(s) from the meal library, "
+          f"{calls} batched call(s)")
+    return calls
+
+if __name__ == "__main__":
+    # Pregenerate the coming week for every registered subscriber, e.g. from a weekly cron job
+    from subscribers import SubscriberRegistry, merge_preferences
+    with SubscriberRegistry() as registry:
+        subscribers = registry.list_subscribers()
+    pregenerate(subscribers or [{"email": config.EMAIL_RECEIVER, "preferences": merge_preferences()}])
@@ -0,0 +1,73 @@
+import http.client
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from app import PlanService, start_server
+from benchmarks.stubs import StubAgent
+from fanout import percentile
+from llm_client import LLMClient
+from plan_cache import PlanCache
+
+def _worker(port, paths):
+    """Send `paths` one after another over a single keep-alive connection"""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    results = []
+    for path in paths:
+        started = time.perf_counter()
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        results.append((time.perf_counter() - started, response.status, response.getheader("X-Plan-Source")))
+    connection.close()
+    return results
+
+def _drive(port, paths, clients):
+    chunks = [paths[i::clients] for i in range(clients)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = [result for chunk in pool.map(lambda chunk: _worker(port, chunk), chunks) for result in chunk]
+    return results, time.perf_counter() - started
+
+def _report(label, results, elapsed, model_calls):
+    latencies = [latency for latency, status, _ in results if status == 200]
+    failures = len(results) - len(latencies)
+    sources = Counter(source for _, status, source in results if status == 200)
+    print(f"{label:7} {len(results):5} requests {len(results) / elapsed:7.0f} req/s  p50 {percentile(latencies, 50) * 1000:7.1f} ms  "
+          f"p99 {percentile(latencies, 99) * 1000:7.1f} ms  failures {failures}  model calls {model_calls:3}  "
+          f"{', '.join(f'{source} {count}' for source, count in sorted(sources.items()))}")
+    if failures:
+        sys.exit(1)
+
+def main(count=2000, clients=16, profiles=8, latency=0.3):
+    """Load-test the plan API against a stubbed model with `latency` seconds per call.
+
+    A cold burst sends every client's first request at once, spread over
+    `profiles` distinct profiles: coalescing should turn it into one model
+    call per profile. Then `count` requests, half HTML and half JSON, are
+    served from the plan cache and the rendered-response cache.
+    """
+    config.MEAL_LIBRARY_ENABLED = config.PLAN_HISTORY_ENABLED = config.VALIDATE_PLANS = False
+    model = LLMClient(lambda: StubAgent(latency=latency), requests_per_minute=0, tokens_per_minute=0,
+                      breaker_threshold=0, hedge_after=0)
+    paths = [f"/plan?calories_per_day={1500 + i % profiles * 100}&format={('html', 'json')[i // profiles % 2]}"
+             for i in range(count)]
+    with tempfile.TemporaryDirectory() as directory, PlanCache(os.path.join(directory, "plan_cache.db")) as cache:
+        service = PlanService(model, cache, warm_agents=profiles)
+        server = start_server(service, port=0)
+        port = server.server_address[1]
+        try:
+            for label, batch in (("cold", paths[:clients]), ("cached", paths)):
+                calls = model.stats["attempts"]
+                results, elapsed = _drive(port, batch, clients)
+                _report(label, results, elapsed, model.stats["attempts"] - calls)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+if __name__ == "__main__":
+    main(count=int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,37 @@
+import asyncio
+import sys
+
+import config
+from async_pipeline import run_async_fanout
+from benchmarks.smtp_sink import SMTPSink
+from benchmarks.stubs import AsyncStubAgent, StubAgent
+from fanout import run_fanout
+from smtp_pool import SMTPConnectionPool
+from subscribers import merge_preferences
+
+import nutrition_agent
+
+def main(count=200, latency=0.2, concurrency=16):
+    """Threaded fan-out vs the async pipeline, both delivering to a local SMTP sink"""
+    subscribers = [
+        {"email": f"user{i}@example.com", "preferences": merge_preferences({"calories_per_day": 1200 + i})}
+        for i in range(count)
+    ]
+    with SMTPSink(connect_delay=0.02, login_delay=0.01) as sink:
+        config.SMTP_HOST, config.SMTP_PORT, config.SMTP_USE_SSL = "127.0.0.1", sink.port, False
+        config.EMAIL_SENDER, config.EMAIL_PASSWORD = "sender@example.com", "password"
+        config.SMTP_MAX_PER_SECOND = 0
+
+        with SMTPConnectionPool(size=3) as pool:
+            deliver = lambda diet_plan, receiver, preferences: nutrition_agent.send_email(
+                diet_plan, receiver, preferences, pool=pool
+            )
+            threaded = run_fanout(subscribers, StubAgent(latency), concurrency, deliver, cache=False)
+        asynchronous = asyncio.run(
+            run_async_fanout(subscribers, AsyncStubAgent(latency), concurrency, 3, cache=False)
+        )
+        print(f"threaded {threaded['throughput_per_s']:8.2f} plans/s   async {asynchronous['throughput_per_s']:8.2f} plans/s")
+        print(f"sink received {sink.messages} messages")
+
+if __name__ == "__main__":
+    main(count=int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,44 @@
+import email
+import os
+import sys
+
+import nutrition_agent
+from benchmarks.corpus import load_corpus
+from bulk_render import BulkRenderer
+from subscribers import merge_preferences
+
+def main(count=4000, max_processes=None):
+    """Render `count` emails to bytes with 1, 2, 4, ... processes up to the core count (or `max_processes`)"""
+    corpus = load_corpus()
+    jobs = [
+        (f"user{i}@example.com", corpus[i % len(corpus)], merge_preferences({"calories_per_day": 1500 + i % 900}),
+         "Monday, May 04, 2026", f"<{i}@nutrition-agent>")
+        for i in range(count)
+    ]
+    receiver, diet_plan, preferences, current_date, _ = jobs[-1]
+    expected = nutrition_agent.get_html_template(current_date, diet_plan, preferences)
+    cores = max_processes or os.cpu_count() or 1
+    counts = sorted({1, *(2 ** power for power in range(1, cores.bit_length())), cores})
+    single = None
+    for processes in counts:
+        with BulkRenderer(processes=processes, min_batch=0) as renderer:
+            renderer.render(jobs[:processes * renderer.chunk_size])  # start the workers
+            messages = renderer.render(jobs)
+        stats = renderer.stats
+        if len(messages) != count or any(isinstance(message, Exception) for message in messages):
+            print(f"✗ {processes} process(es) failed to render every message")
+            sys.exit(1)
+        # Compare the decoded HTML alternative and headers; SMTP line endings are CRLF
+        parsed = email.message_from_bytes(messages[-1])
+        html = parsed.get_payload(1).get_payload(decode=True).decode("utf-8").replace("\r\n", "\n")
+        if html != expected or parsed["To"] != receiver or b"\n" in messages[-1].replace(b"\r\n", b""):
+            print("✗ Rendered bytes are not a CRLF-terminated copy of the last message")
+            sys.exit(1)
+        single = single or stats["throughput_per_s"]
+        per_worker = ", ".join(f"{worker['per_s']:.0f}" for worker in stats["workers"].values())
+        print(f"processes={processes:<3} {stats['throughput_per_s']:8.0f} emails/s  "
+              f"({stats['throughput_per_s'] / single:.2f}x, per worker: {per_worker} emails/s)")
+
+if __name__ == "__main__":
+    main(count=int(sys.argv[1]) if len(sys.argv) > 1 else 4000,
+         max_processes=int(sys.argv[2]) if len(sys.argv) > 2 else None)
@@ -0,0 +1,113 @@
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import config
+from benchmarks.corpus import synthetic_plan
+from plan_history import PlanHistory
+from weekly_digest import aggregate, daily_totals, digest_message, targets_for, weekly_report
+
+BATCH = 10000
+
+def _python_reference(columns, days, calories):
+    """Day totals, weekly totals and calorie trends the straightforward way, one delivery at a time"""
+    meals, values = columns["meals"], np.frombuffer(columns["nutrients"], dtype=np.uint16).tolist()
+    plan_totals, offset = [], 0
+    for count in meals:
+        totals = [sum(values[offset + meal * 4 + nutrient] for meal in range(count)) for nutrient in range(4)]
+        plan_totals.append(totals if count else None)
+        offset += count * 4
+    daily = [[None] * days for _ in columns["emails"]]
+    for subscriber, day, plan in zip(columns["subscriber"], columns["day"], columns["plan"]):
+        daily[subscriber][day] = plan_totals[plan]
+    results = []
+    for subscriber, week in enumerate(daily):
+        logged = [(day, totals) for day, totals in enumerate(week) if totals is not None]
+        totals = [sum(values[nutrient] for _, values in logged) for nutrient in range(4)]
+        trend = float("nan")
+        if len(logged) > 1:
+            xs = [day for day, _ in logged]
+            ys = [values[0] for _, values in logged]
+            mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+            trend = (sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+                     / sum((x - mean_x) ** 2 for x in xs))
+        on_target = sum(abs(values[0] - calories[subscriber]) <= config.VALIDATION_KCAL_TOLERANCE * calories[subscriber]
+                        for _, values in logged)
+        results.append((len(logged), totals, trend, on_target))
+    return results
+
+def main(subscribers=100_000, days=7, plans_per_day=2000):
+    """Archive `subscribers` x `days` deliveries, then time the weekly report over all of them.
+
+    Subscribers fall into `plans_per_day` profiles that each get one plan
+    a day, and about one day in ten is missed.
+    """
+    templates = [synthetic_plan(seed, lines_per_meal=2) for seed in range(500)]
+    start = date(2026, 5, 4)
+    # Subscribers sharing a plan share its profile, and with it the calorie goal
+    profiles = [dict(config.DIETARY_PREFERENCES, calories_per_day=1200 + number % 1500) for number in range(plans_per_day)]
+    preferences = {f"user{number}@example.com": profiles[number % plans_per_day] for number in range(subscribers)}
+    calories = {email: profile["calories_per_day"] for email, profile in preferences.items()}
+
+    with tempfile.TemporaryDirectory() as directory, PlanHistory(os.path.join(directory, "history.db")) as history:
+        started = time.perf_counter()
+        batch = []
+        for offset in range(days):
+            plan_date = start + timedelta(days=offset)
+            plans = [f"Menu {number}/{offset}\n" + templates[(number * 7 + offset) % len(templates)]
+                     for number in range(plans_per_day)]
+            for number, email in enumerate(calories):
+                if (number * 31 + offset) % 10 == 0:
+                    continue
+                batch.append((email, plan_date, plans[number % plans_per_day], preferences[email]))
+                if len(batch) == BATCH:
+                    history.record_many(batch)
+                    batch = []
+        history.record_many(batch)
+        deliveries = history.stats()["deliveries"]
+        print(f"setup     {deliveries} deliveries archived in {time.perf_counter() - started:.1f}s")
+
+        last_date = start + timedelta(days=days - 1)
+        started = time.perf_counter()
+        columns = history.nutrient_columns(start, last_date)
+        loaded = time.perf_counter()
+        daily = daily_totals(columns, days)
+        goals = np.array([calories[email] for email in columns["emails"]], dtype=np.float64)
+        targets = targets_for(goals)
+        results = aggregate(daily, targets)
+        aggregated = time.perf_counter()
+        print(f"load      {len(columns['emails'])} subscribers, {len(columns['subscriber'])} deliveries, "
+              f"{len(columns['meals'])} plans from SQLite in {loaded - started:.2f}s")
+        print(f"aggregate numpy {aggregated - loaded:.3f}s ({daily.nbytes / 2 ** 20:.1f} MiB of day totals)")
+
+        started = time.perf_counter()
+        reference = _python_reference(columns, days, goals.tolist())
+        python_seconds = time.perf_counter() - started
+        expected_totals = np.array([totals for _, totals, _, _ in reference], dtype=np.float64)
+        expected_trend = np.array([trend for _, _, trend, _ in reference])
+        if not (np.array_equal(results["days_logged"], [logged for logged, _, _, _ in reference])
+                and np.allclose(results["totals"], expected_totals)
+                and np.allclose(results["kcal_trend"], expected_trend, equal_nan=True, atol=1e-6)
+                and np.array_equal(results["on_target_days"], [on_target for _, _, _, on_target in reference])):
+            print("✗ numpy aggregation differs from the per-delivery reference")
+            sys.exit(1)
+        print(f"          per-delivery Python {python_seconds:.2f}s ({python_seconds / (aggregated - loaded):.0f}x slower)")
+
+        started = time.perf_counter()
+        report = weekly_report(last_date, history, preferences, days)
+        print(f"report    weekly_report() end to end in {time.perf_counter() - started:.2f}s: "
+              + ", ".join(f"{name} {value:.2f}" if isinstance(value, float) else f"{name} {value}"
+                          for name, value in report.summary().items()))
+
+        sample = min(len(report), 2000)
+        started = time.perf_counter()
+        size = sum(len(digest_message(report, row)) for row in range(sample))
+        elapsed = time.perf_counter() - started
+        print(f"render    {sample / elapsed:.0f} digests/s, {size / sample / 1024:.1f} KiB per message")
+
+if __name__ == "__main__":
+    main(subscribers=int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
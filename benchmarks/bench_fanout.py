@@ -0,0 +1,29 @@
+import sys
+import time
+
+from benchmarks.stubs import StubAgent
+from fanout import run_fanout
+from plan_cache import PlanCache
+from subscribers import merge_preferences
+
+def main(count=200, latency=0.2, workers=(1, 8, 32)):
+    """Compare serial vs pooled fan-out against a stubbed agent and no-op delivery.
+
+    Subscribers cycle through five calorie targets, so the plan cache (in a
+    throwaway in-memory store) collapses the batch to five LLM calls.
+    """
+    subscribers = [
+        {"email": f"user{i}@example.com", "preferences": merge_preferences({"calories_per_day": 1600 + (i % 5) * 100})}
+        for i in range(count)
+    ]
+    deliver = lambda diet_plan, receiver, preferences: True
+    for max_workers in workers:
+        agent = StubAgent(latency=latency)
+        for cache in (False, PlanCache(":memory:")):
+            stats = run_fanout(subscribers, agent_instance=agent, max_workers=max_workers, deliver=deliver, cache=cache)
+            label = "cached" if cache else "uncached"
+            print(f"workers={max_workers:<3} {label:<8} {stats['throughput_per_s']:8.2f} plans/s  elapsed {stats['elapsed_s']:.2f}s  LLM calls {agent.calls}")
+            agent.calls = 0
+
+if __name__ == "__main__":
+    main(count=int(sys.argv[1]) if len(sys.argv) > 1 else 200)
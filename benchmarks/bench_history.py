@@ -0,0 +1,96 @@
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import config
+from benchmarks.corpus import synthetic_plan
+from fanout import percentile
+from plan_history import PlanHistory
+
+BATCH = 10000
+
+def _latencies(operation, arguments):
+    timings = []
+    for argument in arguments:
+        started = time.perf_counter()
+        operation(*argument)
+        timings.append((time.perf_counter() - started) * 1e6)
+    return f"p50 {percentile(timings, 50):7.1f} us, p99 {percentile(timings, 99):7.1f} us"
+
+def main(count=1_000_000, days=20, subscribers_per_plan=1):
+    """Insert `count` deliveries into a fresh plan history, then time lookups and retention at that size.
+
+    Profiles get one plan per day for `days` days; `subscribers_per_plan`
+    subscribers share each plan, so `count / subscribers_per_plan` plans are stored.
+    """
+    templates = [synthetic_plan(seed, lines_per_meal=3) for seed in range(2000)]
+    profiles = max(1, count // (days * subscribers_per_plan))
+    start = date(2026, 1, 1)
+    preferences = [dict(config.DIETARY_PREFERENCES, calories_per_day=1200 + number % 1500,
+                        diet_type=("balanced", "vegetarian", "vegan", "keto")[number // 1500 % 4],
+                        excluded_foods=[f"food{number // 6000}"] if number >= 6000 else [])
+                   for number in range(profiles)]
+
+    def deliveries():
+        produced = 0
+        for offset in range(days):
+            plan_date = start + timedelta(days=offset)
+            for number in range(profiles):
+                # A distinct first line makes every profile-day a distinct plan
+                plan = f"Menu {number}/{offset}\n" + templates[(number * 7 + offset) % len(templates)]
+                for subscriber in range(subscribers_per_plan):
+                    yield f"user{number}.{subscriber}@example.com", plan_date, plan, preferences[number]
+                    produced += 1
+                    if produced == count:
+                        return
+
+    with tempfile.TemporaryDirectory() as directory, PlanHistory(os.path.join(directory, "history.db")) as history:
+        started = batch_started = time.perf_counter()
+        batch = []
+        inserted = 0
+        for delivery in deliveries():
+            batch.append(delivery)
+            if len(batch) == BATCH:
+                history.record_many(batch)
+                inserted += len(batch)
+                batch = []
+                if inserted % (count // 10 or BATCH) < BATCH:
+                    now = time.perf_counter()
+                    print(f"  {inserted:>9} stored, {BATCH / (now - batch_started):8.0f} inserts/s in the last batch")
+                batch_started = time.perf_counter()
+        history.record_many(batch)
+        elapsed = time.perf_counter() - started
+        stats = history.stats()
+        print(f"insert   {count} deliveries ({stats['plans']} plans, {stats['dishes']} dish names) in {elapsed:.1f}s, "
+              f"{count / elapsed:.0f}/s")
+        print(f"size     {stats['size_bytes'] / 2 ** 20:.1f} MiB, {stats['size_bytes'] / stats['plans']:.0f} bytes per plan "
+              f"(plan text averages {sum(map(len, templates)) / len(templates):.0f} bytes)")
+
+        rng = random.Random(0)
+        last_day = min(days, -(-count // (profiles * subscribers_per_plan))) - 1
+        samples = [rng.randrange(profiles) for _ in range(10000)]
+        tracemalloc.start()
+        print("plan_for " + _latencies(history.plan_for, [
+            (f"user{number}.0@example.com", start + timedelta(days=rng.randrange(last_day + 1))) for number in samples
+        ]))
+        print("recent   " + _latencies(history.recent_dishes, [
+            (preferences[number], start + timedelta(days=last_day + 1)) for number in samples
+        ]))
+        read = sum(1 for _ in history.iter_deliveries(start + timedelta(days=last_day)))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"memory   {peak / 2 ** 20:.1f} MiB peak Python allocations for the lookups and streaming {read} deliveries, "
+              f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB max RSS")
+
+        started = time.perf_counter()
+        pruned = history.prune(retention_days=days // 2, keep_text_days=days // 4, today=start + timedelta(days=days))
+        print(f"prune    {pruned['dropped']} dropped, {pruned['compacted']} compacted in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main(count=int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+         subscribers_per_plan=int(sys.argv[2]) if len(sys.argv) > 2 else 1)
@@ -0,0 +1,42 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stubs import FlakyAgent
+from fanout import percentile
+from llm_client import LLMClient
+
+def _drive(run, count, workers):
+    latencies, failures = [], 0
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            run("Create a healthy diet menu for today")
+        except Exception:
+            return None
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for latency in pool.map(one, range(count)):
+            if latency is None:
+                failures += 1
+            else:
+                latencies.append(latency)
+    return latencies, failures
+
+def main(count=400, workers=16):
+    """Raw agent vs resilient client against a fake model with errors, 429s and a slow tail"""
+    raw = FlakyAgent(seed=1)
+    latencies, failures = _drive(raw.run, count, workers)
+    print(f"raw agent      failures {failures:4d}  p50 {percentile(latencies, 50):.3f}s  p99 {percentile(latencies, 99):.3f}s")
+
+    for label, hedge_after in (("retries only", 0), ("retries+hedge", 0.15)):
+        fake = FlakyAgent(seed=1)
+        client = LLMClient(lambda: fake, timeout=5, max_retries=3, backoff_base=0.02, backoff_max=0.2,
+                           requests_per_minute=0, tokens_per_minute=0, breaker_threshold=0, hedge_after=hedge_after)
+        latencies, failures = _drive(client.run, count, workers)
+        print(f"{label:<14} failures {failures:4d}  p50 {percentile(latencies, 50):.3f}s  p99 {percentile(latencies, 99):.3f}s  {client.stats}")
+
+if __name__ == "__main__":
+    main(count=int(sys.argv[1]) if len(sys.argv) > 1 else 400)
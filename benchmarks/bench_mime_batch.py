@@ -0,0 +1,82 @@
+import email
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email import policy
+
+import mime_batch
+import nutrition_agent
+from benchmarks.corpus import load_corpus
+from benchmarks.smtp_sink import SMTPSink
+from smtp_pool import SMTPConnectionPool
+from subscribers import merge_preferences
+
+DATE = "Monday, May 04, 2026"
+SENDER = "sender@example.com"
+
+def _per_recipient(jobs):
+    """What delivery did before: a full MIME build and serialization per recipient"""
+    return [nutrition_agent.build_message(plan, receiver, preferences, DATE, message_id).as_bytes(policy=policy.SMTP)
+            for receiver, plan, preferences, message_id in jobs]
+
+def _shared(jobs):
+    mime_batch._encode.cache_clear()
+    return [mime_batch.render_message(plan, receiver, preferences, DATE, message_id)
+            for receiver, plan, preferences, message_id in jobs]
+
+def _pooled(sink, messages, size):
+    with SMTPConnectionPool("127.0.0.1", sink.port, SENDER, "password", size=size, use_ssl=False, max_per_second=0) as pool:
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            list(executor.map(lambda message: pool.sendmail(SENDER, *message), messages))
+
+def _batched(sink, messages, size):
+    with SMTPConnectionPool("127.0.0.1", sink.port, SENDER, "password", size=size, use_ssl=False, max_per_second=0) as pool:
+        failures = [result for result in pool.send_many(SENDER, messages) if result is not None]
+    if failures:
+        print(f"✗ {len(failures)} messages failed, first: {failures[0]!r}")
+        sys.exit(1)
+
+def main(count=1000, plans=10, round_trip_delay=0.002, size=3):
+    """Encode `count` emails sharing `plans` distinct plans, then send them to a local sink with `round_trip_delay` latency"""
+    corpus = load_corpus()
+    jobs = [
+        (f"user{i}@example.com", corpus[i % plans], merge_preferences({"calories_per_day": 1500 + i % plans * 50}),
+         f"<{i}@nutrition-agent>")
+        for i in range(count)
+    ]
+
+    started = time.perf_counter()
+    before = _per_recipient(jobs)
+    per_recipient = time.perf_counter() - started
+    started = time.perf_counter()
+    messages = _shared(jobs)
+    shared = time.perf_counter() - started
+    # Same headers (but the boundary) and decoded parts as the full build, with CRLF line endings throughout
+    old, new = email.message_from_bytes(before[-1]), email.message_from_bytes(messages[-1])
+    same_headers = sorted(old.items())[1:] == sorted(new.items())[1:] and old.get_content_type() == new.get_content_type()
+    same_parts = all(old.get_payload(i).get_payload(decode=True) ==
+                     new.get_payload(i).get_payload(decode=True).replace(b"\r\n", b"\n") for i in range(2))
+    if not (same_headers and same_parts) or b"\n" in messages[-1].replace(b"\r\n", b""):
+        print("✗ Shared-body messages differ from build_message")
+        sys.exit(1)
+    print(f"encode   per recipient {count / per_recipient:8.0f} msg/s, shared body {count / shared:8.0f} msg/s "
+          f"({per_recipient / shared:.0f}x, {plans} distinct bodies, {sum(map(len, messages)) / count / 1024:.1f} KiB per message)")
+
+    deliveries = [(receiver, message) for (receiver, *_), message in zip(jobs, messages)]
+    for pipelining in (True, False):
+        with SMTPSink(round_trip_delay=round_trip_delay, pipelining=pipelining) as sink:
+            results = []
+            for name, send in (("sendmail", _pooled), ("send_many", _batched)):
+                received = sink.messages
+                started = time.perf_counter()
+                send(sink, deliveries, size)
+                elapsed = time.perf_counter() - started
+                if sink.messages - received != count:
+                    print(f"✗ sink received {sink.messages - received} of {count} messages")
+                    sys.exit(1)
+                results.append(f"{name} {count / elapsed:7.0f} msg/s")
+        label = "pipelined" if pipelining else "no PIPELINING"
+        print(f"deliver  {label:14} pool size={size}, {round_trip_delay * 1000:.0f} ms per round trip: {', '.join(results)}")
+
+if __name__ == "__main__":
+    main(count=int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,103 @@
+import re
+import sys
+import timeit
+
+import nutrition_agent
+from benchmarks.corpus import load_corpus
+
+def legacy_process_diet_content(diet_text):
+    """The original per-line parser, kept verbatim as the reference for output and speed"""
+    sections = {}
+    current_section = "General"
+    lines = []
+    for line in diet_text.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        header_match = re.match(r'^(BREAKFAST|LUNCH|DINNER|SNACK|MORNING SNACK|EVENING SNACK|HYDRATION|WATER).*$', line.upper())
+        if header_match:
+            current_section = line
+            sections[current_section] = []
+        else:
+            if current_section in sections:
+                sections[current_section].append(line)
+            else:
+                lines.append(line)
+    if not sections:
+        return f"<p>{diet_text.replace(chr(10), '<br>')}</p>"
+    html = ""
+    for section, content in sections.items():
+        icon = "🍳"
+        if "BREAKFAST" in section.upper():
+            icon = "🍳"
+        elif "LUNCH" in section.upper():
+            icon = "🍛"
+        elif "DINNER" in section.upper():
+            icon = "🍽️"
+        elif "SNACK" in section.upper():
+            icon = "🥜"
+        elif "HYDRATION" in section.upper() or "WATER" in section.upper():
+            icon = "💧"
+        html += f"""
+        <div class="meal-section">
+            <h2><span class="meal-icon">{icon}</span> {section}</h2>
+            <div class="meal-content">
+        """
+        for line in content:
+            calorie_match = re.search(r'(\d+)\s*(?:kcal|calories|cal)', line, re.IGNORECASE)
+            macro_match = re.search(r'(?:protein|proteins|carbs|carbohydrates|fiber|fibre)[^\d]*(\d+).*g', line, re.IGNORECASE)
+            macro_full_match = re.search(r'protein:?\s*(\d+)\s*g.*carbs?:?\s*(\d+)\s*g.*fiber:?\s*(\d+)\s*g', line, re.IGNORECASE)
+            if macro_full_match:
+                protein = macro_full_match.group(1)
+                carbs = macro_full_match.group(2)
+                fiber = macro_full_match.group(3)
+                html += f"""
+                <div class="macro-box">
+                    <div class="macro-item">
+                        <span class="macro-icon">🥩</span>
+                        <span class="macro-label">Protein</span>
+                        <span class="macro-value">{protein}g</span>
+                    </div>
+                    <div class="macro-item">
+                        <span class="macro-icon">🍚</span>
+                        <span class="macro-label">Carbs</span>
+                        <span class="macro-value">{carbs}g</span>
+                    </div>
+                    <div class="macro-item">
+                        <span class="macro-icon">🌱</span>
+                        <span class="macro-label">Fiber</span>
+                        <span class="macro-value">{fiber}g</span>
+                    </div>
+                </div>
+                """
+            elif calorie_match:
+                calorie_count = calorie_match.group(1)
+                html += f'<div class="calorie-info">{calorie_count} calories</div>'
+            elif "tip" in line.lower() or "prepare" in line.lower() or "cook" in line.lower():
+                html += f'<div class="prep-tip"><span class="tip-icon">💡</span> {line}</div>'
+            else:
+                html += f'<p>{line}</p>'
+        html += """
+            </div>
+        </div>
+        """
+    return html
+
+def main(repeat=200):
+    """Check byte-identical output on the corpus, then time legacy vs current parsing"""
+    corpus = load_corpus()
+    mismatches = [i for i, text in enumerate(corpus)
+                  if legacy_process_diet_content(text) != nutrition_agent.process_diet_content(text)]
+    if mismatches:
+        print(f"✗ Output differs from the legacy parser for corpus entries {mismatches}")
+        sys.exit(1)
+    print(f"✓ Identical HTML for all {len(corpus)} corpus entries")
+
+    legacy = min(timeit.repeat(lambda: [legacy_process_diet_content(t) for t in corpus], number=repeat, repeat=3))
+    current = min(timeit.repeat(lambda: [nutrition_agent.process_diet_content(t) for t in corpus], number=repeat, repeat=3))
+    plans = repeat * len(corpus)
+    print(f"legacy   {plans / legacy:10.0f} plans/s")
+    print(f"current  {plans / current:10.0f} plans/s  ({legacy / current:.2f}x)")
+
+if __name__ == "__main__":
+    main(repeat=int(sys.argv[1]) if len(sys.argv) > 1 else 200)
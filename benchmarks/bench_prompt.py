@@ -0,0 +1,97 @@
+
+import config
+import prompt_builder
+from benchmarks.corpus import load_corpus
+from plan_history import dish_names
+from subscribers import merge_preferences
+
+DATE = "Monday, May 04, 2026"
+
+LEGACY_TEXT_OUTPUT_INSTRUCTIONS = """
+    output format:
+        1.and it shouldnt contain any comments or markdown language make it more readable and userfriendly and presentable.
+        2.make sure no special characters included
+        3.no introduction and conclusion needed.
+        4. Format the response in a clean, organized way with clear section headers.
+        5. For macros, use format like "Protein: 25g | Carbs: 30g | Fiber: 5g" after each meal description.
+    """
+
+LEGACY_JSON_OUTPUT_INSTRUCTIONS = """
+    output format:
+        Respond with a single JSON object and nothing else, no markdown fences or commentary, matching:
+        {"meals": [{"name": "Breakfast", "items": [{"name": "Ragi dosa with coconut chutney", "kcal": 300}],
+                    "kcal": 420, "protein": 14, "carbs": 62, "fiber": 8,
+                    "tips": ["Ferment the batter overnight"]}],
+         "hydration": ["Drink 8 to 10 glasses of water"],
+         "tips": ["General advice for the day"]}
+        Use meal names Breakfast, Morning Snack, Lunch, Evening Snack and Dinner.
+        kcal, protein, carbs and fiber are whole numbers; protein, carbs and fiber are in grams.
+    """
+
+def legacy_build_prompt(preferences, current_date, avoid_dishes=None, structured=False):
+    """The original indented prompt, kept verbatim as the reference for token counts"""
+    allergies_str = ", ".join(preferences["allergies"]) if preferences["allergies"] else "None"
+    excluded_foods_str = ", ".join(preferences["excluded_foods"]) if preferences["excluded_foods"] else "None"
+    
+    prompt = f"""
+    Act as a certified nutritionist and diet expert. Create a healthy diet menu for today, {current_date}.
+    
+    Dietary preferences:
+    - Diet type: {preferences['diet_type']}
+    - Target daily calories: {preferences['calories_per_day']}
+    - Allergies to avoid: {allergies_str}
+    - Foods to exclude: {excluded_foods_str}
+    - Meal complexity: {preferences['meal_complexity']}
+    - Protein focus: {preferences['protein_focus']}
+    
+    The menu should:
+    1. Include tamilnadu stylebreakfast, lunch, dinner, and 2 healthy snacks
+    2. Be nutritionally balanced with appropriate macros
+    3. Focus on whole foods and be suitable for weight management
+    4. Include approximate calorie counts for each meal
+    5. Include preparation tips for each meal
+    6. Suggest hydration throughout the day
+    7. For each meal, provide macro information: protein, carbs, and fiber content in grams
+   """
+    if avoid_dishes:
+        prompt += f""" 8. Do not repeat these recently served dishes: {"; ".join(avoid_dishes)}
+   """
+    return prompt + (LEGACY_JSON_OUTPUT_INSTRUCTIONS if structured else LEGACY_TEXT_OUTPUT_INSTRUCTIONS)
+
+def prompt_cases():
+    """(name, preferences, avoid_dishes, structured) for the prompts the service sends most"""
+    recent = sorted({dish for plan in load_corpus()[:5] for dish in dish_names(plan)})[:config.PLAN_HISTORY_AVOID_MAX]
+    restricted = merge_preferences({"diet_type": "vegetarian", "calories_per_day": 1600, "allergies": ["peanut", "dairy"],
+                                    "excluded_foods": ["mushroom", "brinjal"], "protein_focus": "high"})
+    return [
+        ("default", merge_preferences(), None, False),
+        ("restricted", restricted, None, False),
+        ("with history", merge_preferences(), recent, False),
+        ("json", merge_preferences(), None, True),
+        ("json with history", restricted, recent, True),
+    ]
+
+def build_case(preferences, avoid_dishes, structured):
+    saved = config.STRUCTURED_PLAN_OUTPUT
+    config.STRUCTURED_PLAN_OUTPUT = structured
+    try:
+        return prompt_builder.build_prompt(preferences, DATE, avoid_dishes)
+    finally:
+        config.STRUCTURED_PLAN_OUTPUT = saved
+
+def main():
+    """Token counts per prompt, before and after compaction, and how much of each is the shared prefix"""
+    print(f"tokenizer: {prompt_builder.tokenizer_name()}")
+    print(f"{'prompt':18} {'legacy':>7} {'now':>5} {'saved':>6} {'prefix':>7} {'suffix':>7}")
+    legacy_total = total = 0
+    for name, preferences, avoid_dishes, structured in prompt_cases():
+        legacy = prompt_builder.count_tokens(legacy_build_prompt(preferences, DATE, avoid_dishes, structured))
+        report = prompt_builder.token_report(build_case(preferences, avoid_dishes, structured))
+        legacy_total += legacy
+        total += report["tokens"]
+        print(f"{name:18} {legacy:7} {report['tokens']:5} {1 - report['tokens'] / legacy:6.0%} "
+              f"{report['prefix_tokens']:7} {report['suffix_tokens']:7}")
+    print(f"{'total':18} {legacy_total:7} {total:5} {1 - total / legacy_total:6.0%}")
+
+if __name__ == "__main__":
+    main()
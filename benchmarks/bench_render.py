@@ -0,0 +1,50 @@
+import sys
+import time
+
+import config
+import nutrition_agent
+from benchmarks.bench_parse import legacy_process_diet_content
+from benchmarks.corpus import load_corpus
+from subscribers import merge_preferences
+
+def legacy_get_html_template(current_date, diet_plan, preferences):
+    """Per-message rendering as before: legacy parser plus rebuilding the whole shell"""
+    diet_content = legacy_process_diet_content(diet_plan)
+    calories = preferences['calories_per_day']
+    values = {
+        "current_date": current_date,
+        "calories": str(calories),
+        "protein_target": str(int(calories * 0.25 / 4)),
+        "carbs_target": str(int(calories * 0.5 / 4)),
+        "diet_content": diet_content,
+        "diet_type": preferences['diet_type'].title(),
+    }
+    shell = nutrition_agent._render_shell(config.EMAIL_COLOR_PRIMARY, config.EMAIL_COLOR_SECONDARY)
+    return nutrition_agent._SLOT_RE.sub(lambda match: values[match.group(1)], shell)
+
+def _time(render, jobs):
+    started = time.perf_counter()
+    for current_date, diet_plan, preferences in jobs:
+        render(current_date, diet_plan, preferences)
+    return time.perf_counter() - started
+
+def main(count=10000):
+    """Render `count` emails per-message vs with the cached shell and list-built content"""
+    corpus = load_corpus()
+    jobs = [
+        ("Monday, May 04, 2026", corpus[i % len(corpus)], merge_preferences({"calories_per_day": 1500 + i % 900}))
+        for i in range(count)
+    ]
+    for current_date, diet_plan, preferences in jobs[:len(corpus)]:
+        if legacy_get_html_template(current_date, diet_plan, preferences) != nutrition_agent.get_html_template(current_date, diet_plan, preferences):
+            print("✗ Cached template output differs from per-message rendering")
+            sys.exit(1)
+    print(f"✓ Identical HTML for {len(corpus)} corpus plans")
+
+    before = _time(legacy_get_html_template, jobs)
+    after = _time(nutrition_agent.get_html_template, jobs)
+    print(f"before  {count / before:9.0f} emails/s  ({before:.2f}s for {count})")
+    print(f"after   {count / after:9.0f} emails/s  ({after:.2f}s for {count}, {before / after:.2f}x)")
+
+if __name__ == "__main__":
+    main(count=int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,83 @@
+import random
+import sys
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from subscribers import merge_preferences
+from timer_scheduler import DeliveryScheduler, TimerScheduler, next_daily_run
+
+TIMEZONES = ["Asia/Kolkata", "Europe/London", "America/New_York", "Australia/Sydney", "America/Los_Angeles"]
+
+class FakeClock:
+    """Deterministic clock: sleeping just advances time"""
+
+    def __init__(self, start):
+        self.now = start
+        self.slept = 0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += 1
+        self.now += seconds
+
+def main(count=10000, days=2):
+    """Simulate `days` of per-subscriber, timezone-aware sends on a fake clock"""
+    rng = random.Random(7)
+    subscribers = [
+        {
+            "email": f"user{i}@example.com",
+            "preferences": merge_preferences(),
+            "send_time": f"{rng.randrange(5, 9):02d}:{rng.choice([0, 15, 30, 45]):02d}",
+            "timezone": rng.choice(TIMEZONES),
+        }
+        for i in range(count)
+    ]
+    clock = FakeClock(datetime(2026, 3, 7, 0, 0, tzinfo=ZoneInfo("UTC")).timestamp())
+    lateness = []
+
+    def dispatch(callback, due):
+        lateness.append(clock.time() - due)
+        callback(due)
+
+    timer = TimerScheduler(clock=clock.time, sleep=clock.sleep, dispatch=dispatch)
+    delivered = set()
+    warm = set()
+    pregenerated = set()
+
+    def deliver(members, plan_date):
+        for member in members:
+            delivered.add((member["email"], plan_date))
+            if (member["send_time"], member["timezone"], plan_date) in pregenerated:
+                warm.add((member["email"], plan_date))
+
+    def pregenerate(members, plan_date):
+        pregenerated.add((members[0]["send_time"], members[0]["timezone"], plan_date))
+
+    scheduler = DeliveryScheduler(timer, lambda: subscribers, deliver, pregenerate, lead_minutes=30)
+
+    started = time.perf_counter()
+    groups = scheduler.start()
+    timer.run_until(clock.time() + days * 86400)
+    elapsed = time.perf_counter() - started
+
+    expected = count * days
+    print(f"{count} subscribers in {groups} (send time, timezone) groups over {days} simulated days")
+    print(f"deliveries {len(delivered)}/{expected}, {len(warm)} pregenerated ahead, "
+          f"max lateness {max(lateness):.3f}s, wake-ups {clock.slept}")
+    print(f"simulated in {elapsed:.2f}s of real time")
+    if len(delivered) != expected or max(lateness) > 0:
+        sys.exit(1)
+
+    # The send time holds across the US spring-forward on 8 March 2026
+    before = datetime(2026, 3, 7, 5, tzinfo=ZoneInfo("UTC")).timestamp()
+    first = next_daily_run("06:00", "America/New_York", before)
+    second = next_daily_run("06:00", "America/New_York", first)
+    print("DST check:", datetime.fromtimestamp(first, ZoneInfo("America/New_York")).strftime("%a %H:%M %Z"),
+          "->", datetime.fromtimestamp(second, ZoneInfo("America/New_York")).strftime("%a %H:%M %Z"),
+          f"({(second - first) / 3600:.0f}h apart)")
+
+if __name__ == "__main__":
+    main(count=int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
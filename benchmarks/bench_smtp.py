@@ -0,0 +1,44 @@
+import smtplib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import nutrition_agent
+from benchmarks.smtp_sink import SMTPSink
+from benchmarks.stubs import SAMPLE_PLAN
+from smtp_pool import SMTPConnectionPool
+
+def _per_message(sink, messages):
+    """What send_email does without a pool: connect, login, send, quit"""
+    for receiver, body in messages:
+        with smtplib.SMTP("127.0.0.1", sink.port) as server:
+            server.login("sender@example.com", "password")
+            server.sendmail("sender@example.com", receiver, body)
+
+def _pooled(sink, messages, size):
+    with SMTPConnectionPool("127.0.0.1", sink.port, "sender@example.com", "password",
+                            size=size, use_ssl=False, max_per_second=0) as pool:
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            list(executor.map(lambda m: pool.sendmail("sender@example.com", m[0], m[1]), messages))
+        return pool.connections_opened
+
+def main(count=200, connect_delay=0.02, login_delay=0.01):
+    """Compare per-message connections with pooled delivery against a local sink"""
+    messages = [
+        (f"user{i}@example.com", nutrition_agent.build_message(SAMPLE_PLAN, f"user{i}@example.com").as_string())
+        for i in range(count)
+    ]
+    with SMTPSink(connect_delay, login_delay) as sink:
+        started = time.perf_counter()
+        _per_message(sink, messages)
+        elapsed = time.perf_counter() - started
+        print(f"per-message   {count / elapsed:8.1f} msg/s  ({elapsed:.2f}s, {count} connections)")
+        for size in (1, 3, 8):
+            started = time.perf_counter()
+            opened = _pooled(sink, messages, size)
+            elapsed = time.perf_counter() - started
+            print(f"pooled size={size} {count / elapsed:8.1f} msg/s  ({elapsed:.2f}s, {opened} connections)")
+        print(f"sink received {sink.messages} messages")
+
+if __name__ == "__main__":
+    main(count=int(sys.argv[1]) if len(sys.argv) > 1 else 200)
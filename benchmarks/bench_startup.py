@@ -0,0 +1,76 @@
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+# What `import nutrition_agent` used to pull in before imports were made lazy
+EAGER = "import nutrition_agent, llm_client, smtplib, ssl, email.mime.multipart, agno.agent, agno.models.groq"
+TARGETS = [
+    ("import nutrition_agent", "import nutrition_agent"),
+    ("render one email", "import nutrition_agent; nutrition_agent.get_html_template('today', 'BREAKFAST:\\n- Oats 300 kcal')"),
+    ("import delivery_queue", "import delivery_queue"),
+    ("eager (agno + SMTP)", EAGER),
+]
+
+def _run(code, importtime=False):
+    command = [sys.executable, *(["-X", "importtime"] if importtime else []), "-c", code]
+    return subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True)
+
+def import_profile(code, parent):
+    """Cumulative microseconds for each module imported directly by `parent` while running `code`.
+
+    Parsed from `python -X importtime`, which lists a module's imports (indented
+    one level deeper) before the module itself. Returns (direct imports, every
+    module imported).
+    """
+    children = {}
+    pending = {}
+    everything = set()
+    for line in _run(code, importtime=True).stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        depth, module = len(match.group(3)), match.group(4)
+        everything.add(module)
+        if depth == 3:
+            pending[module] = int(match.group(2))
+        elif depth == 1:
+            if module == parent:
+                children = pending
+            pending = {}
+    return children, everything
+
+def wall_time(code, runs):
+    """Median wall-clock seconds for a fresh interpreter to run `code`"""
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        _run(code)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+def main(runs=7):
+    baseline = wall_time("pass", runs)
+    print(f"{'interpreter only':24} {baseline * 1000:7.1f} ms")
+    results = {}
+    for label, code in TARGETS:
+        results[label] = wall_time(code, runs)
+        print(f"{label:24} {results[label] * 1000:7.1f} ms  (+{(results[label] - baseline) * 1000:.1f} ms over the interpreter)")
+    lazy, eager = results["import nutrition_agent"] - baseline, results["eager (agno + SMTP)"] - baseline
+    print(f"Lazy import costs {lazy / eager:.0%} of the eager import")
+
+    print("Heaviest imports behind `import nutrition_agent`:")
+    direct, everything = import_profile("import nutrition_agent", "nutrition_agent")
+    for module, micros in sorted(direct.items(), key=lambda item: -item[1])[:8]:
+        print(f"  {module:28} {micros / 1000:7.1f} ms")
+    if any(module.split(".")[0] in ("agno", "groq", "smtplib", "tiktoken") for module in everything):
+        print("✗ nutrition_agent imports the model SDK, tiktoken or smtplib at load time")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(runs=int(sys.argv[1]) if len(sys.argv) > 1 else 7)
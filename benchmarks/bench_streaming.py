@@ -0,0 +1,54 @@
+import sys
+import time
+
+import config
+import nutrition_agent
+from benchmarks.corpus import SAMPLE_PLAN, synthetic_plan
+from benchmarks.stubs import StubAgent
+from llm_client import LLMClient
+from streaming import ConstraintViolation, stream_diet_plan
+
+def main(latency=1.0):
+    """Time from the last token to finished HTML, buffered vs streamed, and tokens saved by early abort"""
+    plan = synthetic_plan(0, lines_per_meal=12)
+    agent = StubAgent(latency=latency, content=plan)
+    client = LLMClient(lambda: agent, hedge_after=0, requests_per_minute=0, tokens_per_minute=0)
+
+    started = time.perf_counter()
+    text = client.run(nutrition_agent.build_prompt()).content
+    generated = time.perf_counter()
+    html = nutrition_agent.process_diet_content(text)
+    buffered_tail = time.perf_counter() - generated
+    print(f"buffered  total {time.perf_counter() - started:.3f}s, HTML ready {buffered_tail * 1000:.2f} ms after the last token")
+
+    last_token = []
+    stream = agent._stream
+
+    def timed_stream(content):
+        for event in stream(content):
+            last_token[:] = [time.perf_counter()]
+            yield event
+    agent._stream = timed_stream
+    started = time.perf_counter()
+    renderer = stream_diet_plan(None, client)
+    finished = time.perf_counter()
+    agent._stream = stream
+    if renderer.html != html:
+        print("✗ Streamed HTML differs from the buffered render")
+        sys.exit(1)
+    print(f"streamed  total {finished - started:.3f}s, HTML ready {(finished - last_token[0]) * 1000:.2f} ms after the last token")
+
+    agent.content = SAMPLE_PLAN
+    preferences = dict(config.DIETARY_PREFERENCES, allergies=["chickpea"])
+    started = time.perf_counter()
+    try:
+        stream_diet_plan(preferences, client)
+        print("✗ Stream with an allergen was not aborted")
+        sys.exit(1)
+    except ConstraintViolation as e:
+        consumed = SAMPLE_PLAN.index(e.line) + len(e.line)
+        print(f"aborted   after {time.perf_counter() - started:.3f}s at {consumed / len(SAMPLE_PLAN):.0%} of the plan "
+              f"({e.term!r}), saving ~{(len(SAMPLE_PLAN) - consumed) // 4} completion tokens")
+
+if __name__ == "__main__":
+    main(latency=float(sys.argv[1]) if len(sys.argv) > 1 else 1.0)
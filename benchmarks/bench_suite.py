@@ -0,0 +1,228 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import config
+import meal_library
+import mime_batch
+import nutrition_agent
+import plan_history
+import prompt_builder
+from benchmarks.bench_prompt import build_case, prompt_cases
+from benchmarks.corpus import corpus_by_size
+from benchmarks.smtp_sink import SMTPSink
+from benchmarks.stubs import ReplayAgent
+from plan_validator import validate_plan
+from structured_plan import parse_plan_json
+from subscribers import SubscriberRegistry
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DATE = "Monday, May 04, 2026"
+# Constraints the corpus never breaks, so validation measures the common all-clear path
+VALIDATION_PREFERENCES = dict(config.DIETARY_PREFERENCES, allergies=["shellfish", "soy"], excluded_foods=["mushroom"])
+
+def _calibrate(seconds=0.05):
+    """Rate of a fixed pure-Python workload, used to compare runs across machines"""
+    words = [f"line {i} protein {i % 40}g" for i in range(200)]
+    done = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        sorted(word.upper() for word in words)
+        done += 1
+    return done / (time.perf_counter() - started)
+
+def _rate(operation, inputs, min_seconds):
+    done = 0
+    started = time.perf_counter()
+    while True:
+        for item in inputs:
+            operation(item)
+        done += len(inputs)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return done / elapsed
+
+def _throughput(operation, inputs, min_seconds, repeats=5):
+    """Median operations per second over `repeats`, and the median of each repeat's rate relative
+    to the calibration workload run right before and after it.
+
+    Pairing every repeat with its own calibration cancels out the machine
+    speeding up or slowing down during the run (frequency scaling, noisy
+    neighbours), and the median ignores the odd repeat that was interrupted.
+    """
+    rates, scores = [], []
+    for _ in range(repeats):
+        before = _calibrate()
+        rate = _rate(operation, inputs, min_seconds)
+        rates.append(rate)
+        scores.append(rate / ((before + _calibrate()) / 2))
+    return statistics.median(rates), statistics.median(scores)
+
+def _peak_kib(operation, inputs):
+    """Largest peak of traced allocations for a single operation, in KiB"""
+    tracemalloc.start()
+    peak = 0
+    try:
+        for item in inputs:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            operation(item)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+def _parse(plan):
+    if plan.lstrip().startswith("{"):
+        return nutrition_agent.plan_to_sections(parse_plan_json(plan))
+    return nutrition_agent.parse_diet_content(plan)
+
+def _render(plan):
+    return nutrition_agent.get_html_template(DATE, plan, config.DIETARY_PREFERENCES)
+
+def _mime(plan):
+    # The first recipient of a plan pays for encoding its body; later ones only add headers
+    mime_batch._encode.cache_clear()
+    return mime_batch.render_message(plan, "user@example.com", config.DIETARY_PREFERENCES, DATE)
+
+def _validate(plan):
+    return validate_plan(plan, VALIDATION_PREFERENCES)
+
+def micro_benchmarks(min_seconds):
+    """parse / validate / render / mime throughput and peak memory for each corpus size"""
+    results = {}
+    for size, plans in corpus_by_size().items():
+        for stage, operation in (("parse", _parse), ("validate", _validate), ("render", _render), ("mime", _mime)):
+            ops_per_s, score = _throughput(operation, plans, min_seconds)
+            results[f"{stage}/{size}"] = {"ops_per_s": ops_per_s, "score": score, "peak_kib": _peak_kib(operation, plans)}
+    return results
+
+def job_benchmark(subscribers=200):
+    """The full `nutrition_job()` offline: replayed model output, real SMTP against a local sink"""
+    plans = [plan for group in corpus_by_size().values() for plan in group]
+    agent = ReplayAgent(plans)
+    saved = {name: getattr(config, name) for name in (
+        "SUBSCRIBERS_DB", "DELIVERY_QUEUE_DB", "PLAN_CACHE_DB", "MEAL_LIBRARY_DB", "PLAN_HISTORY_DB", "METRICS_TEXTFILE",
+        "SMTP_HOST", "SMTP_PORT", "SMTP_USE_SSL", "SMTP_MAX_PER_SECOND", "EMAIL_SENDER", "EMAIL_RECEIVER",
+        "VALIDATION_KCAL_TOLERANCE", "VALIDATION_MACRO_TOLERANCE",
+    )}
+    previous_agent = nutrition_agent._agent
+    with tempfile.TemporaryDirectory() as directory, SMTPSink() as sink:
+        config.SUBSCRIBERS_DB = os.path.join(directory, "subscribers.db")
+        config.DELIVERY_QUEUE_DB = os.path.join(directory, "delivery_queue.db")
+        config.PLAN_CACHE_DB = os.path.join(directory, "plan_cache.db")
+        config.MEAL_LIBRARY_DB = os.path.join(directory, "meal_library.db")
+        config.PLAN_HISTORY_DB = os.path.join(directory, "plan_history.db")
+        config.METRICS_TEXTFILE = os.path.join(directory, "metrics.prom")
+        config.SMTP_HOST, config.SMTP_PORT, config.SMTP_USE_SSL = "127.0.0.1", sink.port, False
+        config.SMTP_MAX_PER_SECOND, config.EMAIL_SENDER = 0, ""
+        # Replayed plans ignore the calorie targets: keep the checks running, but never repair
+        config.VALIDATION_KCAL_TOLERANCE = config.VALIDATION_MACRO_TOLERANCE = float("inf")
+        nutrition_agent._agent = agent
+        previous_library, meal_library._library = meal_library._library, None
+        previous_history, plan_history._history = plan_history._history, None
+        try:
+            with SubscriberRegistry() as registry:
+                for i in range(subscribers):
+                    # Distinct calorie targets so every subscriber needs its own generation
+                    registry.add_subscriber(f"user{i}@example.com", {"calories_per_day": 1200 + i})
+            before = _calibrate(0.2)
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                nutrition_agent.nutrition_job()
+            elapsed = time.perf_counter() - started
+            calibration = (before + _calibrate(0.2)) / 2
+            delivered = sink.messages
+        finally:
+            nutrition_agent._agent = previous_agent
+            if meal_library._library is not None:
+                meal_library._library.close()
+            meal_library._library = previous_library
+            if plan_history._history is not None:
+                plan_history._history.close()
+            plan_history._history = previous_history
+            for name, value in saved.items():
+                setattr(config, name, value)
+    if delivered != subscribers:
+        print(f"✗ nutrition_job delivered {delivered} of {subscribers} plans")
+        sys.exit(1)
+    return {"job/nutrition_job": {"ops_per_s": subscribers / elapsed, "score": subscribers / elapsed / calibration,
+                                  "model_calls": agent.calls}}
+
+def prompt_tokens():
+    """Counted tokens of representative plan prompts; deterministic, so any growth is a regression"""
+    results = {}
+    for name, preferences, avoid_dishes, structured in prompt_cases():
+        prompt = build_case(preferences, avoid_dishes, structured)
+        results[f"prompt/{name.replace(' ', '_')}"] = {
+            "tokens": prompt_builder.count_tokens(prompt),
+            "tokenizer": prompt_builder.tokenizer_name(),
+        }
+    return results
+
+def compare(results, baseline, tolerance):
+    """Regressions against the baseline: calibrated throughput or memory beyond `tolerance`,
+    or prompts longer than recorded"""
+    failures = []
+    for name, expected in baseline["results"].items():
+        actual = results.get(name)
+        if actual is None:
+            continue
+        if "tokens" in expected:
+            # Counts are only comparable under the same tokenizer
+            if actual["tokenizer"] == expected["tokenizer"] and actual["tokens"] > expected["tokens"]:
+                failures.append(f"{name}: {actual['tokens']} prompt tokens vs {expected['tokens']}")
+            continue
+        score, expected_score = actual["score"], expected["score"]
+        if score < expected_score * (1 - tolerance):
+            failures.append(f"{name}: {score / expected_score:.0%} of baseline throughput")
+        if "peak_kib" in expected and actual["peak_kib"] > expected["peak_kib"] * (1 + tolerance) + 1:
+            failures.append(f"{name}: peak memory {actual['peak_kib']:.1f} KiB vs {expected['peak_kib']:.1f} KiB")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline parse/validate/render/MIME, nutrition_job and prompt size benchmarks")
+    parser.add_argument("--seconds", type=float, default=0.3, help="minimum time per measurement")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed regression before failing")
+    parser.add_argument("--update-baseline", action="store_true", help=f"overwrite {os.path.basename(BASELINE_PATH)}")
+    parser.add_argument("--skip-job", action="store_true", help="only run the CPU-bound micro benchmarks")
+    args = parser.parse_args()
+
+    results = micro_benchmarks(args.seconds)
+    if not args.skip_job:
+        results.update(job_benchmark())
+    print(f"{'benchmark':24} {'ops/s':>10} {'peak KiB':>9}")
+    for name, result in results.items():
+        peak = f"{result['peak_kib']:9.1f}" if "peak_kib" in result else f"{'':9}"
+        print(f"{name:24} {result['ops_per_s']:10.0f} {peak}")
+    tokens = prompt_tokens()
+    for name, result in tokens.items():
+        print(f"{name:24} {result['tokens']:10} tokens ({result['tokenizer']})")
+    results.update(tokens)
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as handle:
+            json.dump({"results": results}, handle, indent=2, sort_keys=True)
+            handle.write("\n")
+        print(f"✓ Baseline written to {BASELINE_PATH}")
+        return
+    if not os.path.exists(BASELINE_PATH):
+        print("No baseline yet; run with --update-baseline to record one")
+        return
+    with open(BASELINE_PATH, encoding="utf-8") as handle:
+        failures = compare(results, json.load(handle), args.tolerance)
+    if failures:
+        for failure in failures:
+            print(f"✗ {failure}")
+        sys.exit(1)
+    print(f"✓ No regressions beyond {args.tolerance:.0%} of the baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import json
+import random
+
+# Recorded-style and synthetic LLM outputs used by the offline benchmarks.
+# They cover the formats seen in practice: upper-case headers, title-case
+# headers with times, inline calories, markdown leftovers, repeated headers
+# and plans with no recognizable headers at all.
+
+SAMPLE_PLAN = """BREAKFAST
+Ragi dosa with coconut chutney and sambar
+Calories: 420 kcal
+Protein: 14g | Carbs: 62g | Fiber: 8g
+Tip: Ferment the batter overnight for a lighter dosa
+
+MORNING SNACK
+Sundal made with boiled chickpeas and grated coconut
+Calories: 180 kcal
+Protein: 8g | Carbs: 24g | Fiber: 6g
+
+LUNCH
+Brown rice with drumstick sambar, beans poriyal and curd
+Calories: 620 kcal
+Protein: 22g | Carbs: 95g | Fiber: 11g
+Tip: Cook the poriyal with minimal oil and fresh curry leaves
+
+EVENING SNACK
+Buttermilk with a handful of roasted peanuts
+Calories: 200 kcal
+Protein: 9g | Carbs: 12g | Fiber: 3g
+
+DINNER
+Wheat chapati with mixed vegetable kurma
+Calories: 520 kcal
+Protein: 18g | Carbs: 70g | Fiber: 9g
+Tip: Prepare the kurma with a cashew paste instead of cream
+
+HYDRATION
+Drink 8 to 10 glasses of water spread through the day
+Start the morning with warm water and lemon"""
+
+
+TITLE_CASE_PLAN = """Breakfast (7:30 AM)
+Idli with tomato chutney and a small bowl of sambar - 350 kcal
+Protein: 12g, Carbs: 58g, Fiber: 6g
+Preparation tip: steam the idlis in a greased plate to avoid sticking
+
+Mid Morning
+A guava or an orange
+
+Lunch (1:00 PM)
+Millet pongal with vegetable kootu, 540 calories
+protein 20g carbs 80g fiber 10g
+Cook the kootu with moong dal for extra protein
+
+Snack (4:30 PM)
+Roasted chana, 150 cal
+
+Dinner (8:00 PM)
+Vegetable uttapam with mint chutney
+Approximately 450 Calories
+Protein: 16 g | Carbs: 66 g | Fiber: 7 g
+
+Water and Hydration
+Aim for 2.5 litres across the day"""
+
+MARKDOWN_PLAN = """**BREAKFAST**
+* Pesarattu (green gram dosa) with ginger chutney
+* 380 kcal
+* Protein: 18g | Carbs: 50g | Fiber: 9g
+
+**LUNCH**
+* Red rice, rasam, keerai masiyal and cucumber raita
+* 600 kcal
+* Protein: 19g | Carbs: 98g | Fiber: 12g
+* Tip: use a pressure cooker to keep the greens bright
+
+**DINNER**
+* Ragi kali with kathirikkai kuzhambu
+* 480 kcal
+* Protein: 14g | Carbs: 76g | Fiber: 11g"""
+
+REPEATED_HEADER_PLAN = """BREAKFAST
+Poha with peanuts
+300 kcal
+SNACK
+Apple slices
+90 kcal
+SNACK
+Sprouts salad
+Protein: 10g | Carbs: 20g | Fiber: 6g
+DINNER
+Chapati and dal
+Tip: prepare the dal earlier in the day"""
+
+UNSTRUCTURED_PLAN = """Start with warm water and lemon.
+Eat a light millet porridge in the morning, then a balanced thali for lunch.
+Keep dinner light and finish eating two hours before bed."""
+
+_DISHES = [
+    "Ragi dosa with coconut chutney", "Vegetable upma with sambar", "Kambu koozh with small onions",
+    "Brown rice with drumstick sambar", "Lemon rice with beans poriyal", "Curd rice with pomegranate",
+    "Chapati with channa masala", "Idiyappam with vegetable stew", "Adai with avial",
+    "Sundal with grated coconut", "Buttermilk with curry leaves", "Roasted makhana",
+]
+_HEADERS = ["BREAKFAST", "MORNING SNACK", "LUNCH", "EVENING SNACK", "DINNER"]
+
+def synthetic_plan(seed=0, lines_per_meal=4):
+    """A deterministic plan in the documented output format, `lines_per_meal` long per meal"""
+    rng = random.Random(seed)
+    blocks = []
+    for header in _HEADERS:
+        lines = [header]
+        for _ in range(lines_per_meal):
+            lines.append(f"{rng.choice(_DISHES)} prepared with fresh local vegetables")
+        lines.append(f"Calories: {rng.randrange(150, 700)} kcal")
+        lines.append(f"Protein: {rng.randrange(5, 30)}g | Carbs: {rng.randrange(15, 100)}g | Fiber: {rng.randrange(2, 14)}g")
+        lines.append(f"Tip: cook the {rng.choice(_DISHES).split()[0].lower()} with minimal oil")
+        blocks.append("\n".join(lines))
+    blocks.append("HYDRATION\nDrink 8 to 10 glasses of water spread through the day")
+    return "\n\n".join(blocks)
+
+def load_corpus(synthetic=20):
+    """Every recorded-style sample plus `synthetic` generated plans of growing size"""
+    corpus = [SAMPLE_PLAN, TITLE_CASE_PLAN, MARKDOWN_PLAN, REPEATED_HEADER_PLAN, UNSTRUCTURED_PLAN]
+    corpus.extend(synthetic_plan(seed, lines_per_meal=1 + seed % 8) for seed in range(synthetic))
+    return corpus
+
+def synthetic_json_plan(seed=0, items_per_meal=2):
+    """A deterministic plan in the structured JSON output format"""
+    rng = random.Random(seed)
+    meals = []
+    for header in _HEADERS:
+        meals.append({
+            "name": header.title(),
+            "items": [{"name": rng.choice(_DISHES), "kcal": rng.randrange(60, 350)} for _ in range(items_per_meal)],
+            "kcal": rng.randrange(150, 700),
+            "protein": rng.randrange(5, 30),
+            "carbs": rng.randrange(15, 100),
+            "fiber": rng.randrange(2, 14),
+            "tips": [f"Cook the {rng.choice(_DISHES).split()[0].lower()} with minimal oil"],
+        })
+    return json.dumps({"meals": meals, "hydration": ["Drink 8 to 10 glasses of water"], "tips": ["Eat slowly"]})
+
+def corpus_by_size():
+    """Plans grouped by shape for per-size throughput: recorded samples, typical, very long and JSON"""
+    return {
+        "small": [SAMPLE_PLAN, TITLE_CASE_PLAN, MARKDOWN_PLAN, REPEATED_HEADER_PLAN, UNSTRUCTURED_PLAN],
+        "medium": [synthetic_plan(seed, lines_per_meal=4) for seed in range(10)],
+        "large": [synthetic_plan(seed, lines_per_meal=40) for seed in range(5)],
+        "json": [synthetic_json_plan(seed, items_per_meal=1 + seed % 4) for seed in range(10)],
+    }
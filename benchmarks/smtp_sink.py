@@ -0,0 +1,106 @@
+import socketserver
+import threading
+import time
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough of RFC 5321 to accept, count and discard messages"""
+
+    def reply(self, line):
+        self.replies += line.encode("ascii") + b"\r\n"
+
+    def readline(self):
+        # Reads straight from the socket so every packet the client sends pays the network delay
+        while True:
+            end = self.buffer.find(b"\n")
+            if end != -1:
+                line = bytes(self.buffer[:end + 1])
+                del self.buffer[:end + 1]
+                return line
+            # Replies go out together once all pipelined input is handled (RFC 2920 section 3.1)
+            if self.replies:
+                self.request.sendall(self.replies)
+                self.replies.clear()
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return b""
+            if self.server.round_trip_delay:
+                time.sleep(self.server.round_trip_delay)
+            self.buffer += chunk
+
+    def handle(self):
+        server = self.server
+        self.buffer = bytearray()
+        self.replies = bytearray()
+        # Simulate the TLS handshake and greeting latency of a real provider
+        time.sleep(server.connect_delay)
+        self.reply("220 localhost sink ready")
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250-localhost")
+                self.reply("250-AUTH PLAIN LOGIN")
+                if server.pipelining:
+                    self.reply("250-PIPELINING")
+                self.reply("250 8BITMIME")
+            elif verb == "AUTH":
+                time.sleep(server.login_delay)
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    data = self.readline()
+                    if not data or data == b".\r\n":
+                        break
+                    size += len(data)
+                with server.lock:
+                    server.messages += 1
+                    server.bytes_received += size
+                self.reply("250 OK queued")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                self.request.sendall(self.replies)
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Local stand-in SMTP server for delivery benchmarks.
+
+    `connect_delay` and `login_delay` emulate the TLS handshake and AUTH round
+    trips that make per-message connections expensive against real providers.
+    `round_trip_delay` is added to every packet the client sends, standing in
+    for network latency, so commands written together (PIPELINING, advertised
+    unless `pipelining` is False) pay it once.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, connect_delay=0.0, login_delay=0.0, round_trip_delay=0.0, pipelining=True):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.connect_delay = connect_delay
+        self.login_delay = login_delay
+        self.round_trip_delay = round_trip_delay
+        self.pipelining = pipelining
+        self.messages = 0
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,85 @@
+import asyncio
+import random
+import threading
+import time
+
+from benchmarks.corpus import SAMPLE_PLAN
+
+class StubResponse:
+    def __init__(self, content):
+        self.content = content
+
+class StubAgent:
+    """Stand-in for the agno Agent that sleeps like an LLM call and returns a canned plan"""
+
+    def __init__(self, latency=0.5, content=SAMPLE_PLAN):
+        self.latency = latency
+        self.content = content
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def run(self, prompt, stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if stream:
+            return self._stream(self.content)
+        time.sleep(self.latency)
+        return StubResponse(self.content)
+
+    def _stream(self, content, token_chars=4):
+        """Yield the content a few characters at a time, spreading the latency over the tokens"""
+        tokens = [content[offset:offset + token_chars] for offset in range(0, len(content), token_chars)]
+        for token in tokens:
+            time.sleep(self.latency / len(tokens))
+            yield StubResponse(token)
+
+class ReplayAgent(StubAgent):
+    """Replays recorded model outputs in order, cycling, so whole jobs run offline and deterministically"""
+
+    def __init__(self, responses, latency=0.0):
+        super().__init__(latency, responses[0])
+        self.responses = list(responses)
+
+    def run(self, prompt, **kwargs):
+        with self._lock:
+            content = self.responses[self.calls % len(self.responses)]
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return StubResponse(content)
+
+class AsyncStubAgent(StubAgent):
+    """StubAgent that also offers a non-blocking `arun`, like the agno Agent"""
+
+    async def arun(self, prompt, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return StubResponse(self.content)
+
+class FakeModelError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+class FlakyAgent(StubAgent):
+    """Fake model with a slow tail, transient 5xx errors and 429 rate limits"""
+
+    def __init__(self, latency=0.05, tail_latency=1.0, tail_rate=0.03, error_rate=0.05, rate_limit_rate=0.02, seed=0):
+        super().__init__(latency)
+        self.tail_latency = tail_latency
+        self.tail_rate = tail_rate
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self._rng = random.Random(seed)
+
+    def run(self, prompt, **kwargs):
+        with self._lock:
+            self.calls += 1
+            roll = self._rng.random()
+            slow = self._rng.random() < self.tail_rate
+        if roll < self.rate_limit_rate:
+            raise FakeModelError("Rate limit reached. Please try again in 0.05s", 429)
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise FakeModelError("Internal server error", 503)
+        time.sleep(self.tail_latency if slow else self.latency)
+        return StubResponse(self.content)
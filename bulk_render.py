@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Import configuration
+import config
+from mime_batch import render_message
+
+# Settings a render reads, handed to each worker rather than inherited from the parent
+_RENDER_SETTINGS = ("EMAIL_SENDER", "EMAIL_SUBJECT_TEMPLATE", "EMAIL_COLOR_PRIMARY", "EMAIL_COLOR_SECONDARY",
+                    "DIETARY_PREFERENCES")
+
+def _start_context():
+    """Workers start from a fresh interpreter: a forked child could inherit a lock another thread held"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def _init_worker(settings):
+    for name, value in settings.items():
+        setattr(config, name, value)
+
+def _render_one(job):
+    receiver, diet_plan, preferences, current_date, message_id = job
+    # Jobs sharing a plan reuse its encoded body; only the recipient headers are new
+    return render_message(diet_plan, receiver, preferences, current_date, message_id)
+
+def _render_chunk(chunk):
+    """Render one chunk in a worker; a job that fails yields its exception instead of bytes"""
+    started = time.perf_counter()
+    messages = []
+    for job in chunk:
+        try:
+            messages.append(_render_one(job))
+        except Exception as e:
+            messages.append(RuntimeError(f"render failed for {job[0]}: {e}"))
+    return os.getpid(), time.perf_counter() - started, messages
+
+class BulkRenderer:
+    """Renders batches of emails to ready-to-send bytes across a pool of processes.
+
+    Each job is a (receiver, diet_plan, preferences, current_date, message_id)
+    tuple; `render` returns one `bytes` message per job in input order, or the
+    exception that job raised. Jobs are sent to the workers in chunks of
+    `chunk_size` so pickling and scheduling costs are paid per chunk rather
+    than per email. Batches smaller than BULK_RENDER_MIN_BATCH are rendered in
+    the calling process, where starting workers would cost more than it saves.
+    Workers are started on the first large batch, in fresh interpreters
+    given the render settings, and reused until `close`.
+    """
+
+    def __init__(self, processes=None, chunk_size=None, min_batch=None):
+        self.processes = processes or config.BULK_RENDER_PROCESSES or os.cpu_count() or 1
+        self.chunk_size = chunk_size or config.BULK_RENDER_CHUNK_SIZE
+        self.min_batch = config.BULK_RENDER_MIN_BATCH if min_batch is None else min_batch
+        self.stats = {}
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def render(self, jobs):
+        """Render every job, recording throughput overall and per worker in `stats`"""
+        jobs = list(jobs)
+        started = time.perf_counter()
+        if len(jobs) < self.min_batch or self.processes == 1:
+            results = [_render_chunk(jobs)]
+        else:
+            if self._executor is None:
+                settings = {name: getattr(config, name) for name in _RENDER_SETTINGS}
+                self._executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=_start_context(),
+                                                     initializer=_init_worker, initargs=(settings,))
+            chunks = [jobs[offset:offset + self.chunk_size] for offset in range(0, len(jobs), self.chunk_size)]
+            results = list(self._executor.map(_render_chunk, chunks))
+        elapsed = time.perf_counter() - started
+
+        messages = []
+        workers = {}
+        for pid, busy, chunk_messages in results:
+            messages.extend(chunk_messages)
+            worker = workers.setdefault(pid, {"messages": 0, "busy_s": 0.0})
+            worker["messages"] += len(chunk_messages)
+            worker["busy_s"] += busy
+        for worker in workers.values():
+            worker["per_s"] = worker["messages"] / worker["busy_s"] if worker["busy_s"] else 0.0
+        self.stats = {
+            "messages": len(messages),
+            "elapsed_s": elapsed,
+            "throughput_per_s": len(messages) / elapsed if elapsed else 0.0,
+            "workers": workers,
+        }
+        return messages
+
+def render_batch(jobs, processes=None, chunk_size=None):
+    """One-off bulk render; returns (messages, stats)"""
+    with BulkRenderer(processes, chunk_size) as renderer:
+        messages = renderer.render(jobs)
+    return messages, renderer.stats
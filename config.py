@@ -4,14 +4,93 @@
 GROQ_API_KEY = ""
 GROQ_MODEL = "llama-3.3-70b-versatile"
 
+# Resilient model calls: deadlines, retries, rate limits, circuit breaker, hedging
+LLM_TIMEOUT_SECONDS = 60
+LLM_MAX_RETRIES = 3
+LLM_BACKOFF_BASE_SECONDS = 1
+LLM_BACKOFF_MAX_SECONDS = 30
+LLM_REQUESTS_PER_MINUTE = 30
+LLM_TOKENS_PER_MINUTE = 12000
+LLM_EXPECTED_COMPLETION_TOKENS = 900
+LLM_BREAKER_THRESHOLD = 5
+LLM_BREAKER_COOLDOWN_SECONDS = 60
+# Send a duplicate request when one is slower than this (0 disables hedging)
+LLM_HEDGE_AFTER_SECONDS = 20
+LLM_MAX_INFLIGHT = 32
+
 # Email configuration
 EMAIL_SENDER = ""
 EMAIL_PASSWORD = ""
 EMAIL_RECEIVER = ""
 
+# SMTP delivery: pooled connections reused across messages
+SMTP_HOST = "smtp.gmail.com"
+SMTP_PORT = 465
+SMTP_USE_SSL = True
+SMTP_POOL_SIZE = 3
+SMTP_MAX_PER_SECOND = 5
+# Messages sent back to back on one connection, pipelined when the server supports it (RFC 2920)
+SMTP_PIPELINE_BATCH = 50
+# Encoded message bodies kept for reuse by recipients of the same plan, targets and date
+MIME_BODY_CACHE_SIZE = 256
+
+# Async pipeline (python nutrition_agent.py --async)
+ASYNC_GENERATION_CONCURRENCY = 16
+ASYNC_DELIVERY_CONCURRENCY = 3
+
+# Subscriber registry and batch fan-out
+SUBSCRIBERS_DB = "subscribers.db"
+FANOUT_MAX_WORKERS = 8
+
+# Plan cache shared by subscribers with identical preferences
+PLAN_CACHE_ENABLED = True
+PLAN_CACHE_DB = "plan_cache.db"
+PLAN_CACHE_TTL_HOURS = 36
+PLAN_CACHE_MAX_ENTRIES = 5000
+
+# Durable delivery queue: one row per subscriber per date, resumed after a crash
+DELIVERY_QUEUE_ENABLED = True
+DELIVERY_QUEUE_DB = "delivery_queue.db"
+DELIVERY_MAX_ATTEMPTS = 5
+DELIVERY_BACKOFF_BASE_SECONDS = 60
+DELIVERY_BACKOFF_MAX_SECONDS = 3600
+# A claimed row whose worker has not finished within this long is handed to another worker
+DELIVERY_LEASE_SECONDS = 600
+# How often failed deliveries are retried (and `python delivery_queue.py work --forever` polls)
+DELIVERY_POLL_SECONDS = 60
+
+# Batched generation (python batch_generation.py): days per call, or profiles per call for a single day
+BATCH_DAYS = 7
+BATCH_PROFILES_PER_CALL = 4
+
+# Bulk rendering of large delivery batches across processes (0 processes means one per CPU core)
+BULK_RENDER_PROCESSES = 0
+BULK_RENDER_CHUNK_SIZE = 32
+BULK_RENDER_MIN_BATCH = 200
+
+# Metrics in the Prometheus text format: written to this file after every run ("" disables),
+# and served on http://127.0.0.1:<port>/metrics while the scheduler runs (0 disables)
+METRICS_TEXTFILE = "metrics.prom"
+METRICS_HTTP_PORT = 0
+
+# HTTP API (python app.py) serving on-demand plans as HTML or JSON
+API_HOST = "127.0.0.1"
+API_PORT = 8080
+# Model agents built at startup, so the first requests do not pay for client setup
+API_WARM_AGENTS = 4
+# Rendered responses kept for repeat requests of the same plan, targets, date and format
+API_RESPONSE_CACHE_SIZE = 256
+
 # Scheduling configuration
 DAILY_SEND_TIME = "06:00"
 RUN_TEST_ON_START = True
+# IANA time zone for subscribers without one, e.g. "Asia/Kolkata"; empty means server local time
+DEFAULT_TIMEZONE = ""
+# Generate plans this many minutes before their send time so delivery is immediate
+PREGENERATE_LEAD_MINUTES = 30
+# How often the scheduler rereads the subscriber registry for new send times
+SCHEDULER_REFRESH_MINUTES = 15
+SCHEDULER_JOB_WORKERS = 4
 
 # Diet preferences
 DIETARY_PREFERENCES = {
@@ -23,6 +102,45 @@ DIETARY_PREFERENCES = {
     "protein_focus": "balanced"
 }
 
+# Ask the model for a JSON plan instead of free text (falls back to the text parser)
+STRUCTURED_PLAN_OUTPUT = False
+# tiktoken encoding used to count prompt tokens (an estimate is used when tiktoken is not installed)
+PROMPT_TOKENIZER = "cl100k_base"
+
+# Stream plans token by token, stopping as soon as one mentions an allergy or excluded food
+STREAMING_GENERATION = False
+STREAM_MAX_RESTARTS = 2
+
+# Check each generated plan against allergies, excluded foods and calorie/macro targets,
+# regenerating only the meals that fail (allergens left after the repairs stop the send)
+VALIDATE_PLANS = True
+VALIDATION_KCAL_TOLERANCE = 0.15  # fraction of calories_per_day the day may be off by
+VALIDATION_MACRO_TOLERANCE = 0.5  # same for protein and carbs against the targets in the email
+VALIDATION_MAX_REPAIRS = 2
+
+# Reuse meals from past plans: a day is assembled from stored meals to hit the calorie
+# target, and the model is only called when the library cannot cover the profile
+MEAL_LIBRARY_ENABLED = True
+MEAL_LIBRARY_DB = "meal_library.db"
+MEAL_LIBRARY_MIN_CANDIDATES = 3  # eligible meals needed per slot before assembling
+MEAL_LIBRARY_CANDIDATES = 24  # meals per slot considered for one day
+MEAL_LIBRARY_FRESH_SHARE = 0.2  # share of profile-days still generated by the model, for variety
+
+# Archive of sent plans: lets the prompt avoid recently served dishes and plans be resent without the model
+PLAN_HISTORY_ENABLED = True
+PLAN_HISTORY_DB = "plan_history.db"
+PLAN_HISTORY_AVOID_DAYS = 7  # days of dishes listed in the prompt as "do not repeat"
+PLAN_HISTORY_AVOID_MAX = 25  # most dish names listed
+PLAN_HISTORY_KEEP_TEXT_DAYS = 35  # full plan text kept this long; dish lists stay until retention
+PLAN_HISTORY_RETENTION_DAYS = 400
+PLAN_HISTORY_CACHE_KIB = 8192  # SQLite page cache
+PLAN_HISTORY_DISH_CACHE = 50000  # dish name -> id entries kept in memory
+
+# Weekly digest (python weekly_digest.py send): each subscriber's week of plans against their targets
+DIGEST_DAYS = 7
+DIGEST_SUBJECT_TEMPLATE = "Your Weekly Nutrition Digest - {start} to {end}"
+DIGEST_SEND_CHUNK = 1000  # digests rendered and sent per batch, bounding memory
+
 # Email template customization
 EMAIL_SUBJECT_TEMPLATE = "Your Daily Nutrition Plan - {date}"
 EMAIL_COLOR_PRIMARY = "#1e8a3e"
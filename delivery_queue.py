@@ -0,0 +1,471 @@
+import hashlib
+import json
+import random
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+# Import configuration
+import config
+import metrics
+import nutrition_agent
+from plan_cache import PlanCache
+from plan_history import record_delivery
+
+# Row lifecycle: pending -> generating -> ready -> sending -> sent, or dead once attempts run out
+PENDING, GENERATING, READY, SENDING, SENT, DEAD = "pending", "generating", "ready", "sending", "sent", "dead"
+_STAGES = {"generate": (PENDING, GENERATING), "deliver": (READY, SENDING)}
+# Returned by a stage's work when the row's lease went to another worker, which now owns it
+_LEASE_LOST = object()
+
+def idempotency_key(email, plan_date):
+    """One delivery per subscriber per date, however often the job is enqueued"""
+    return f"{email.strip().lower()}:{plan_date.isoformat()}"
+
+def message_id(key):
+    """Stable Message-ID, so a resend after a crash is recognisable as the same email"""
+    return f"<{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}@nutrition-agent>"
+
+class DeliveryQueue:
+    """Durable SQLite (WAL) queue of per-subscriber, per-date deliveries.
+
+    Each row is claimed under a lease before work starts and checkpointed
+    when a stage finishes: the generated plan is stored on the row, so a
+    restart resumes with delivery instead of calling the model again. Failed
+    rows are retried with exponential backoff and moved to the dead-letter
+    state after `max_attempts`. Leases left behind by a crashed worker
+    expire after `lease_seconds` and the row becomes claimable again, which
+    lets separate generation and delivery workers, threads or processes,
+    share one queue file.
+    """
+
+    def __init__(self, path=None, max_attempts=None, lease_seconds=None, backoff_base=None, backoff_max=None):
+        self.path = path or config.DELIVERY_QUEUE_DB
+        self.max_attempts = max_attempts or config.DELIVERY_MAX_ATTEMPTS
+        self.lease_seconds = lease_seconds or config.DELIVERY_LEASE_SECONDS
+        self.backoff_base = backoff_base if backoff_base is not None else config.DELIVERY_BACKOFF_BASE_SECONDS
+        self.backoff_max = backoff_max if backoff_max is not None else config.DELIVERY_BACKOFF_MAX_SECONDS
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS deliveries (
+                key TEXT PRIMARY KEY,
+                email TEXT NOT NULL,
+                preferences TEXT NOT NULL,
+                plan_date TEXT NOT NULL,
+                status TEXT NOT NULL,
+                plan TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_until REAL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                sent_at REAL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS deliveries_due ON deliveries (status, next_attempt_at)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, subscribers, plan_date=None):
+        """Queue each subscriber's plan for `plan_date`; returns how many were new.
+
+        Subscribers already queued for that date, in any state, are left alone.
+        """
+        plan_date = plan_date or date.today()
+        now = time.time()
+        rows = [
+            (idempotency_key(subscriber["email"], plan_date), subscriber["email"],
+             json.dumps(subscriber["preferences"]), plan_date.isoformat(), PENDING, now, now, now)
+            for subscriber in subscribers
+        ]
+        with self._lock:
+            before = self.conn.total_changes
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                """INSERT OR IGNORE INTO deliveries
+                   (key, email, preferences, plan_date, status, next_attempt_at, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows,
+            )
+            self.conn.execute("COMMIT")
+            return self.conn.total_changes - before
+
+    def recover(self):
+        """Hand rows whose worker died mid-stage back to the queue; returns how many"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            cursor = self.conn.execute(
+                """UPDATE deliveries SET
+                       status = CASE WHEN attempts >= ? THEN ? WHEN status = ? THEN ? ELSE ? END,
+                       lease_owner = NULL, lease_until = NULL, updated_at = ?,
+                       last_error = COALESCE(last_error, 'worker lease expired')
+                   WHERE status IN (?, ?) AND lease_until < ?""",
+                (self.max_attempts, DEAD, GENERATING, PENDING, READY, now, GENERATING, SENDING, now),
+            )
+            self.conn.execute("COMMIT")
+            return cursor.rowcount
+
+    def claim(self, stage, limit=1):
+        """Lease up to `limit` due rows for the "generate" or "deliver" stage.
+
+        Returns a list of dicts with the row's key, email, preferences,
+        plan_date, plan and lease token, which must be passed back to
+        `complete` or `fail`.
+        """
+        waiting, working = _STAGES[stage]
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute(
+                """UPDATE deliveries SET status = ?, attempts = attempts + 1, lease_owner = ?,
+                       lease_until = ?, updated_at = ?
+                   WHERE key IN (
+                       SELECT key FROM deliveries WHERE status = ? AND next_attempt_at <= ?
+                       ORDER BY next_attempt_at LIMIT ?
+                   )
+                   RETURNING key, email, preferences, plan_date, plan""",
+                (working, token, now + self.lease_seconds, now, waiting, now, limit),
+            ).fetchall()
+            self.conn.execute("COMMIT")
+        return [
+            {
+                "key": key,
+                "email": email,
+                "preferences": json.loads(preferences),
+                "plan_date": date.fromisoformat(plan_date),
+                "plan": plan,
+                "token": token,
+            }
+            for key, email, preferences, plan_date, plan in rows
+        ]
+
+    def renew(self, items):
+        """Extend the leases on `items` before slow work; returns those still held by this worker.
+
+        A lease that expired and was reclaimed by another worker is not
+        renewed, and its item must be dropped.
+        """
+        if not items:
+            return []
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            held = set()
+            for token in {item["token"] for item in items}:
+                keys = [item["key"] for item in items if item["token"] == token]
+                held.update(key for key, in self.conn.execute(
+                    f"""UPDATE deliveries SET lease_until = ?, updated_at = ?
+                        WHERE key IN ({", ".join("?" * len(keys))}) AND lease_owner = ?
+                        RETURNING key""",
+                    (now + self.lease_seconds, now, *keys, token),
+                ))
+            self.conn.execute("COMMIT")
+        return [item for item in items if item["key"] in held]
+
+    def complete(self, item, plan=None):
+        """Checkpoint a finished stage: store the generated `plan`, or mark the row sent.
+
+        Returns False if the lease was lost to another worker in the meantime.
+        """
+        now = time.time()
+        with self._lock:
+            if plan is not None:
+                cursor = self.conn.execute(
+                    """UPDATE deliveries SET status = ?, plan = ?, attempts = 0, next_attempt_at = ?,
+                           lease_owner = NULL, lease_until = NULL, last_error = NULL, updated_at = ?
+                       WHERE key = ? AND status = ? AND lease_owner = ?""",
+                    (READY, plan, now, now, item["key"], GENERATING, item["token"]),
+                )
+            else:
+                cursor = self.conn.execute(
+                    """UPDATE deliveries SET status = ?, lease_owner = NULL, lease_until = NULL,
+                           last_error = NULL, updated_at = ?, sent_at = ?
+                       WHERE key = ? AND status = ? AND lease_owner = ?""",
+                    (SENT, now, now, item["key"], SENDING, item["token"]),
+                )
+            return cursor.rowcount == 1
+
+    def fail(self, item, error):
+        """Schedule a retry with exponential backoff, or dead-letter the row; returns the new status"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute(
+                "SELECT status, attempts FROM deliveries WHERE key = ? AND lease_owner = ?",
+                (item["key"], item["token"]),
+            ).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            status, attempts = row
+            if attempts >= self.max_attempts:
+                new_status, next_attempt_at = DEAD, now
+            else:
+                new_status = PENDING if status == GENERATING else READY
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+                next_attempt_at = now + random.uniform(delay / 2, delay)
+            self.conn.execute(
+                """UPDATE deliveries SET status = ?, next_attempt_at = ?, lease_owner = NULL,
+                       lease_until = NULL, last_error = ?, updated_at = ?
+                   WHERE key = ?""",
+                (new_status, next_attempt_at, str(error)[:500], now, item["key"]),
+            )
+            self.conn.execute("COMMIT")
+            return new_status
+
+    def counts(self):
+        """Number of rows in each state"""
+        with self._lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM deliveries GROUP BY status").fetchall()
+        counts = dict.fromkeys((PENDING, GENERATING, READY, SENDING, SENT, DEAD), 0)
+        counts.update(rows)
+        return counts
+
+    def dead_letters(self):
+        """Rows that ran out of attempts, with the last error seen"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT email, plan_date, attempts, last_error FROM deliveries WHERE status = ? ORDER BY plan_date, email",
+                (DEAD,),
+            ).fetchall()
+        return [
+            {"email": email, "plan_date": plan_date, "attempts": attempts, "last_error": last_error}
+            for email, plan_date, attempts, last_error in rows
+        ]
+
+    def requeue_dead(self):
+        """Give every dead-lettered row a fresh set of attempts; returns how many"""
+        now = time.time()
+        with self._lock:
+            cursor = self.conn.execute(
+                """UPDATE deliveries SET status = CASE WHEN plan IS NULL THEN ? ELSE ? END,
+                       attempts = 0, next_attempt_at = ?, updated_at = ?
+                   WHERE status = ?""",
+                (PENDING, READY, now, now, DEAD),
+            )
+            return cursor.rowcount
+
+def _drain(queue, stage, work, max_workers, batch_size=None, prepare=None):
+    """Claim and process due rows for `stage` until none are left; returns (done, failed).
+
+    `prepare(items)`, if given, runs once per claimed batch before `work` is
+    mapped over its items.
+    """
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            items = queue.claim(stage, batch_size or max_workers * 2)
+            if not items:
+                return done, failed
+            if prepare is not None:
+                prepare(items)
+            for item, error in zip(items, pool.map(work, items)):
+                if error is None:
+                    done += 1
+                elif error is _LEASE_LOST:
+                    print(f"Queued {stage} for {item['email']} ({item['plan_date']}) left to the worker that took over its lease")
+                else:
+                    failed += 1
+                    status = queue.fail(item, error)
+                    print(f"Queued {stage} for {item['email']} ({item['plan_date']}) failed, now {status}: {error}")
+
+def generate_pending(queue, agent_instance=None, cache=None, max_workers=None):
+    """Generate plans for every due pending row and checkpoint them; returns (generated, failed)"""
+    max_workers = max_workers or config.FANOUT_MAX_WORKERS
+    owns_cache = cache is None and config.PLAN_CACHE_ENABLED
+    if owns_cache:
+        cache = PlanCache()
+    elif not cache:
+        cache = None
+
+    def work(item):
+        generate = lambda preferences: nutrition_agent.generate_diet_plan(
+            preferences, agent_instance or nutrition_agent.get_agent(), item["plan_date"]
+        )
+        try:
+            if cache is not None:
+                plan = cache.get_or_generate(item["preferences"], generate, item["plan_date"])
+            else:
+                plan = generate(item["preferences"])
+        except Exception as e:
+            return e
+        return None if queue.complete(item, plan) else _LEASE_LOST
+
+    try:
+        return _drain(queue, "generate", work, max_workers)
+    finally:
+        if owns_cache:
+            cache.close()
+
+def deliver_ready(queue, deliver=None, max_workers=None):
+    """Send every due generated plan and mark it sent; returns (sent, failed).
+
+    `deliver(diet_plan, receiver, preferences)` replaces SMTP delivery as in
+    `run_fanout`. By default each claimed batch is rendered up front by the
+    bulk renderer (across processes for large batches), reusing one encoded
+    body per shared plan, and the finished messages, carrying a Message-ID
+    derived from the idempotency key, go out over the SMTP connection pool
+    in pipelined batches.
+    """
+    max_workers = max_workers or config.FANOUT_MAX_WORKERS
+    smtp_pool = renderer = prepare = batch_size = None
+    if deliver is None:
+        from bulk_render import BulkRenderer
+        from smtp_pool import SMTPConnectionPool
+        smtp_pool = SMTPConnectionPool()
+        renderer = BulkRenderer()
+        batch_size = max(max_workers * 2, renderer.min_batch)
+
+        def prepare(items):
+            # Only send rows still leased to this worker once rendering is done
+            for item in items:
+                item["error"] = _LEASE_LOST
+            messages = renderer.render(
+                (item["email"], item["plan"], item["preferences"],
+                 item["plan_date"].strftime("%A, %B %d, %Y"), message_id(item["key"]))
+                for item in items
+            )
+            rendered = []
+            for item, message in zip(items, messages):
+                # A message that failed to render fails its row without being sent
+                if isinstance(message, Exception):
+                    item["error"] = message
+                else:
+                    rendered.append((item, message))
+            held = {item["key"] for item in queue.renew([item for item, _ in rendered])}
+            ready = [(item, message) for item, message in rendered if item["key"] in held]
+            results = smtp_pool.send_many(config.EMAIL_SENDER, [(item["email"], message) for item, message in ready])
+            for (item, _), error in zip(ready, results):
+                item["error"] = error
+
+    def work(item):
+        if smtp_pool is not None:
+            if item["error"] is _LEASE_LOST:
+                return _LEASE_LOST
+        elif not queue.renew([item]):
+            return _LEASE_LOST
+        try:
+            if smtp_pool is not None:
+                if item["error"] is not None:
+                    raise item["error"]
+                print(f"✓ Email sent successfully to {item['email']} for {item['plan_date']}")
+                success = True
+            else:
+                success = deliver(item["plan"], item["email"], item["preferences"])
+        except Exception as e:
+            success, error = False, e
+        else:
+            error = None if success else RuntimeError("delivery was not accepted")
+        if not success:
+            metrics.DELIVERIES.inc(result="failed")
+            return error
+        metrics.DELIVERIES.inc(result="sent")
+        if not queue.complete(item):
+            # Sent, but the row now belongs to another worker, which will send and record it too;
+            # both copies carry the same Message-ID
+            print(f"Lease on {item['email']} ({item['plan_date']}) expired during the send; it may be delivered twice")
+            return _LEASE_LOST
+        if config.PLAN_HISTORY_ENABLED:
+            record_delivery(item["email"], item["plan_date"], item["plan"], item["preferences"])
+        return None
+
+    try:
+        return _drain(queue, "deliver", work, max_workers, batch_size, prepare)
+    finally:
+        if smtp_pool is not None:
+            smtp_pool.close()
+            renderer.close()
+
+def process_queue(queue=None, agent_instance=None, deliver=None, cache=None, max_workers=None):
+    """Recover abandoned rows, then run one generation pass and one delivery pass"""
+    owns_queue = queue is None
+    queue = queue or DeliveryQueue()
+    try:
+        recovered = queue.recover()
+        generated, generation_failed = generate_pending(queue, agent_instance, cache, max_workers)
+        sent, delivery_failed = deliver_ready(queue, deliver, max_workers)
+        counts = queue.counts()
+        for status, count in counts.items():
+            metrics.QUEUE_DEPTH.set(count, status=status)
+        return {
+            "recovered": recovered,
+            "generated": generated,
+            "delivered": sent,
+            "failed": generation_failed + delivery_failed,
+            **counts,
+        }
+    finally:
+        if owns_queue:
+            queue.close()
+
+def run_queued(subscribers, plan_date=None, agent_instance=None, deliver=None, cache=None, max_workers=None, queue=None):
+    """Queue today's (or `plan_date`'s) deliveries for `subscribers` and work the queue.
+
+    Subscribers already served for the date are skipped, plans generated
+    before a crash are sent without regenerating, and failures stay queued
+    for the periodic retry pass. Returns per-run stats.
+    """
+    owns_queue = queue is None
+    queue = queue or DeliveryQueue()
+    started = time.perf_counter()
+    try:
+        enqueued = queue.enqueue(subscribers, plan_date)
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Queued {enqueued} new deliveries "
+              f"({len(subscribers) - enqueued} already queued)...")
+        stats = process_queue(queue, agent_instance, deliver, cache, max_workers)
+    finally:
+        if owns_queue:
+            queue.close()
+    stats.update({"subscribers": len(subscribers), "enqueued": enqueued, "elapsed_s": time.perf_counter() - started})
+    print(
+        f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Queue pass finished in {stats['elapsed_s']:.1f}s: "
+        f"{stats['generated']} generated, {stats['delivered']} sent, {stats['failed']} failed "
+        f"({stats[PENDING] + stats[READY]} awaiting retry, {stats[DEAD]} dead-lettered)"
+    )
+    return stats
+
+if __name__ == "__main__":
+    # Usage:
+    #   python delivery_queue.py status
+    #   python delivery_queue.py generate|deliver|work [--forever]
+    #   python delivery_queue.py dead
+    #   python delivery_queue.py requeue-dead
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    forever = "--forever" in sys.argv[2:]
+    with DeliveryQueue() as delivery_queue:
+        if command in ("generate", "deliver", "work"):
+            # Generation and delivery workers can run as separate processes on the same queue file
+            while True:
+                delivery_queue.recover()
+                if command != "deliver":
+                    generate_pending(delivery_queue)
+                if command != "generate":
+                    deliver_ready(delivery_queue)
+                if not forever:
+                    break
+                time.sleep(config.DELIVERY_POLL_SECONDS)
+        elif command == "dead":
+            for row in delivery_queue.dead_letters():
+                print(f"{row['email']} {row['plan_date']}: {row['attempts']} attempt(s), {row['last_error']}")
+        elif command == "requeue-dead":
+            print(f"✓ Requeued {delivery_queue.requeue_dead()} dead-lettered deliveries")
+        for status, count in delivery_queue.counts().items():
+            print(f"{status}: {count}")
@@ -0,0 +1,113 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+# Import configuration
+import config
+import metrics
+import nutrition_agent
+from plan_cache import PlanCache
+from plan_history import record_delivery
+from smtp_pool import SMTPConnectionPool
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def _serve_subscriber(subscriber, agent_instance, deliver, cache, plan_date):
+    """Generate and deliver one subscriber's plan, timing each stage"""
+    started = time.perf_counter()
+    generate = lambda preferences: nutrition_agent.generate_diet_plan(
+        preferences, agent_instance or nutrition_agent.get_agent(), plan_date
+    )
+    if cache is not None:
+        diet_plan = cache.get_or_generate(subscriber["preferences"], generate, plan_date)
+    else:
+        diet_plan = generate(subscriber["preferences"])
+    generated = time.perf_counter()
+    success = deliver(diet_plan, subscriber["email"], subscriber["preferences"])
+    finished = time.perf_counter()
+    if success and config.PLAN_HISTORY_ENABLED:
+        record_delivery(subscriber["email"], plan_date, diet_plan, subscriber["preferences"])
+    return success, generated - started, finished - generated
+
+def run_fanout(subscribers, agent_instance=None, max_workers=None, deliver=None, cache=None, plan_date=None):
+    """Generate and send plans for many subscribers on a bounded worker pool.
+
+    Workers share the resilient `nutrition_agent.get_agent()` client unless
+    `agent_instance` (e.g. a stub) is given. Pass `deliver` to replace
+    `send_email`; by default plans go out over one pooled SMTP connection set
+    for the whole run. Subscribers with identical preferences share one
+    generation through the plan cache (see `PLAN_CACHE_ENABLED`); pass
+    `cache=False` to always generate. `plan_date` is the date the plans are
+    for, defaulting to today. Returns per-run throughput/latency stats.
+    """
+    max_workers = max_workers or config.FANOUT_MAX_WORKERS
+    smtp_pool = None
+    if deliver is None:
+        smtp_pool = SMTPConnectionPool()
+        deliver = lambda diet_plan, receiver, preferences: nutrition_agent.send_email(
+            diet_plan, receiver, preferences, pool=smtp_pool
+        )
+    owns_cache = cache is None and config.PLAN_CACHE_ENABLED
+    if owns_cache:
+        cache = PlanCache()
+    elif not cache:
+        cache = None
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Fanning out to {len(subscribers)} subscribers with {max_workers} workers...")
+
+    generation_times = []
+    delivery_times = []
+    succeeded = failed = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(_serve_subscriber, subscriber, agent_instance, deliver, cache, plan_date): subscriber
+            for subscriber in subscribers
+        }
+        for future in as_completed(futures):
+            try:
+                success, generation_time, delivery_time = future.result()
+            except Exception as e:
+                print(f"Error serving {futures[future]['email']}: {e}")
+                metrics.DELIVERIES.inc(result="failed")
+                failed += 1
+                continue
+            generation_times.append(generation_time)
+            delivery_times.append(delivery_time)
+            metrics.DELIVERIES.inc(result="sent" if success else "failed")
+            if success:
+                succeeded += 1
+            else:
+                failed += 1
+    elapsed = time.perf_counter() - started
+    cache_stats = cache.stats() if cache is not None else {"hits": 0, "misses": 0, "hit_rate": 0.0}
+    if owns_cache:
+        cache.close()
+    if smtp_pool is not None:
+        smtp_pool.close()
+
+    stats = {
+        "subscribers": len(subscribers),
+        "succeeded": succeeded,
+        "failed": failed,
+        "elapsed_s": elapsed,
+        "throughput_per_s": len(subscribers) / elapsed if elapsed else 0.0,
+        "generation_p50_s": percentile(generation_times, 50),
+        "generation_p95_s": percentile(generation_times, 95),
+        "delivery_p50_s": percentile(delivery_times, 50),
+        "delivery_p95_s": percentile(delivery_times, 95),
+        "cache_hits": cache_stats["hits"],
+        "cache_misses": cache_stats["misses"],
+        "cache_hit_rate": cache_stats["hit_rate"],
+    }
+    print(
+        f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Batch finished: "
+        f"{succeeded} delivered, {failed} failed in {elapsed:.1f}s "
+        f"({stats['throughput_per_s']:.2f}/s, generation p50 {stats['generation_p50_s']:.2f}s "
+        f"p95 {stats['generation_p95_s']:.2f}s, cache hit rate {stats['cache_hit_rate']:.0%})"
+    )
+    return stats
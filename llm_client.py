@@ -0,0 +1,365 @@
+import asyncio
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Import configuration
+import config
+import metrics
+
+# HTTP statuses that fail the same way on every attempt
+_NON_RETRYABLE_STATUS = {400, 401, 403, 404, 413, 422}
+# Groq phrases rate limits as "Please try again in 1m2.5s"
+_RETRY_AFTER_RE = re.compile(r'try again in (?:(\d+)m)?([\d.]+)s', re.IGNORECASE)
+
+class LLMError(Exception):
+    """A model call failed after all retries"""
+
+class LLMTimeoutError(LLMError, TimeoutError):
+    """A model call missed its deadline"""
+
+class RateLimitTimeoutError(LLMTimeoutError):
+    """Waiting for the rate limiter would have passed the deadline, so the model was never called"""
+
+class CircuitOpenError(LLMError):
+    """Calls are being rejected because the model keeps failing"""
+
+def _status_code(error):
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+def _retry_after(error):
+    """Seconds the provider asked us to wait, if it said"""
+    match = _RETRY_AFTER_RE.search(str(error))
+    if match:
+        return int(match.group(1) or 0) * 60 + float(match.group(2))
+    return None
+
+def is_retryable(error):
+    if isinstance(error, (LLMTimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = _status_code(error)
+    return status not in _NON_RETRYABLE_STATUS
+
+class TokenBucket:
+    """Refills `per_minute` units evenly over a minute; `acquire` blocks until enough are available"""
+
+    def __init__(self, per_minute, capacity=None):
+        self.per_minute = per_minute
+        self.capacity = capacity or per_minute
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def _wait_time(self, amount, now):
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / self.per_minute
+
+    def try_acquire(self, amount=1):
+        if not self.per_minute:
+            return True
+        with self._lock:
+            if self._wait_time(amount, time.monotonic()) == 0:
+                self.tokens -= amount
+                return True
+            return False
+
+    def acquire(self, amount=1, deadline=None):
+        """Take `amount` units, waiting for the refill; False if that would pass `deadline`"""
+        if not self.per_minute:
+            return True
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = self._wait_time(amount, now)
+                if delay == 0:
+                    self.tokens -= amount
+                    return True
+            if deadline is not None and now + delay > deadline:
+                return False
+            time.sleep(delay)
+
+    def adjust(self, amount):
+        """Return (positive) or charge (negative) units once the real cost is known"""
+        if not self.per_minute:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def pause(self, seconds):
+        """Hold every caller for `seconds`, e.g. after the provider returned 429"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and lets one trial call through after `cooldown`"""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def release(self):
+        """Give back a half-open trial that ended without telling anything about the model.
+
+        For calls abandoned before a response (rate-limit waits, streams the
+        consumer closed early): the next caller gets the trial instead.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.threshold and self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+class LLMClient:
+    """Resilient drop-in for `Agent.run`: deadlines, retries, rate limits, circuit breaking and hedging.
+
+    `agent_factory` builds agents on demand; each in-flight call gets its own
+    agent from a small pool, so concurrent and hedged calls never share run
+    state. Every call is bounded by a deadline, retried with jittered
+    exponential backoff on timeouts, 429s and 5xx errors, throttled by
+    request and token buckets, and rejected fast while the circuit is open.
+    A call still running after the hedge delay (the recent p95 latency, or
+    LLM_HEDGE_AFTER_SECONDS until there is history) gets a duplicate request
+    and the first answer wins.
+    """
+
+    def __init__(self, agent_factory, timeout=None, max_retries=None, backoff_base=None,
+                 backoff_max=None, requests_per_minute=None, tokens_per_minute=None,
+                 breaker_threshold=None, breaker_cooldown=None, hedge_after=None, max_inflight=None):
+        self.agent_factory = agent_factory
+        self.timeout = timeout if timeout is not None else config.LLM_TIMEOUT_SECONDS
+        self.max_retries = max_retries if max_retries is not None else config.LLM_MAX_RETRIES
+        self.backoff_base = backoff_base if backoff_base is not None else config.LLM_BACKOFF_BASE_SECONDS
+        self.backoff_max = backoff_max if backoff_max is not None else config.LLM_BACKOFF_MAX_SECONDS
+        self.hedge_after = hedge_after if hedge_after is not None else config.LLM_HEDGE_AFTER_SECONDS
+        self.requests = TokenBucket(config.LLM_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute)
+        self.tokens = TokenBucket(config.LLM_TOKENS_PER_MINUTE if tokens_per_minute is None else tokens_per_minute)
+        self.breaker = CircuitBreaker(
+            config.LLM_BREAKER_THRESHOLD if breaker_threshold is None else breaker_threshold,
+            config.LLM_BREAKER_COOLDOWN_SECONDS if breaker_cooldown is None else breaker_cooldown,
+        )
+        self.stats = {"calls": 0, "attempts": 0, "retries": 0, "timeouts": 0, "rate_limited": 0,
+                      "hedges": 0, "hedge_wins": 0, "rejected": 0, "failures": 0}
+        self._latencies = deque(maxlen=200)
+        self._idle_agents = queue.LifoQueue()
+        self._executor = ThreadPoolExecutor(max_workers=max_inflight or config.LLM_MAX_INFLIGHT)
+        self._lock = threading.Lock()
+
+    def warm(self, count):
+        """Build agents until `count` are idle, so the next calls skip agent and model client setup"""
+        for _ in range(count - self._idle_agents.qsize()):
+            self._idle_agents.put(self.agent_factory())
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+        metrics.LLM_EVENTS.inc(event=name)
+
+    @staticmethod
+    def estimate_tokens(prompt):
+        """Rough prompt size plus the expected completion, for the token bucket"""
+        return len(prompt) // 4 + config.LLM_EXPECTED_COMPLETION_TOKENS
+
+    def _hedge_delay(self):
+        if not self.hedge_after:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) >= 20:
+            return samples[int(len(samples) * 0.95)]
+        return self.hedge_after
+
+    def _call(self, prompt, estimate):
+        """One request on a pooled agent; raises if the run reports an error"""
+        try:
+            agent = self._idle_agents.get_nowait()
+        except queue.Empty:
+            agent = self.agent_factory()
+        started = time.monotonic()
+        try:
+            response = agent.run(prompt)
+        finally:
+            self._idle_agents.put(agent)
+        status = getattr(getattr(response, "status", None), "value", None)
+        if status == "ERROR":
+            raise LLMError(response.content or "model run failed")
+        latency = time.monotonic() - started
+        with self._lock:
+            self._latencies.append(latency)
+        metrics.LLM_CALL_SECONDS.observe(latency)
+        usage = getattr(response, "metrics", None)
+        actual = getattr(usage, "total_tokens", 0) if usage is not None else 0
+        if actual:
+            self.tokens.adjust(estimate - actual)
+            metrics.LLM_TOKENS.inc(getattr(usage, "input_tokens", 0) or 0, kind="prompt")
+            metrics.LLM_TOKENS.inc(getattr(usage, "output_tokens", 0) or 0, kind="completion")
+            # Prompt tokens the provider served from its prefix cache (part of the prompt count)
+            metrics.LLM_TOKENS.inc(getattr(usage, "cache_read_tokens", 0) or 0, kind="cached_prompt")
+            metrics.LLM_TOKENS_PER_CALL.observe(actual)
+        return response
+
+    def _attempt(self, prompt, deadline):
+        estimate = self.estimate_tokens(prompt)
+        if not (self.requests.acquire(1, deadline) and self.tokens.acquire(estimate, deadline)):
+            raise RateLimitTimeoutError("rate limit wait would exceed the deadline")
+        self._count("attempts")
+        futures = [self._executor.submit(self._call, prompt, estimate)]
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None and hedge_delay < deadline - time.monotonic():
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done and self.requests.try_acquire(1) and self.tokens.try_acquire(estimate):
+                self._count("hedges")
+                futures.append(self._executor.submit(self._call, prompt, estimate))
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        self._count("timeouts")
+        raise LLMTimeoutError(f"no response within {self.timeout:g}s")
+
+    def run(self, prompt, **kwargs):
+        """Run `prompt` like `Agent.run`, returning the agent's response object"""
+        self._count("calls")
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self._count("rejected")
+                raise CircuitOpenError("model circuit is open after repeated failures") from last_error
+            try:
+                response = self._attempt(prompt, time.monotonic() + self.timeout)
+            except Exception as e:
+                if isinstance(e, RateLimitTimeoutError):
+                    self.breaker.release()
+                else:
+                    self.breaker.record_failure()
+                last_error = e
+                if _status_code(e) == 429:
+                    self._count("rate_limited")
+                if attempt == self.max_retries or not is_retryable(e):
+                    break
+                self._count("retries")
+                # Full jitter, but never retry sooner than the provider asked
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                retry_after = _retry_after(e)
+                if retry_after is not None:
+                    self.requests.pause(retry_after)
+                    delay = max(delay, retry_after)
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return response
+        self._count("failures")
+        raise LLMError(f"model call failed after {attempt + 1} attempt(s): {last_error}") from last_error
+
+    def stream(self, prompt, **kwargs):
+        """Stream `prompt` like `Agent.run(stream=True)`, yielding the agent's events.
+
+        Rate limits and the circuit breaker apply as for `run`, and the
+        deadline is checked as each event arrives. A stream cannot be retried
+        or hedged once output has been yielded. Closing the generator early
+        closes the underlying stream, so the provider stops generating.
+        """
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError("model circuit is open after repeated failures")
+        deadline = time.monotonic() + self.timeout
+        estimate = self.estimate_tokens(prompt)
+        if not (self.requests.acquire(1, deadline) and self.tokens.acquire(estimate, deadline)):
+            self.breaker.release()
+            raise RateLimitTimeoutError("rate limit wait would exceed the deadline")
+        self._count("attempts")
+        try:
+            agent = self._idle_agents.get_nowait()
+        except queue.Empty:
+            try:
+                agent = self.agent_factory()
+            except BaseException:
+                self.breaker.release()
+                raise
+        started = time.monotonic()
+        events = None
+        try:
+            events = agent.run(prompt, stream=True)
+            for event in events:
+                if time.monotonic() > deadline:
+                    self._count("timeouts")
+                    raise LLMTimeoutError(f"stream did not finish within {self.timeout:g}s")
+                yield event
+        except GeneratorExit:
+            # The consumer stopped reading; that says nothing about the model's health,
+            # but a half-open trial must not stay taken
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            self._count("failures")
+            raise
+        else:
+            self.breaker.record_success()
+            metrics.LLM_CALL_SECONDS.observe(time.monotonic() - started)
+        finally:
+            close = getattr(events, "close", None)
+            if close is not None:
+                close()
+            self._idle_agents.put(agent)
+
+    async def arun(self, prompt, **kwargs):
+        """Async variant for the asyncio pipeline; the resilient call runs on a worker thread"""
+        return await asyncio.to_thread(self.run, prompt)
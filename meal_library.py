@@ -0,0 +1,269 @@
+import hashlib
+import random
+import sqlite3
+import threading
+import time
+from datetime import date
+
+# Import configuration
+import config
+import metrics
+import nutrition_agent
+from plan_cache import profile_fingerprint
+from plan_validator import INGREDIENT_SYNONYMS, ConstraintMatcher, compile_constraints, expand_term, normalize_term, validate_plan
+from structured_plan import looks_like_json, parse_plan_json
+
+# Meal slots of an assembled day, in order, with the library slot each is filled from.
+# Snacks are stored under one slot and fill both snack places
+DAY_SLOTS = (("BREAKFAST", "BREAKFAST"), ("MORNING SNACK", "SNACK"), ("LUNCH", "LUNCH"),
+             ("EVENING SNACK", "SNACK"), ("DINNER", "DINNER"))
+_SLOT_PREFIXES = (("MORNING SNACK", "SNACK"), ("EVENING SNACK", "SNACK"), ("BREAKFAST", "BREAKFAST"),
+                  ("LUNCH", "LUNCH"), ("DINNER", "DINNER"), ("SNACK", "SNACK"))
+HYDRATION = "HYDRATION\nDrink 8 to 10 glasses of water spread through the day\nStart the morning with warm water and lemon"
+
+# Tags every stored meal with the allergen groups it contains
+_ALLERGEN_TAGGER = ConstraintMatcher(allergies=tuple(INGREDIENT_SYNONYMS))
+
+def _slot(title):
+    upper = title.upper()
+    for prefix, slot in _SLOT_PREFIXES:
+        if upper.startswith(prefix):
+            return slot
+    return None
+
+def _profile(preferences):
+    """(diet type, complexity, protein focus): the constraints a stored meal was generated for"""
+    return (str(preferences["diet_type"]).strip().lower(), str(preferences["meal_complexity"]).strip().lower(),
+            str(preferences["protein_focus"]).strip().lower())
+
+def _allergen_groups(preferences):
+    """Allergen groups among a subscriber's allergies, which the stored tags can filter on"""
+    groups = set()
+    for term in preferences.get("allergies", []):
+        groups.update(word for word in expand_term(normalize_term(term)) if word in INGREDIENT_SYNONYMS)
+    return groups
+
+def _fresh_roll(preferences, plan_date):
+    """A stable number in [0, 1) for this profile and day, so retries make the same choice"""
+    digest = hashlib.sha256(f"{profile_fingerprint(preferences)}:{plan_date.isoformat()}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+def _plan_meals(plan_text):
+    """(title, dish and tip lines, kcal, (protein, carbs, fiber)) for each section of a plan"""
+    if looks_like_json(plan_text):
+        for meal in parse_plan_json(plan_text).meals:
+            # Item calories stay out of the text, where they would read as the meal total
+            lines = [item.name for item in meal.items] + [f"Tip: {tip}" for tip in meal.tips]
+            yield meal.name, lines, meal.kcal, (meal.protein, meal.carbs, meal.fiber)
+        return
+    for title, _, items in nutrition_agent.parse_diet_content(plan_text):
+        kcal = macros = None
+        lines = []
+        for kind, value in items:
+            if kind == nutrition_agent.CALORIES:
+                kcal = max(kcal or 0, int(value))
+            elif kind == nutrition_agent.MACROS:
+                macros = macros or tuple(int(number) for number in value)
+            else:
+                lines.append(value)
+        yield title, lines, kcal, macros
+
+class MealLibrary:
+    """SQLite store of validated meals, reusable across subscribers and days.
+
+    Meals are harvested from generated plans with their calories, macros,
+    allergen tags, diet type, complexity and protein focus, and only reused
+    for that same diet type, complexity and protein focus. `assemble` fills
+    a day from them to hit a calorie target, so the model is only called
+    when the library cannot satisfy a profile or to keep adding variety.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.MEAL_LIBRARY_DB
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS meals (
+                id TEXT PRIMARY KEY,
+                slot TEXT NOT NULL,
+                diet_type TEXT NOT NULL,
+                complexity TEXT NOT NULL,
+                protein_focus TEXT NOT NULL,
+                body TEXT NOT NULL,
+                kcal INTEGER NOT NULL,
+                protein INTEGER NOT NULL,
+                carbs INTEGER NOT NULL,
+                fiber INTEGER NOT NULL,
+                tags TEXT NOT NULL,
+                uses INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_used_at REAL
+            )"""
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(meals)")}
+        if "protein_focus" not in columns:
+            # Meals stored before the protein focus was recorded match no profile, so they are never reused
+            self.conn.execute("ALTER TABLE meals ADD COLUMN protein_focus TEXT NOT NULL DEFAULT ''")
+        self.conn.execute("DROP INDEX IF EXISTS meals_profile")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS meals_constraints ON meals (diet_type, complexity, protein_focus, slot, uses)"
+        )
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def harvest(self, plan_text, preferences):
+        """Store every complete meal of a plan (dishes, calories and macros); returns how many were new"""
+        diet_type, complexity, protein_focus = _profile(preferences)
+        rows = []
+        for title, lines, kcal, macros in _plan_meals(plan_text):
+            slot = _slot(title)
+            if slot is None or not kcal or macros is None or not lines:
+                continue
+            body = "\n".join(lines)
+            identity = f"{diet_type}:{complexity}:{protein_focus}:{slot}:{body.lower()}"
+            key = hashlib.sha256(identity.encode("utf-8")).hexdigest()[:32]
+            tags = sorted({group for _, group, _ in _ALLERGEN_TAGGER.find(body)})
+            rows.append((key, slot, diet_type, complexity, protein_focus, body, kcal, *macros, "," + ",".join(tags) + ",", time.time()))
+        with self._lock:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                """INSERT OR IGNORE INTO meals
+                   (id, slot, diet_type, complexity, protein_focus, body, kcal, protein, carbs, fiber, tags, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows,
+            )
+            self.conn.commit()
+            return self.conn.total_changes - before
+
+    def _candidates(self, preferences, slot, rng):
+        """Least-used meals for a slot that are safe for these preferences, in a per-day random order"""
+        query = ("SELECT id, body, kcal, protein, carbs, fiber FROM meals "
+                 "WHERE diet_type = ? AND complexity = ? AND protein_focus = ? AND slot = ?")
+        params = [*_profile(preferences), slot]
+        for group in sorted(_allergen_groups(preferences)):
+            query += " AND tags NOT LIKE ?"
+            params.append(f"%,{group},%")
+        query += " ORDER BY uses, last_used_at LIMIT ?"
+        params.append(config.MEAL_LIBRARY_CANDIDATES * 4)
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+        # Tags cover known allergen groups; excluded foods and other terms need the full matcher
+        matcher = compile_constraints(preferences)
+        rows = [row for row in rows if not matcher.find(row[1])]
+        rng.shuffle(rows)
+        return rows[:config.MEAL_LIBRARY_CANDIDATES]
+
+    def assemble(self, preferences, plan_date=None):
+        """Build a day's plan text from stored meals, or None if the library cannot cover the profile.
+
+        One meal is chosen per slot (a multiple-choice knapsack over calories,
+        in 10 kcal steps) to land as close as possible to `calories_per_day`,
+        within VALIDATION_KCAL_TOLERANCE. Candidates are shuffled per profile
+        and day, so consecutive days get different combinations. The result
+        must also pass `validate_plan`.
+        """
+        plan_date = plan_date or date.today()
+        target = int(preferences["calories_per_day"])
+        limit = target * (1 + config.VALIDATION_KCAL_TOLERANCE)
+        rng = random.Random(f"{profile_fingerprint(preferences)}:{plan_date.isoformat()}")
+        candidates = {}
+        for _, slot in DAY_SLOTS:
+            if slot not in candidates:
+                candidates[slot] = self._candidates(preferences, slot, rng)
+            if len(candidates[slot]) < config.MEAL_LIBRARY_MIN_CANDIDATES:
+                return None
+
+        # Reachable calorie totals (in 10 kcal steps) -> one choice of meals reaching them
+        step_limit = limit / 10
+        states = {0: ()}
+        for _, slot in DAY_SLOTS:
+            steps = [(round(meal[2] / 10), meal) for meal in candidates[slot]]
+            next_states = {}
+            for total, chosen in states.items():
+                for step, meal in steps:
+                    reached = total + step
+                    if reached <= step_limit and reached not in next_states and meal not in chosen:
+                        next_states[reached] = chosen + (meal,)
+            states = next_states
+        if not states:
+            return None
+        best = min(states, key=lambda total: abs(total * 10 - target))
+        if abs(best * 10 - target) > target * config.VALIDATION_KCAL_TOLERANCE:
+            return None
+
+        sections = [
+            f"{title}\n{body}\nCalories: {kcal} kcal\nProtein: {protein}g | Carbs: {carbs}g | Fiber: {fiber}g"
+            for (title, _), (_, body, kcal, protein, carbs, fiber) in zip(DAY_SLOTS, states[best])
+        ]
+        plan_text = "\n\n".join(sections + [HYDRATION])
+        if not validate_plan(plan_text, preferences).ok:
+            return None
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE meals SET uses = uses + 1, last_used_at = ? WHERE id = ?",
+                [(time.time(), meal[0]) for meal in states[best]],
+            )
+            self.conn.commit()
+        return plan_text
+
+    def counts(self):
+        """Stored meals per (diet_type, complexity, protein_focus, slot)"""
+        with self._lock:
+            rows = self.conn.execute(
+                """SELECT diet_type, complexity, protein_focus, slot, COUNT(*) FROM meals
+                   GROUP BY diet_type, complexity, protein_focus, slot"""
+            ).fetchall()
+        return {tuple(row[:4]): row[4] for row in rows}
+
+_library = None
+_library_lock = threading.Lock()
+
+def get_library():
+    """The process-wide meal library, opened on first use"""
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = MealLibrary()
+        return _library
+
+def plan_from_library(preferences=None, plan_date=None):
+    """An assembled plan for these preferences, or None when the model should generate one.
+
+    MEAL_LIBRARY_FRESH_SHARE of profile-days always go to the model, so the
+    library keeps growing and menus do not settle into a fixed rotation.
+    """
+    preferences = preferences or config.DIETARY_PREFERENCES
+    plan_date = plan_date or date.today()
+    if _fresh_roll(preferences, plan_date) < config.MEAL_LIBRARY_FRESH_SHARE:
+        metrics.LIBRARY_PLANS.inc(result="fresh")
+        return None
+    try:
+        plan_text = get_library().assemble(preferences, plan_date)
+    except sqlite3.Error as e:
+        print(f"Meal library unavailable, generating instead: {e}")
+        plan_text = None
+    metrics.LIBRARY_PLANS.inc(result="miss" if plan_text is None else "assembled")
+    return plan_text
+
+def harvest(plan_text, preferences=None):
+    """Add a validated plan's meals to the process-wide library; failures only cost reuse"""
+    try:
+        return get_library().harvest(plan_text, preferences or config.DIETARY_PREFERENCES)
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Could not add the plan's meals to the library: {e}")
+        return 0
+
+if __name__ == "__main__":
+    with MealLibrary() as library:
+        counts = library.counts()
+    for (diet_type, complexity, protein_focus, slot), count in sorted(counts.items()):
+        print(f"{diet_type:12} {complexity:8} {protein_focus or '-':8} {slot:10} {count:6}")
+    print(f"{sum(counts.values())} meals")
@@ -0,0 +1,245 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Import configuration
+import config
+
+_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+_TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames) or not all(name in labels for name in self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple([str(labels[name]) for name in self.labelnames])
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    """Monotonically increasing total, e.g. plans generated or tokens used"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """A value that goes up and down, e.g. queue depth"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    """Distribution of observations in cumulative buckets, plus their sum and count"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, amount, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, amount)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += amount
+            state[2] += 1
+
+    def time(self, **labels):
+        """Observe the duration of the `with` block, even when it raises"""
+        return _Timer(self, labels)
+
+    def value(self, **labels):
+        """(count, sum) of the observations for these labels"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (state[2], state[1]) if state else (0, 0.0)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += bucket_count
+                    le = bound if bound == "+Inf" else _format_value(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, (('le', le),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+class Registry:
+    """The set of metrics exposed together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.setdefault(metric.name, metric)
+        if existing is not metric:
+            raise ValueError(f"metric {metric.name} is already registered")
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=_LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.collect()) + "\n"
+
+REGISTRY = Registry()
+
+# Generation
+GENERATION_SECONDS = REGISTRY.histogram("nutrition_generation_seconds", "Time to generate one diet plan, including retries")
+GENERATION_FAILURES = REGISTRY.counter("nutrition_generation_failures_total", "Diet plans that could not be generated")
+STREAM_ABORTS = REGISTRY.counter("nutrition_stream_aborts_total", "Streamed generations stopped early for breaking dietary constraints")
+VALIDATION_FAILURES = REGISTRY.counter("nutrition_validation_failures_total", "Generated plans failing a validation check", ("kind",))
+MEAL_REPAIRS = REGISTRY.counter("nutrition_meal_repairs_total", "Single meals regenerated after failing validation")
+LIBRARY_PLANS = REGISTRY.counter(
+    "nutrition_meal_library_plans_total", "Plans requested from the meal library (assembled, miss or fresh)", ("result",)
+)
+LLM_CALL_SECONDS = REGISTRY.histogram("nutrition_llm_call_seconds", "Latency of individual model requests")
+LLM_TOKENS = REGISTRY.counter("nutrition_llm_tokens_total", "Tokens used by model requests", ("kind",))
+LLM_TOKENS_PER_CALL = REGISTRY.histogram(
+    "nutrition_llm_tokens_per_call", "Total tokens used by one model request", buckets=_TOKEN_BUCKETS
+)
+PROMPT_TOKENS = REGISTRY.histogram(
+    "nutrition_prompt_tokens", "Counted tokens in each plan prompt, shared prefix and per-profile suffix", ("part",),
+    buckets=_TOKEN_BUCKETS,
+)
+LLM_EVENTS = REGISTRY.counter("nutrition_llm_events_total", "Resilient client events (retries, timeouts, hedges, ...)", ("event",))
+
+# Rendering
+RENDER_SECONDS = REGISTRY.histogram("nutrition_render_seconds", "Time spent turning a plan into email HTML", ("stage",))
+
+# Delivery
+SMTP_SECONDS = REGISTRY.histogram("nutrition_smtp_seconds", "Time spent in each SMTP phase", ("phase",))
+SMTP_FAILURES = REGISTRY.counter("nutrition_smtp_failures_total", "SMTP sends that raised", ("reason",))
+DELIVERIES = REGISTRY.counter("nutrition_deliveries_total", "Plans delivered or failed per subscriber", ("result",))
+
+# HTTP API
+API_REQUESTS = REGISTRY.counter("nutrition_api_requests_total", "HTTP API responses", ("route", "status"))
+API_SECONDS = REGISTRY.histogram("nutrition_api_request_seconds", "HTTP API request latency", ("route",))
+API_COALESCED = REGISTRY.counter("nutrition_api_coalesced_total", "Plan requests that shared an identical in-flight generation")
+
+# Cache, queue and jobs
+CACHE_LOOKUPS = REGISTRY.counter("nutrition_plan_cache_lookups_total", "Plan cache lookups", ("result",))
+QUEUE_DEPTH = REGISTRY.gauge("nutrition_delivery_queue_rows", "Delivery queue rows in each state", ("status",))
+SUBSCRIBERS = REGISTRY.gauge("nutrition_subscribers", "Subscribers served by the last batch")
+JOB_SECONDS = REGISTRY.histogram("nutrition_job_seconds", "Duration of a whole batch run", ("job",))
+LAST_JOB_TIMESTAMP = REGISTRY.gauge("nutrition_last_job_timestamp_seconds", "When a batch run last finished", ("job",))
+
+def write_textfile(path=None):
+    """Atomically write all metrics for a textfile collector (e.g. node_exporter's)"""
+    path = path or config.METRICS_TEXTFILE
+    if not path:
+        return None
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as handle:
+        handle.write(REGISTRY.render())
+    os.replace(temporary, path)
+    return path
+
+def start_http_server(port=None, host="127.0.0.1"):
+    """Serve /metrics on a daemon thread; returns the server, or None when disabled"""
+    port = config.METRICS_HTTP_PORT if port is None else port
+    if not port:
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+@contextmanager
+def job(name):
+    """Time a batch run and export the metrics once it is done"""
+    try:
+        with JOB_SECONDS.time(job=name):
+            yield
+    finally:
+        LAST_JOB_TIMESTAMP.set(time.time(), job=name)
+        try:
+            write_textfile()
+        except OSError as e:
+            print(f"Could not write metrics file: {e}")
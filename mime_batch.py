@@ -0,0 +1,85 @@
+import functools
+import hashlib
+from binascii import b2a_qp
+from dataclasses import dataclass
+from datetime import datetime
+from email import policy
+
+# Import configuration
+import config
+import nutrition_agent
+
+# Headers are folded and encoded as the email package would, with CRLF line endings
+_HEADER_POLICY = policy.compat32.clone(linesep="\r\n")
+_PART_HEADERS = (b'Content-Type: text/%s; charset="utf-8"\r\n'
+                 b"MIME-Version: 1.0\r\n"
+                 b"Content-Transfer-Encoding: quoted-printable\r\n\r\n")
+
+def _quoted_printable(text):
+    """CRLF quoted-printable bytes, from binascii's C encoder"""
+    return b2a_qp(text.replace("\r\n", "\n").replace("\n", "\r\n").encode("utf-8"), istext=True)
+
+@dataclass(frozen=True, slots=True)
+class SharedBody:
+    """One plan's serialized email minus the headers that differ per recipient.
+
+    `head` holds the MIME, Subject and From headers and `body` the
+    multipart/alternative payload, with both parts already quoted-printable
+    encoded, so a message for another recipient is only a byte join.
+    """
+
+    head: bytes
+    body: bytes
+
+    def message_for(self, receiver, message_id=None):
+        """Complete CRLF-terminated message bytes for one recipient"""
+        headers = [self.head, _HEADER_POLICY.fold_binary("To", receiver)]
+        if message_id:
+            headers.append(_HEADER_POLICY.fold_binary("Message-ID", message_id))
+        headers.append(b"\r\n")
+        headers.append(self.body)
+        return b"".join(headers)
+
+def alternative_body(subject, text, html, sender=None, key=None):
+    """Encode a text/HTML multipart/alternative email once, for any number of recipients.
+
+    The boundary is derived from `key` (by default the subject and both
+    bodies), so the same email encodes to the same bytes every time.
+    """
+    # Quoted-printable never emits "=_", so no boundary starting with it can appear inside a part
+    key = key if key is not None else "\0".join((subject, text, html))
+    boundary = b"=_" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:32].encode("ascii")
+    head = b"".join((
+        b'Content-Type: multipart/alternative;\r\n boundary="%s"\r\nMIME-Version: 1.0\r\n' % boundary,
+        _HEADER_POLICY.fold_binary("Subject", subject),
+        _HEADER_POLICY.fold_binary("From", config.EMAIL_SENDER if sender is None else sender),
+    ))
+    body = b"".join((
+        b"--%s\r\n" % boundary, _PART_HEADERS % b"plain", _quoted_printable(text),
+        b"\r\n--%s\r\n" % boundary, _PART_HEADERS % b"html", _quoted_printable(html),
+        b"\r\n--%s--\r\n" % boundary,
+    ))
+    return SharedBody(head, body)
+
+@functools.lru_cache(maxsize=config.MIME_BODY_CACHE_SIZE)
+def _encode(diet_plan, calories, diet_type, current_date, subject, sender, *theme):
+    text, html = nutrition_agent.render_alternatives(
+        diet_plan, {"calories_per_day": calories, "diet_type": diet_type}, current_date
+    )
+    # Keyed on the inputs, which are cheaper to hash than the rendered bodies, so a resent message is byte-identical
+    key = "\0".join((diet_plan, str(calories), diet_type, current_date, subject, sender, *theme))
+    return alternative_body(subject, text, html, sender, key)
+
+def shared_body(diet_plan, preferences=None, current_date=None):
+    """The encoded body for a plan, built once and reused for every recipient with the same targets and date"""
+    preferences = preferences or config.DIETARY_PREFERENCES
+    current_date = current_date or datetime.now().strftime("%A, %B %d, %Y")
+    return _encode(
+        diet_plan, preferences["calories_per_day"], preferences["diet_type"], current_date,
+        config.EMAIL_SUBJECT_TEMPLATE.format(date=current_date), config.EMAIL_SENDER,
+        config.EMAIL_COLOR_PRIMARY, config.EMAIL_COLOR_SECONDARY,
+    )
+
+def render_message(diet_plan, receiver, preferences=None, current_date=None, message_id=None):
+    """Ready-to-send bytes for one recipient: `build_message` serialized with CRLF line endings"""
+    return shared_body(diet_plan, preferences, current_date).message_for(receiver, message_id)
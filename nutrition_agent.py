@@ -1,130 +1,179 @@
-import os
-import smtplib
-import ssl
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from datetime import datetime
-import schedule
 import time
-import json
+import functools
 import re
-
-from agno.agent import Agent
-from agno.models.groq import Groq
+from html import escape
+import threading
+from collections import OrderedDict
 
 # Import configuration
 import config
+import metrics
+from prompt_builder import build_prompt
+from structured_plan import looks_like_json, parse_plan_json
 
-# Initialize the Groq agent with API key
-agent = Agent(model=Groq(id=config.GROQ_MODEL, api_key=config.GROQ_API_KEY), markdown=True)
+# agno, the Groq SDK and the SMTP/MIME modules are imported where they are first
+# needed, so rendering, tests and short-lived workers start without loading them
 
-def generate_diet_plan():
-    """Generate a daily diet plan using the Groq model"""
-    current_date = datetime.now().strftime("%A, %B %d, %Y")
-    
-    # Convert dietary preferences to a string format for the prompt
-    preferences = config.DIETARY_PREFERENCES
-    allergies_str = ", ".join(preferences["allergies"]) if preferences["allergies"] else "None"
-    excluded_foods_str = ", ".join(preferences["excluded_foods"]) if preferences["excluded_foods"] else "None"
-    
-    prompt = f"""
-    Act as a certified nutritionist and diet expert. Create a healthy diet menu for today, {current_date}.
-    
-    Dietary preferences:
-    - Diet type: {preferences['diet_type']}
-    - Target daily calories: {preferences['calories_per_day']}
-    - Allergies to avoid: {allergies_str}
-    - Foods to exclude: {excluded_foods_str}
-    - Meal complexity: {preferences['meal_complexity']}
-    - Protein focus: {preferences['protein_focus']}
-    
-    The menu should:
-    1. Include tamilnadu stylebreakfast, lunch, dinner, and 2 healthy snacks
-    2. Be nutritionally balanced with appropriate macros
-    3. Focus on whole foods and be suitable for weight management
-    4. Include approximate calorie counts for each meal
-    5. Include preparation tips for each meal
-    6. Suggest hydration throughout the day
-    7. For each meal, provide macro information: protein, carbs, and fiber content in grams
-   
-    output format:
-        1.and it shouldnt contain any comments or markdown language make it more readable and userfriendly and presentable.
-        2.make sure no special characters included
-        3.no introduction and conclusion needed.
-        4. Format the response in a clean, organized way with clear section headers.
-        5. For macros, use format like "Protein: 25g | Carbs: 30g | Fiber: 5g" after each meal description.
+def create_agent():
+    """Create a Groq-backed agent from the configured model and API key"""
+    from agno.agent import Agent
+    from agno.models.groq import Groq
+    return Agent(model=Groq(id=config.GROQ_MODEL, api_key=config.GROQ_API_KEY), markdown=True)
+
+_agent = None
+_agent_lock = threading.Lock()
+
+def get_agent():
+    """The shared resilient client, created on first use; it builds Groq agents as calls need them"""
+    global _agent
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                from llm_client import LLMClient
+                _agent = LLMClient(create_agent)
+    return _agent
+
+def __getattr__(name):
+    # Keep `nutrition_agent.agent` working without constructing the client at import time
+    if name == "agent":
+        return get_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def plan_prompt(preferences=None, plan_date=None):
+    """The prompt for one profile and day, steering away from dishes the profile was served lately"""
+    avoid_dishes = None
+    if config.PLAN_HISTORY_ENABLED:
+        from plan_history import recently_served
+        avoid_dishes = recently_served(preferences, plan_date)
+    return build_prompt(preferences, plan_date.strftime("%A, %B %d, %Y") if plan_date else None, avoid_dishes)
+
+def generate_raw_plan(preferences=None, agent_instance=None, plan_date=None):
+    """Generate a daily diet plan using the Groq model, without validating it"""
+    if config.STREAMING_GENERATION:
+        from streaming import generate_streaming
+        return generate_streaming(preferences, agent_instance, plan_date)
+    prompt = plan_prompt(preferences, plan_date)
+    return (agent_instance or get_agent()).run(prompt).content
+
+def generate_diet_plan(preferences=None, agent_instance=None, plan_date=None):
+    """Generate a daily diet plan, from the meal library when it can cover the preferences, else with the Groq model.
+
+    Generated plans have failing meals regenerated (see plan_validator) and
+    their meals added to the library.
     """
-    
-    response = agent.run(prompt)
-    return response.content
+    if config.MEAL_LIBRARY_ENABLED:
+        from meal_library import plan_from_library
+        diet_plan = plan_from_library(preferences, plan_date)
+        if diet_plan is not None:
+            return diet_plan
+    with metrics.GENERATION_SECONDS.time():
+        try:
+            diet_plan = generate_raw_plan(preferences, agent_instance, plan_date)
+            if config.VALIDATE_PLANS:
+                from plan_validator import validate_and_repair
+                diet_plan = validate_and_repair(diet_plan, preferences, agent_instance, plan_date)
+            if config.MEAL_LIBRARY_ENABLED:
+                from meal_library import harvest
+                harvest(diet_plan, preferences)
+        except Exception:
+            metrics.GENERATION_FAILURES.inc()
+            raise
+    return diet_plan
+
+# Line item kinds produced by parse_diet_content
+MACROS = "macros"
+CALORIES = "calories"
+TIP = "tip"
+TEXT = "text"
+
+# Main headers (BREAKFAST, LUNCH, etc.), matched against the upper-cased line start
+_HEADER_PREFIXES = ("BREAKFAST", "LUNCH", "DINNER", "SNACK", "MORNING SNACK", "EVENING SNACK", "HYDRATION", "WATER")
+_HEADER_PREFIX_LEN = max(len(prefix) for prefix in _HEADER_PREFIXES)
+
+# One anchored pass per line: a full "Protein/Carbs/Fiber" macro line wins over
+# a calorie count anywhere in the line, exactly like separate searches in that order
+_LINE_RE = re.compile(
+    r'(?:.*?protein:?\s*(?P<protein>\d+)\s*g.*carbs?:?\s*(?P<carbs>\d+)\s*g.*fiber:?\s*(?P<fiber>\d+)\s*g'
+    r'|.*?(?P<calories>\d+)\s*(?:kcal|calories|cal))',
+    re.IGNORECASE,
+)
 
-def process_diet_content(diet_text):
-    # Identify meal sections
+def is_section_header(line):
+    """Whether a stripped line starts a new section (BREAKFAST, LUNCH, ...)"""
+    return line[:_HEADER_PREFIX_LEN].upper().startswith(_HEADER_PREFIXES)
+
+def section_icon(section):
+    """Choose the icon shown next to a section header"""
+    upper = section.upper()
+    if "BREAKFAST" in upper:
+        return "🍳"
+    if "LUNCH" in upper:
+        return "🍛"
+    if "DINNER" in upper:
+        return "🍽️"
+    if "SNACK" in upper:
+        return "🥜"
+    if "HYDRATION" in upper or "WATER" in upper:
+        return "💧"
+    return "🍳"  # Default icon
+
+def classify_line(line):
+    """Classify one content line as a (kind, value) item"""
+    match = _LINE_RE.match(line)
+    if match:
+        if match.group("protein") is not None:
+            return (MACROS, (match.group("protein"), match.group("carbs"), match.group("fiber")))
+        return (CALORIES, match.group("calories"))
+    lowered = line.lower()
+    # Check if line is a preparation tip
+    if "tip" in lowered or "prepare" in lowered or "cook" in lowered:
+        return (TIP, line)
+    return (TEXT, line)
+
+def parse_diet_content(diet_text):
+    """Split a free-text plan into sections of typed line items.
+
+    Returns a list of (title, icon, items) tuples, where each item is a
+    (kind, value) pair: MACROS -> (protein, carbs, fiber), CALORIES -> count,
+    TIP/TEXT -> the line itself. Lines before the first header are dropped and
+    a repeated header restarts its section in place. An empty list means no
+    headers were found.
+    """
     sections = {}
-    current_section = "General"
-    lines = []
+    items = None
     
     # Parse the content into sections
     for line in diet_text.split('\n'):
         line = line.strip()
         if not line:
             continue
-            
-        # Detect main headers (BREAKFAST, LUNCH, etc.)
-        header_match = re.match(r'^(BREAKFAST|LUNCH|DINNER|SNACK|MORNING SNACK|EVENING SNACK|HYDRATION|WATER).*$', line.upper())
-        if header_match:
-            current_section = line
-            sections[current_section] = []
-        else:
-            if current_section in sections:
-                sections[current_section].append(line)
-            else:
-                lines.append(line)
+        if line[:_HEADER_PREFIX_LEN].upper().startswith(_HEADER_PREFIXES):
+            items = sections[line] = []
+        elif items is not None:
+            items.append(classify_line(line))
     
-    # If no sections were found, return the original text with basic formatting
-    if not sections:
-        return f"<p>{diet_text.replace(chr(10), '<br>')}</p>"
-    
-    # Build HTML with sections
-    html = ""
+    return [(title, section_icon(title), items) for title, items in sections.items()]
+
+def render_diet_content(sections):
+    """Render parsed sections to the HTML placed inside the email body"""
+    parts = []
+    append = parts.append
     
     # Process each section
-    for section, content in sections.items():
-        icon = "🍳"  # Default icon
-        
-        # Choose appropriate icon for section
-        if "BREAKFAST" in section.upper():
-            icon = "🍳"
-        elif "LUNCH" in section.upper():
-            icon = "🍛"
-        elif "DINNER" in section.upper():
-            icon = "🍽️"
-        elif "SNACK" in section.upper():
-            icon = "🥜"
-        elif "HYDRATION" in section.upper() or "WATER" in section.upper():
-            icon = "💧"
-        
+    for section, icon, content in sections:
         # Add section header
-        html += f"""
+        append(f"""
         <div class="meal-section">
             <h2><span class="meal-icon">{icon}</span> {section}</h2>
             <div class="meal-content">
-        """
+        """)
         
         # Process content
-        for line in content:
-            # Try to detect calorie information
-            calorie_match = re.search(r'(\d+)\s*(?:kcal|calories|cal)', line, re.IGNORECASE)
-            
-            # Try to detect macro information (protein, carbs, fiber)
-            macro_match = re.search(r'(?:protein|proteins|carbs|carbohydrates|fiber|fibre)[^\d]*(\d+).*g', line, re.IGNORECASE)
-            macro_full_match = re.search(r'protein:?\s*(\d+)\s*g.*carbs?:?\s*(\d+)\s*g.*fiber:?\s*(\d+)\s*g', line, re.IGNORECASE)
-            
-            if macro_full_match:
-                protein = macro_full_match.group(1)
-                carbs = macro_full_match.group(2)
-                fiber = macro_full_match.group(3)
-                html += f"""
+        for kind, value in content:
+            if kind == MACROS:
+                protein, carbs, fiber = value
+                append(f"""
                 <div class="macro-box">
                     <div class="macro-item">
                         <span class="macro-icon">🥩</span>
@@ -142,33 +191,107 @@ def process_diet_content(diet_text):
                         <span class="macro-value">{fiber}g</span>
                     </div>
                 </div>
-                """
-            elif calorie_match:
-                calorie_count = calorie_match.group(1)
-                html += f'<div class="calorie-info">{calorie_count} calories</div>'
-            # Check if line is a preparation tip
-            elif "tip" in line.lower() or "prepare" in line.lower() or "cook" in line.lower():
-                html += f'<div class="prep-tip"><span class="tip-icon">💡</span> {line}</div>'
+                """)
+            elif kind == CALORIES:
+                append(f'<div class="calorie-info">{value} calories</div>')
+            elif kind == TIP:
+                append(f'<div class="prep-tip"><span class="tip-icon">💡</span> {value}</div>')
             else:
-                html += f'<p>{line}</p>'
+                append(f'<p>{value}</p>')
         
-        html += """
+        append("""
             </div>
         </div>
-        """
+        """)
     
-    return html
+    return "".join(parts)
 
-def get_html_template(current_date, diet_plan):
-    """Create the HTML email template without f-strings to avoid syntax issues"""
-    # Get the nicely formatted content
-    diet_content = process_diet_content(diet_plan)
+def plan_to_sections(plan):
+    """Convert a structured DietPlan into the sections consumed by render_diet_content"""
+    sections = []
+    for meal in plan.meals:
+        items = [
+            (TEXT, f"{item.name} ({item.kcal} kcal)" if item.kcal is not None else item.name)
+            for item in meal.items
+        ]
+        items.append((CALORIES, str(meal.kcal)))
+        items.append((MACROS, (str(meal.protein), str(meal.carbs), str(meal.fiber))))
+        items.extend((TIP, tip) for tip in meal.tips)
+        sections.append((meal.name, section_icon(meal.name), items))
+    if plan.hydration:
+        sections.append(("Hydration", section_icon("Hydration"), [(TEXT, line) for line in plan.hydration]))
+    if plan.tips:
+        sections.append(("Tips", "💡", [(TIP, tip) for tip in plan.tips]))
+    return sections
+
+# Sections and content HTML rendered while a plan streamed in, by plan text, so its email reuses them
+_PRERENDERED_PLANS = 64
+_prerendered = OrderedDict()
+_prerendered_lock = threading.Lock()
+
+def remember_rendered(diet_text, sections, html):
+    """Keep a plan's already parsed sections and rendered content for when its email is built"""
+    with _prerendered_lock:
+        _prerendered[diet_text] = (sections, html)
+        _prerendered.move_to_end(diet_text)
+        while len(_prerendered) > _PRERENDERED_PLANS:
+            _prerendered.popitem(last=False)
+
+def _rendered(diet_text):
+    with _prerendered_lock:
+        return _prerendered.get(diet_text)
+
+def plan_sections(diet_text):
+    """Parse a plan into sections, from structured JSON when possible, else from free text"""
+    rendered = _rendered(diet_text)
+    if rendered is not None:
+        return rendered[0]
+    if looks_like_json(diet_text):
+        try:
+            return plan_to_sections(parse_plan_json(diet_text))
+        except ValueError as e:
+            print(f"Structured plan rejected, falling back to text parser: {e}")
+    return parse_diet_content(diet_text)
+
+def process_diet_content(diet_text, sections=None):
+    """Render a plan as HTML sections; pass `sections` when the plan is already parsed"""
+    rendered = _rendered(diet_text)
+    if rendered is not None:
+        return rendered[1]
+    with metrics.RENDER_SECONDS.time(stage="content"):
+        if sections is None:
+            sections = plan_sections(diet_text)
     
-    primary_color = config.EMAIL_COLOR_PRIMARY
-    secondary_color = config.EMAIL_COLOR_SECONDARY
-    diet_type = config.DIETARY_PREFERENCES['diet_type'].title()
-    calories = config.DIETARY_PREFERENCES['calories_per_day']
+        # If no sections were found, return the original text with basic formatting
+        if not sections:
+            return f"<p>{diet_text.replace(chr(10), '<br>')}</p>"
     
+        return render_diet_content(sections)
+
+def render_plain_text(sections):
+    """Render parsed sections as the text/plain alternative of the email body"""
+    lines = []
+    append = lines.append
+    for section, icon, content in sections:
+        append(f"{icon} {section}")
+        for kind, value in content:
+            if kind == MACROS:
+                protein, carbs, fiber = value
+                append(f"   🥩 Protein {protein}g | 🍚 Carbs {carbs}g | 🌱 Fiber {fiber}g")
+            elif kind == CALORIES:
+                append(f"   {value} calories")
+            elif kind == TIP:
+                append(f"   💡 {value}")
+            else:
+                append(f"   {value}")
+        append("")
+    return "\n".join(lines)
+
+# Per-message values are marked in the shell with <!--slot:name--> and filled in by get_html_template
+_SLOT_RE = re.compile(r'<!--slot:(\w+)-->')
+
+def _render_shell(primary_color, secondary_color):
+    """Render the static email shell (head, CSS, header/footer chrome) for one theme"""
     html = f"""<!DOCTYPE html>
 <html>
 <head>
@@ -371,22 +494,22 @@ def get_html_template(current_date, diet_plan):
         <div class="container">
             <div class="header">
                 <h1>Your Daily Nutrition Plan</h1>
-                <div class="date">{current_date}</div>
+                <div class="date"><!--slot:current_date--></div>
             </div>
             <div class="content">
                 <div class="daily-summary">
                     <h3>Daily Nutritional Goals</h3>
                     <div class="summary-grid">
                         <div class="summary-item">
-                            <div class="summary-value">{calories}</div>
+                            <div class="summary-value"><!--slot:calories--></div>
                             <div class="summary-label">Calories</div>
                         </div>
                         <div class="summary-item">
-                            <div class="summary-value">{int(calories * 0.25 / 4)}g</div>
+                            <div class="summary-value"><!--slot:protein_target-->g</div>
                             <div class="summary-label">Protein Target</div>
                         </div>
                         <div class="summary-item">
-                            <div class="summary-value">{int(calories * 0.5 / 4)}g</div>
+                            <div class="summary-value"><!--slot:carbs_target-->g</div>
                             <div class="summary-label">Carbs Target</div>
                         </div>
                         <div class="summary-item">
@@ -397,7 +520,7 @@ def get_html_template(current_date, diet_plan):
                 </div>
                 
                 <div class="diet-content">
-                    {diet_content}
+                    <!--slot:diet_content-->
                 </div>
                 <div class="quote">
                     "Let food be thy medicine, and medicine be thy food." — Hippocrates
@@ -405,8 +528,8 @@ def get_html_template(current_date, diet_plan):
             </div>
             <div class="footer">
                 <p>Personalized for your wellness journey</p>
-                <span class="diet-specs">{diet_type}</span>
-                <span class="diet-specs">{calories} calories</span>
+                <span class="diet-specs"><!--slot:diet_type--></span>
+                <span class="diet-specs"><!--slot:calories--> calories</span>
                 <p style="margin-top: 15px;">Generated by AI Nutritionist Assistant. Please consult with a healthcare professional for personalized advice.</p>
             </div>
         </div>
@@ -416,74 +539,245 @@ def get_html_template(current_date, diet_plan):
     
     return html
 
-def send_email(diet_plan):
-    """Send the diet plan via email"""
-    current_date = datetime.now().strftime("%A, %B %d, %Y")
+@functools.lru_cache(maxsize=None)
+def _template_fragments(primary_color, secondary_color):
+    """Split the shell for a theme once into alternating static text and slot names"""
+    fragments = _SLOT_RE.split(_render_shell(primary_color, secondary_color))
+    return tuple(fragments[0::2]), tuple(fragments[1::2])
+
+def _summary_values(current_date, preferences):
+    """Per-message values shared by the HTML and plain-text bodies"""
+    calories = preferences['calories_per_day']
+    return {
+        "current_date": current_date,
+        "calories": str(calories),
+        "protein_target": str(int(calories * 0.25 / 4)),
+        "carbs_target": str(int(calories * 0.5 / 4)),
+        "diet_type": preferences['diet_type'].title(),
+    }
+
+def get_html_template(current_date, diet_plan, preferences=None, sections=None):
+    """Fill the cached email shell for the configured theme with one message's content"""
+    # Get the nicely formatted content
+    diet_content = process_diet_content(diet_plan, sections)
+    
+    started = time.perf_counter()
+    # Preferences may come from API requests, so every slot but the rendered content is escaped
+    values = {slot: escape(value) for slot, value in
+              _summary_values(current_date, preferences or config.DIETARY_PREFERENCES).items()}
+    values["diet_content"] = diet_content
+    
+    statics, slots = _template_fragments(config.EMAIL_COLOR_PRIMARY, config.EMAIL_COLOR_SECONDARY)
+    parts = [statics[0]]
+    for slot, static in zip(slots, statics[1:]):
+        parts.append(values[slot])
+        parts.append(static)
+    html = "".join(parts)
+    metrics.RENDER_SECONDS.observe(time.perf_counter() - started, stage="template")
+    return html
+
+def get_text_template(current_date, diet_plan, preferences=None, sections=None):
+    """The plain-text alternative of the email, from the same parsed sections as the HTML"""
+    if sections is None:
+        sections = plan_sections(diet_plan)
+    values = _summary_values(current_date, preferences or config.DIETARY_PREFERENCES)
+    content = render_plain_text(sections) if sections else diet_plan
+    return (
+        f"Your Daily Nutrition Plan\n{values['current_date']}\n\n"
+        f"Daily Nutritional Goals: {values['calories']} calories | Protein {values['protein_target']}g | "
+        f"Carbs {values['carbs_target']}g | Fiber 25-30g\n\n"
+        f"{content.rstrip()}\n\n"
+        f"Personalized for your wellness journey: {values['diet_type']}, {values['calories']} calories\n"
+        "Generated by AI Nutritionist Assistant. Please consult with a healthcare professional for personalized advice.\n"
+    )
+
+def render_alternatives(diet_plan, preferences=None, current_date=None):
+    """The plain-text and HTML bodies of a plan's email, rendered from one parse"""
+    current_date = current_date or datetime.now().strftime("%A, %B %d, %Y")
+    sections = plan_sections(diet_plan)
+    return (get_text_template(current_date, diet_plan, preferences, sections),
+            get_html_template(current_date, diet_plan, preferences, sections))
+
+def build_message(diet_plan, receiver, preferences=None, current_date=None, message_id=None):
+    """Build the MIME message carrying a rendered diet plan, as plain text and HTML alternatives"""
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    current_date = current_date or datetime.now().strftime("%A, %B %d, %Y")
     
     # Create email message
     message = MIMEMultipart("alternative")
     message["Subject"] = config.EMAIL_SUBJECT_TEMPLATE.format(date=current_date)
     message["From"] = config.EMAIL_SENDER
-    message["To"] = config.EMAIL_RECEIVER
+    message["To"] = receiver
+    if message_id:
+        message["Message-ID"] = message_id
     
-    # Create HTML version of message
-    html = get_html_template(current_date, diet_plan)
+    # Clients show the last alternative they can display, so HTML goes last
+    text, html = render_alternatives(diet_plan, preferences, current_date)
+    message.attach(MIMEText(text, "plain", "utf-8"))
+    message.attach(MIMEText(html, "html", "utf-8"))
+    return message
+
+def send_email(diet_plan, receiver=None, preferences=None, pool=None, current_date=None, message_id=None):
+    """Send the diet plan via email, over a pooled connection when one is given"""
+    from mime_batch import render_message
+    current_date = current_date or datetime.now().strftime("%A, %B %d, %Y")
+    receiver = receiver or config.EMAIL_RECEIVER
+    # Recipients of the same plan share one encoded body
+    message = render_message(diet_plan, receiver, preferences, current_date, message_id)
     
-    # Attach parts to email
-    part = MIMEText(html, "html")
-    message.attach(part)
+    if pool is not None:
+        try:
+            pool.sendmail(config.EMAIL_SENDER, receiver, message)
+            print(f"✓ Email sent successfully to {receiver} on {current_date}")
+            return True
+        except Exception as e:
+            print(f"Error sending email to {receiver}: {e}")
+            return False
     
     # Create secure connection and send email
+    import smtplib
+    import ssl
     context = ssl.create_default_context()
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
+    with metrics.SMTP_SECONDS.time(phase="connect"):
+        server = smtplib.SMTP_SSL(config.SMTP_HOST, config.SMTP_PORT, context=context)
+    with server:
         try:
-            server.login(config.EMAIL_SENDER, config.EMAIL_PASSWORD)
-            server.sendmail(config.EMAIL_SENDER, config.EMAIL_RECEIVER, message.as_string())
-            print(f"✓ Email sent successfully on {current_date}")
+            with metrics.SMTP_SECONDS.time(phase="login"):
+                server.login(config.EMAIL_SENDER, config.EMAIL_PASSWORD)
+            with metrics.SMTP_SECONDS.time(phase="send"):
+                server.sendmail(config.EMAIL_SENDER, receiver, message)
+            print(f"✓ Email sent successfully to {receiver} on {current_date}")
             return True
         except Exception as e:
+            metrics.SMTP_FAILURES.inc(reason="error")
             print(f"Error sending email: {e}")
             return False
 
 def nutrition_job():
-    """Generate and send daily nutrition plan"""
+    """Generate and send daily nutrition plan, exporting metrics and pruning plan history when done"""
+    with metrics.job("daily"):
+        _nutrition_job()
+    if config.PLAN_HISTORY_ENABLED:
+        from plan_history import get_history
+        get_history().prune()
+
+def _nutrition_job():
+    # Fan out to every registered subscriber when the registry is populated
+    from subscribers import SubscriberRegistry, merge_preferences
+    with SubscriberRegistry() as registry:
+        subscribers = registry.list_subscribers()
+    metrics.SUBSCRIBERS.set(len(subscribers) or 1)
+    if config.DELIVERY_QUEUE_ENABLED:
+        # Tracked per subscriber and date, so a rerun only finishes what is missing
+        from delivery_queue import run_queued
+        run_queued(subscribers or [{"email": config.EMAIL_RECEIVER, "preferences": merge_preferences()}])
+        return
+    if subscribers:
+        from fanout import run_fanout
+        run_fanout(subscribers)
+        return
+    
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Generating daily nutrition plan...")
-    diet_plan = generate_diet_plan()
+    try:
+        diet_plan = generate_diet_plan()
+    except Exception as e:
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Failed to generate nutrition plan: {e}")
+        return
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Sending nutrition plan via email...")
     success = send_email(diet_plan)
+    metrics.DELIVERIES.inc(result="sent" if success else "failed")
+    if success and config.PLAN_HISTORY_ENABLED:
+        from plan_history import record_delivery
+        record_delivery(config.EMAIL_RECEIVER, None, diet_plan)
     
     if success:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Daily nutrition plan delivered successfully!")
     else:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Failed to deliver nutrition plan.")
 
+def _run_logged(callback, due):
+    try:
+        callback(due)
+    except Exception as e:
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Scheduled job failed: {e}")
+
+def scheduled_subscribers():
+    """Registered subscribers with their send times, or the configured receiver when there are none"""
+    from subscribers import SubscriberRegistry, merge_preferences
+    with SubscriberRegistry() as registry:
+        subscribers = registry.list_subscribers()
+    return subscribers or [{
+        "email": config.EMAIL_RECEIVER,
+        "preferences": merge_preferences(),
+        "send_time": config.DAILY_SEND_TIME,
+        "timezone": config.DEFAULT_TIMEZONE,
+    }]
+
 def setup_scheduler():
-    """Set up the scheduler to run at specified times"""
-    # Schedule to run at the configured time
-    schedule.every().day.at(config.DAILY_SEND_TIME).do(nutrition_job)
-    print(f"Nutrition agent scheduled to run daily at {config.DAILY_SEND_TIME}")
+    """Set up the scheduler to run at each subscriber's send time"""
+    from concurrent.futures import ThreadPoolExecutor
+    from batch_generation import pregenerate
+    from delivery_queue import process_queue, run_queued
+    from fanout import run_fanout
+    from timer_scheduler import DeliveryScheduler, TimerScheduler
+    
+    # Jobs run on worker threads so a long batch never delays the next deadline
+    executor = ThreadPoolExecutor(max_workers=config.SCHEDULER_JOB_WORKERS)
+    timer = TimerScheduler(dispatch=lambda callback, due: executor.submit(_run_logged, callback, due))
+    deliver = run_queued if config.DELIVERY_QUEUE_ENABLED else run_fanout
+    def deliver_group(subscribers, plan_date):
+        with metrics.job("scheduled"):
+            metrics.SUBSCRIBERS.set(len(subscribers))
+            deliver(subscribers, plan_date=plan_date)
+    
+    deliveries = DeliveryScheduler(
+        timer,
+        scheduled_subscribers,
+        deliver=deliver_group,
+        # Pregenerated plans only reach deliveries through the plan cache
+        pregenerate=(lambda subscribers, plan_date: pregenerate(subscribers, start_date=plan_date, days=1))
+        if config.PLAN_CACHE_ENABLED else None,
+    )
+    groups = deliveries.start()
+    metrics.start_http_server()
+    if config.DELIVERY_QUEUE_ENABLED:
+        # Retry failed deliveries once their backoff has passed, and resume any left by a crash
+        timer.schedule_every(config.DELIVERY_POLL_SECONDS, lambda due: process_queue())
+    if config.PLAN_HISTORY_ENABLED:
+        from plan_history import get_history
+        timer.schedule_every(24 * 3600, lambda due: get_history().prune())
+    first = datetime.fromtimestamp(timer.next_due()).strftime('%Y-%m-%d %H:%M')
+    print(f"Nutrition agent scheduled {groups} send time group(s); next job at {first}")
     
     # For testing/demonstration purposes, run immediately if configured
     if config.RUN_TEST_ON_START:
         print("Running initial nutrition plan now for testing...")
         nutrition_job()
     
-    # Keep the script running
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # Check every minute
+    # Sleep until exactly the next due job
+    timer.run_forever()
 
 if __name__ == "__main__":
     import sys
     
+    # Run the async pipeline instead of the blocking one
+    use_async = "--async" in sys.argv[1:]
+    if use_async:
+        import asyncio
+        from async_pipeline import async_nutrition_job, run_scheduler_async
+    
     # Check for test-only flag
-    if len(sys.argv) > 1 and sys.argv[1] == "--test-only":
+    if "--test-only" in sys.argv[1:]:
         print("=" * 60)
         print("TESTING NUTRITION FOOD ALERT AGENT (WITHOUT SCHEDULING)")
         print(f"Diet Type: {config.DIETARY_PREFERENCES['diet_type']}")
         print(f"Target Calories: {config.DIETARY_PREFERENCES['calories_per_day']}")
         print("=" * 60)
-        nutrition_job()
+        if use_async:
+            asyncio.run(async_nutrition_job())
+        else:
+            nutrition_job()
     else:
         print("=" * 60)
         print("Starting Nutrition Food Alert Agent...")
@@ -491,4 +785,7 @@ if __name__ == "__main__":
         print(f"Target Calories: {config.DIETARY_PREFERENCES['calories_per_day']}")
         print(f"Send Time: {config.DAILY_SEND_TIME}")
         print("=" * 60)
-        setup_scheduler() 
\ No newline at end of file
+        if use_async:
+            asyncio.run(run_scheduler_async())
+        else:
+            setup_scheduler()
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from datetime import date
+
+# Import configuration
+import config
+import metrics
+
+def _normalize_list(values):
+    return sorted({str(value).strip().lower() for value in values or [] if str(value).strip()})
+
+def _normalized_profile(preferences, model_id=None):
+    return {
+        "diet_type": str(preferences["diet_type"]).strip().lower(),
+        "calories": int(preferences["calories_per_day"]),
+        "allergies": _normalize_list(preferences["allergies"]),
+        "excluded_foods": _normalize_list(preferences["excluded_foods"]),
+        "complexity": str(preferences["meal_complexity"]).strip().lower(),
+        "protein_focus": str(preferences["protein_focus"]).strip().lower(),
+        "model": model_id or config.GROQ_MODEL,
+    }
+
+def _digest(key):
+    encoded = json.dumps(key, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+def plan_fingerprint(preferences, plan_date=None, model_id=None):
+    """Content-address a plan by everything that goes into its prompt.
+
+    Subscribers whose preferences only differ in casing, ordering or duplicate
+    list entries share one fingerprint, and therefore one generated plan.
+    """
+    key = _normalized_profile(preferences, model_id)
+    key["date"] = (plan_date or date.today()).isoformat()
+    return _digest(key)
+
+def profile_fingerprint(preferences, model_id=None):
+    """Fingerprint of the preference profile alone, independent of the date"""
+    return _digest(_normalized_profile(preferences, model_id))
+
+class PlanCache:
+    """On-disk plan cache with TTL expiry, LRU eviction and hit/miss counters"""
+
+    def __init__(self, path=None, ttl_seconds=None, max_entries=None):
+        self.path = path or config.PLAN_CACHE_DB
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else config.PLAN_CACHE_TTL_HOURS * 3600
+        self.max_entries = max_entries or config.PLAN_CACHE_MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> [lock, callers holding or waiting on it]; dropped once the last caller is done
+        self._key_locks = {}
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS plan_cache (
+                key TEXT PRIMARY KEY,
+                plan TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                expires_at REAL
+            )"""
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(plan_cache)")}
+        if "expires_at" not in columns:
+            self.conn.execute("ALTER TABLE plan_cache ADD COLUMN expires_at REAL")
+        self.conn.execute(
+            "UPDATE plan_cache SET expires_at = created_at + ? WHERE expires_at IS NULL", (self.ttl_seconds,)
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS plan_cache_accessed ON plan_cache (accessed_at)")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, key):
+        """Return the cached plan for `key`, or None if it is missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute("SELECT plan, expires_at FROM plan_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or now > row[1]:
+                if row is not None:
+                    self.conn.execute("DELETE FROM plan_cache WHERE key = ?", (key,))
+                    self.conn.commit()
+                self.misses += 1
+                metrics.CACHE_LOOKUPS.inc(result="miss")
+                return None
+            self.conn.execute("UPDATE plan_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            metrics.CACHE_LOOKUPS.inc(result="hit")
+            return row[0]
+
+    def put(self, key, plan, ttl_seconds=None):
+        """Store a plan and evict the least recently used entries over capacity.
+
+        `ttl_seconds` overrides the default lifetime, e.g. for plans generated
+        days ahead of their delivery date.
+        """
+        now = time.time()
+        expires_at = now + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO plan_cache (key, plan, created_at, accessed_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, plan, now, now, expires_at),
+            )
+            self.conn.execute("DELETE FROM plan_cache WHERE expires_at < ?", (now,))
+            self.conn.execute(
+                """DELETE FROM plan_cache WHERE key IN (
+                    SELECT key FROM plan_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+            self.conn.commit()
+
+    def get_or_generate(self, preferences, generate, plan_date=None):
+        """Return the cached plan for these preferences, generating it at most once.
+
+        Concurrent callers with the same fingerprint wait on a per-key lock so
+        only the first one calls `generate(preferences)`; the lock is dropped
+        when the last of them is done, so the table only holds keys in flight.
+        """
+        key = plan_fingerprint(preferences, plan_date)
+        with self._lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                plan = self.get(key)
+                if plan is None:
+                    plan = generate(preferences)
+                    self.put(key, plan)
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[key]
+        return plan
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
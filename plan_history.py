@@ -0,0 +1,407 @@
+import hashlib
+import re
+import sqlite3
+import sys
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from datetime import date, timedelta
+
+# Import configuration
+import config
+import nutrition_agent
+from plan_cache import profile_fingerprint
+from structured_plan import looks_like_json, parse_plan_json
+
+# Preset dictionary for compressing plans: plans are short, so most of their
+# redundancy is with other plans rather than within themselves
+_ZDICT = b"""
+BREAKFAST
+MORNING SNACK
+LUNCH
+EVENING SNACK
+DINNER
+HYDRATION
+Drink 8 to 10 glasses of water spread through the day
+Start the morning with warm water and lemon
+Calories: kcal
+Protein: g | Carbs: g | Fiber: g
+Tip: Prepare with minimal oil and fresh curry leaves
+{"meals": [{"name": "Breakfast", "items": [{"name": "", "kcal": }], "kcal": , "protein": , "carbs": , "fiber": , "tips": [""]}],
+"hydration": [""], "tips": [""]}
+idli dosa ragi sambar chutney coconut pongal upma adai avial poriyal kootu rasam curd rice brown rice
+chapati kurma millet kambu koozh idiyappam vegetable stew sundal chickpeas buttermilk sprouts salad
+"""
+_FORMAT = b"\x01"  # leading byte of compressed bodies, so the dictionary can change later
+
+# Dish names are cut at an explanation, calorie count or quantity: "- Ragi dosa (2) - 300 kcal" -> "ragi dosa"
+_BULLETS = "-*•·0123456789.) \t"
+_DISH_END_RE = re.compile(r'[(:|]| - |\d+\s*k?cal', re.IGNORECASE)
+_MAX_DISH_LENGTH = 60
+_DIGIT_RE = re.compile(r"\d")
+_NOT_DISHES = ("tip", "prepare", "preparation", "cook", "note", "calories", "total", "protein", "macros", "approx")
+
+def _compress(text):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 15, 8, zlib.Z_DEFAULT_STRATEGY, _ZDICT)
+    return _FORMAT + compressor.compress(text.encode("utf-8")) + compressor.flush()
+
+def _decompress(blob):
+    decompressor = zlib.decompressobj(zdict=_ZDICT)
+    return (decompressor.decompress(blob[1:]) + decompressor.flush()).decode("utf-8")
+
+def _profile_key(preferences):
+    # 60 bits of the fingerprint fit a SQLite integer and keep the index small
+    return int(profile_fingerprint(preferences)[:15], 16)
+
+def dish_names(plan_text):
+    """Short, lower-cased names of the dishes in a plan, in order and without duplicates"""
+    if looks_like_json(plan_text):
+        try:
+            lines = [item.name for meal in parse_plan_json(plan_text).meals for item in meal.items]
+        except ValueError:
+            lines = []
+    else:
+        # Scanned directly rather than parsed: the parser files "Idli with sambar - 250 kcal" as a calorie count
+        lines = []
+        in_meal = False
+        for line in plan_text.split("\n"):
+            line = line.strip()
+            if nutrition_agent.is_section_header(line):
+                in_meal = not line.upper().startswith(("HYDRATION", "WATER"))
+            elif in_meal and line and not line.lstrip(_BULLETS).lower().startswith(_NOT_DISHES):
+                lines.append(line)
+    names = {}
+    for line in lines:
+        name = line.lstrip(_BULLETS)
+        end = _DISH_END_RE.search(name)
+        name = (name[:end.start()] if end else name).strip().lower()
+        if len(name) > _MAX_DISH_LENGTH:
+            name = name[:_MAX_DISH_LENGTH].rsplit(" ", 1)[0]
+        if len(name) > 2:
+            names[name] = None
+    return list(names)
+
+def meal_nutrients(plan_text):
+    """Per-meal (kcal, protein, carbs, fiber) of a plan, packed as unsigned shorts, four per meal.
+
+    As in the validator, a meal's largest calorie line is its total; a meal
+    without a macro line counts 0 g. Hydration and sections without numbers
+    are left out, so a plan without any numbers packs to nothing.
+    """
+    meals = None
+    if looks_like_json(plan_text):
+        try:
+            meals = {meal.name: [meal.kcal, (meal.protein, meal.carbs, meal.fiber)]
+                     for meal in parse_plan_json(plan_text).meals}
+        except ValueError:
+            pass
+    if meals is None:
+        # Sections keyed like parse_diet_content, but only lines with digits are classified
+        meals = {}
+        numbers = None
+        for line in plan_text.split("\n"):
+            line = line.strip()
+            if nutrition_agent.is_section_header(line):
+                numbers = meals[line] = [0, None]
+            elif numbers is not None and _DIGIT_RE.search(line):
+                kind, value = nutrition_agent.classify_line(line)
+                if kind == nutrition_agent.CALORIES:
+                    numbers[0] = max(numbers[0], int(value))
+                elif kind == nutrition_agent.MACROS and numbers[1] is None:
+                    numbers[1] = value
+    values = array("H")
+    for title, (kcal, macros) in meals.items():
+        if (kcal or macros) and not title.upper().startswith(("HYDRATION", "WATER")):
+            values.extend(min(int(number), 0xFFFF) for number in (kcal, *(macros or (0, 0, 0))))
+    return values.tobytes()
+
+class PlanHistory:
+    """Compact SQLite archive of the plans each subscriber was sent.
+
+    A plan shared by several subscribers (same profile and day) is stored
+    once, zlib-compressed against a preset dictionary, and each subscriber's
+    delivery points at it. Dish names are interned into a dictionary table
+    and kept per plan as a packed array of ids, so the dishes served to a
+    profile recently can be read without decompressing anything. Each
+    plan's per-meal nutrients are packed the same way, for weekly reports.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.PLAN_HISTORY_DB
+        self._lock = threading.Lock()
+        self._dish_ids = OrderedDict()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # Bounded page cache, however many subscribers' history is read
+        self.conn.execute(f"PRAGMA cache_size=-{int(config.PLAN_HISTORY_CACHE_KIB)}")
+        self.conn.executescript(
+            """CREATE TABLE IF NOT EXISTS dishes (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS plans (
+                id INTEGER PRIMARY KEY,
+                profile INTEGER NOT NULL,
+                plan_date INTEGER NOT NULL,
+                digest BLOB NOT NULL UNIQUE,
+                body BLOB,
+                dishes BLOB NOT NULL,
+                nutrients BLOB
+            );
+            CREATE INDEX IF NOT EXISTS plans_profile ON plans (profile, plan_date);
+            CREATE TABLE IF NOT EXISTS deliveries (
+                email TEXT NOT NULL,
+                plan_date INTEGER NOT NULL,
+                plan_id INTEGER NOT NULL,
+                PRIMARY KEY (email, plan_date)
+            ) WITHOUT ROWID;"""
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(plans)")}
+        if "nutrients" not in columns:
+            # Filled in from the stored text when a report first needs it
+            self.conn.execute("ALTER TABLE plans ADD COLUMN nutrients BLOB")
+        # Covers a day's deliveries (the key adds the email), so reports read a week without the table
+        self.conn.execute("CREATE INDEX IF NOT EXISTS deliveries_date ON deliveries (plan_date, plan_id)")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _intern(self, names):
+        """Dish ids for `names`, adding new names; recently used ids stay in a bounded in-memory map"""
+        ids = []
+        for name in names:
+            dish_id = self._dish_ids.get(name)
+            if dish_id is None:
+                self.conn.execute("INSERT OR IGNORE INTO dishes (name) VALUES (?)", (name,))
+                dish_id = self.conn.execute("SELECT id FROM dishes WHERE name = ?", (name,)).fetchone()[0]
+                self._dish_ids[name] = dish_id
+                if len(self._dish_ids) > config.PLAN_HISTORY_DISH_CACHE:
+                    self._dish_ids.popitem(last=False)
+            else:
+                self._dish_ids.move_to_end(name)
+            ids.append(dish_id)
+        return array("I", ids).tobytes()
+
+    def record_many(self, deliveries):
+        """Store (email, plan_date, plan_text, preferences) deliveries in one transaction"""
+        with self._lock:
+            for email, plan_date, plan_text, preferences in deliveries:
+                profile = _profile_key(preferences)
+                day = plan_date.toordinal()
+                digest = hashlib.sha256(f"{profile}:{day}:{plan_text}".encode("utf-8")).digest()[:16]
+                row = self.conn.execute("SELECT id FROM plans WHERE digest = ?", (digest,)).fetchone()
+                if row is None:
+                    plan_id = self.conn.execute(
+                        "INSERT INTO plans (profile, plan_date, digest, body, dishes, nutrients) VALUES (?, ?, ?, ?, ?, ?)",
+                        (profile, day, digest, _compress(plan_text), self._intern(dish_names(plan_text)),
+                         meal_nutrients(plan_text)),
+                    ).lastrowid
+                else:
+                    plan_id = row[0]
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO deliveries (email, plan_date, plan_id) VALUES (?, ?, ?)",
+                    (email.strip().lower(), day, plan_id),
+                )
+            self.conn.commit()
+
+    def record(self, email, plan_date, plan_text, preferences):
+        self.record_many([(email, plan_date, plan_text, preferences)])
+
+    def plan_for(self, email, plan_date):
+        """The plan sent to `email` on `plan_date`, or None if there is none (or it was compacted)"""
+        with self._lock:
+            row = self.conn.execute(
+                """SELECT plans.body FROM deliveries JOIN plans ON plans.id = deliveries.plan_id
+                   WHERE deliveries.email = ? AND deliveries.plan_date = ?""",
+                (email.strip().lower(), plan_date.toordinal()),
+            ).fetchone()
+        return _decompress(row[0]) if row is not None and row[0] is not None else None
+
+    def recent_dishes(self, preferences, plan_date=None, days=None, limit=None):
+        """Dishes served to this profile in the `days` before `plan_date`, most recent first"""
+        day = (plan_date or date.today()).toordinal()
+        days = config.PLAN_HISTORY_AVOID_DAYS if days is None else days
+        limit = config.PLAN_HISTORY_AVOID_MAX if limit is None else limit
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT dishes FROM plans WHERE profile = ? AND plan_date >= ? AND plan_date < ? ORDER BY plan_date DESC",
+                (_profile_key(preferences), day - days, day),
+            ).fetchall()
+            ids = {}
+            for (packed,) in rows:
+                for dish_id in array("I", packed):
+                    ids[dish_id] = None
+                if len(ids) >= limit:
+                    break
+            ids = list(ids)[:limit]
+            if not ids:
+                return []
+            names = dict(self.conn.execute(
+                f"SELECT id, name FROM dishes WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall())
+        return [names[dish_id] for dish_id in ids if dish_id in names]
+
+    def iter_deliveries(self, since=None, batch_size=1000):
+        """Yield (email, plan_date, plan_text or None) from `since` on, reading `batch_size` rows at a time.
+
+        Uses its own read connection, so memory stays bounded and writers are
+        not blocked however much history is read.
+        """
+        reader = sqlite3.connect(self.path)
+        try:
+            cursor = reader.execute(
+                """SELECT deliveries.email, deliveries.plan_date, plans.body
+                   FROM deliveries JOIN plans ON plans.id = deliveries.plan_id
+                   WHERE deliveries.plan_date >= ? ORDER BY deliveries.plan_date, deliveries.email""",
+                ((since or date.min).toordinal(),),
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for email, day, body in rows:
+                    yield email, date.fromordinal(day), _decompress(body) if body is not None else None
+        finally:
+            reader.close()
+
+    def nutrient_columns(self, first_date, last_date):
+        """Every delivery from `first_date` to `last_date` with its plan's meal nutrients, as flat columns.
+
+        Returns a dict: `emails` lists each address once; `subscriber`,
+        `day` (days since `first_date`) and `plan` are parallel arrays with
+        one entry per delivery, indexing `emails` and the plans; `meals`
+        holds each plan's meal count, and `nutrients` the plans' packed
+        meal values (see `meal_nutrients`) back to back. Plans archived
+        before nutrients were stored are filled in from their text first;
+        compacted ones count as having no meals.
+        """
+        first, last = first_date.toordinal(), last_date.toordinal()
+        emails, subscribers, days, plans = {}, array("i"), array("i"), array("i")
+        plan_index, meals, packed = {}, array("i"), bytearray()
+        with self._lock:
+            missing = self.conn.execute(
+                """SELECT id, body FROM plans WHERE nutrients IS NULL AND body IS NOT NULL
+                   AND id IN (SELECT plan_id FROM deliveries WHERE plan_date BETWEEN ? AND ?)""",
+                (first, last),
+            ).fetchall()
+            if missing:
+                self.conn.executemany("UPDATE plans SET nutrients = ? WHERE id = ?",
+                                      [(meal_nutrients(_decompress(body)), plan_id) for plan_id, body in missing])
+                self.conn.commit()
+            # Read from the date index alone; a plan's nutrients are fetched once below, not per subscriber
+            cursor = self.conn.execute(
+                "SELECT email, plan_date, plan_id FROM deliveries WHERE plan_date BETWEEN ? AND ?", (first, last)
+            )
+            for email, day, plan_id in cursor:
+                subscriber = emails.get(email)
+                if subscriber is None:
+                    subscriber = emails[email] = len(emails)
+                index = plan_index.get(plan_id)
+                if index is None:
+                    index = plan_index[plan_id] = len(plan_index)
+                subscribers.append(subscriber)
+                days.append(day - first)
+                plans.append(index)
+            nutrients = dict(self.conn.execute(
+                """SELECT id, nutrients FROM plans WHERE id IN (
+                       SELECT DISTINCT plan_id FROM deliveries WHERE plan_date BETWEEN ? AND ?)""",
+                (first, last),
+            ))
+        for plan_id in plan_index:
+            values = nutrients.get(plan_id) or b""
+            meals.append(len(values) // 8)
+            packed += values
+        return {"emails": list(emails), "subscriber": subscribers, "day": days, "plan": plans,
+                "meals": meals, "nutrients": bytes(packed)}
+
+    def prune(self, retention_days=None, keep_text_days=None, today=None, vacuum=False):
+        """Apply retention: drop plan text after `keep_text_days`, and whole records after `retention_days`.
+
+        Dish lists and nutrients outlive the text, so older days still count
+        towards variety and reports. Returns how many plans were dropped and compacted.
+        """
+        today = (today or date.today()).toordinal()
+        retention_days = config.PLAN_HISTORY_RETENTION_DAYS if retention_days is None else retention_days
+        keep_text_days = config.PLAN_HISTORY_KEEP_TEXT_DAYS if keep_text_days is None else keep_text_days
+        with self._lock:
+            self.conn.execute("DELETE FROM deliveries WHERE plan_date < ?", (today - retention_days,))
+            dropped = self.conn.execute("DELETE FROM plans WHERE plan_date < ?", (today - retention_days,)).rowcount
+            compacted = self.conn.execute(
+                "UPDATE plans SET body = NULL WHERE plan_date < ? AND body IS NOT NULL", (today - keep_text_days,)
+            ).rowcount
+            self.conn.commit()
+            if vacuum:
+                self.conn.execute("VACUUM")
+        return {"dropped": dropped, "compacted": compacted}
+
+    def stats(self):
+        with self._lock:
+            plans, stored = self.conn.execute("SELECT COUNT(*), COUNT(body) FROM plans").fetchone()
+            deliveries = self.conn.execute("SELECT COUNT(*) FROM deliveries").fetchone()[0]
+            dishes = self.conn.execute("SELECT COUNT(*) FROM dishes").fetchone()[0]
+            pages, page_size = (self.conn.execute(f"PRAGMA {pragma}").fetchone()[0] for pragma in ("page_count", "page_size"))
+        return {"deliveries": deliveries, "plans": plans, "plans_with_text": stored, "dishes": dishes,
+                "size_bytes": pages * page_size}
+
+_history = None
+_history_lock = threading.Lock()
+
+def get_history():
+    """The process-wide plan history, opened on first use"""
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = PlanHistory()
+        return _history
+
+def record_delivery(email, plan_date, plan_text, preferences=None):
+    """Archive a sent plan; a failure here never fails the delivery"""
+    try:
+        get_history().record(email, plan_date or date.today(), plan_text, preferences or config.DIETARY_PREFERENCES)
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Could not archive the plan sent to {email}: {e}")
+
+def recently_served(preferences=None, plan_date=None):
+    """Dishes this profile was served lately, for the prompt's "do not repeat" list"""
+    try:
+        return get_history().recent_dishes(preferences or config.DIETARY_PREFERENCES, plan_date)
+    except sqlite3.Error as e:
+        print(f"Plan history unavailable: {e}")
+        return []
+
+if __name__ == "__main__":
+    # Usage:
+    #   python plan_history.py stats
+    #   python plan_history.py show EMAIL [YYYY-MM-DD]
+    #   python plan_history.py resend EMAIL [YYYY-MM-DD]
+    #   python plan_history.py prune [--vacuum]
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    with PlanHistory() as history:
+        if command in ("show", "resend"):
+            email = sys.argv[2]
+            plan_date = date.fromisoformat(sys.argv[3]) if len(sys.argv) > 3 else date.today() - timedelta(days=1)
+            plan = history.plan_for(email, plan_date)
+            if plan is None:
+                print(f"No archived plan for {email} on {plan_date}")
+                sys.exit(1)
+            if command == "show":
+                print(plan)
+            else:
+                from subscribers import SubscriberRegistry, merge_preferences
+                with SubscriberRegistry() as registry:
+                    preferences = next((subscriber["preferences"] for subscriber in registry.list_subscribers()
+                                        if subscriber["email"].lower() == email.lower()), merge_preferences())
+                nutrition_agent.send_email(plan, email, preferences, current_date=plan_date.strftime("%A, %B %d, %Y"))
+        elif command == "prune":
+            print(history.prune(vacuum="--vacuum" in sys.argv[2:]))
+        for name, value in history.stats().items():
+            print(f"{name}: {value}")
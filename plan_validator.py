@@ -0,0 +1,342 @@
+import functools
+import json
+import re
+from dataclasses import dataclass, field
+
+# Import configuration
+import config
+import metrics
+import nutrition_agent
+from structured_plan import _meal, looks_like_json, parse_plan_json
+
+# Ingredients that count as each allergen or food group, so "dairy" also catches paneer and ghee
+INGREDIENT_SYNONYMS = {
+    "dairy": ["milk", "curd", "yogurt", "yoghurt", "paneer", "ghee", "butter", "buttermilk", "cheese", "cream",
+              "khoa", "lassi", "raita", "kheer", "payasam", "whey", "mor", "dahi", "malai"],
+    "nuts": ["almond", "cashew", "walnut", "pistachio", "hazelnut", "pecan", "macadamia", "badam", "kaju"],
+    "peanut": ["groundnut", "peanut butter", "nilakadalai", "moongphali"],
+    "gluten": ["wheat", "maida", "atta", "rava", "semolina", "sooji", "suji", "chapati", "chapathi", "roti",
+               "paratha", "parotta", "poori", "bread", "pasta", "barley", "rye", "seitan", "semiya", "vermicelli"],
+    "egg": ["omelette", "omelet", "mayonnaise", "meringue"],
+    "soy": ["soya", "tofu", "edamame", "tempeh", "miso"],
+    "fish": ["salmon", "tuna", "sardine", "mackerel", "anchovy", "nethili", "meen", "pomfret", "seer fish"],
+    "shellfish": ["prawn", "shrimp", "crab", "lobster", "squid", "mussel", "oyster", "clam"],
+    "meat": ["chicken", "mutton", "lamb", "beef", "pork", "goat", "bacon", "ham", "keema"],
+    "sesame": ["til", "gingelly", "ellu", "tahini"],
+}
+# Other names subscribers use for the same groups
+_GROUP_ALIASES = {
+    "milk": "dairy", "lactose": "dairy", "nut": "nuts", "tree nut": "nuts", "tree nuts": "nuts",
+    "wheat": "gluten", "eggs": "egg", "soya": "soy", "seafood": ("fish", "shellfish"), "non-veg": ("meat", "fish", "shellfish"),
+    "non veg": ("meat", "fish", "shellfish"), "peanuts": "peanut", "groundnut": "peanut",
+}
+
+# Phrasings that mention a food in order to rule it out, e.g. "nut-free" or "without peanuts". The negation
+# must sit directly next to the food: "do not overcook the paneer" and "replace rice with paneer" still serve it
+_NEGATED_BEFORE = re.compile(
+    r'\b(?:no|without|avoid(?:ing)?|free\s+of|instead\s+of|skip(?:ping)?|excluding)[\s:]+$'
+)
+_NEGATED_AFTER = re.compile(r'\s*-?\s*free\b')
+# Plant-based stand-ins named after dairy ("almond milk", "coconut cream", "peanut butter")
+_PLANT_BEFORE = re.compile(
+    r'\b(?:almond|cashew|coconut|oat|soy|soya|rice|peanut|cocoa|vegan|plant[\s-]based)[\s-]+$'
+)
+_DAIRY_WORDS = frozenset(["dairy", *INGREDIENT_SYNONYMS["dairy"]])
+_NEGATION_WINDOW = 24
+
+# Default targets mirror the ones printed in the email
+NUTRIENT_TARGETS = {
+    "calories": lambda calories: calories,
+    "protein": lambda calories: calories * 0.25 / 4,
+    "carbs": lambda calories: calories * 0.5 / 4,
+}
+
+_UNITS = {"calories": "kcal", "protein": "g protein", "carbs": "g carbs"}
+
+class PlanValidationError(ValueError):
+    """A plan still breaks a subscriber's allergies or exclusions after all repairs"""
+
+@dataclass(slots=True)
+class Violation:
+    kind: str  # "allergy", "excluded", "calories", "protein" or "carbs"
+    meal: str | None  # section title to regenerate, or None for the whole plan
+    detail: str
+    target: int | None = None  # what the regenerated meal should come to, for nutrient violations
+
+@dataclass(slots=True)
+class ValidationResult:
+    violations: list[Violation] = field(default_factory=list)
+    totals: dict = field(default_factory=dict)
+
+    @property
+    def ok(self):
+        return not self.violations
+
+    @property
+    def unsafe(self):
+        """Whether any violation is an allergy or exclusion rather than a nutrient miss"""
+        return any(violation.kind in ("allergy", "excluded") for violation in self.violations)
+
+def _trie_regex(words):
+    """Compile words into one regex shaped like their trie, so shared prefixes are matched once"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def pattern(node):
+        end = "" in node
+        branches = [re.escape(char) + pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if end else body
+    return pattern(trie)
+
+def normalize_term(term):
+    return " ".join(str(term).strip().lower().split())
+
+def expand_term(term):
+    """A constraint term plus every ingredient it covers"""
+    groups = _GROUP_ALIASES.get(term, term)
+    if isinstance(groups, str):
+        groups = (groups,)
+    expanded = {term}
+    for group in groups:
+        if group in INGREDIENT_SYNONYMS:
+            expanded.add(group)
+            expanded.update(INGREDIENT_SYNONYMS[group])
+    return expanded
+
+class ConstraintMatcher:
+    """Finds allergens and excluded foods, including their synonyms and plurals, in plan text.
+
+    All terms are compiled into a single trie-shaped regex, so a plan is
+    scanned once however many constraints a subscriber has. Mentions that
+    rule a food out ("nut-free", "without eggs") are ignored, and so are
+    dairy words naming plant-based stand-ins ("almond milk").
+    """
+
+    def __init__(self, allergies=(), excluded_foods=()):
+        self.labels = {}
+        for kind, terms in (("excluded", excluded_foods), ("allergy", allergies)):
+            for term in terms:
+                term = normalize_term(term)
+                if term:
+                    for word in expand_term(term):
+                        self.labels[word] = (kind, term)
+        self._mention = None
+        if self.labels:
+            # Optional trie branches are greedy, so "peanut butter" wins over "peanut".
+            # Matching runs on lower-cased text, which is much faster than IGNORECASE
+            words = _trie_regex(self.labels)
+            self._mention = re.compile(rf'\b(?:{words})(?:e?s)?\b')
+
+    def _label(self, matched):
+        for candidate in (matched, matched[:-1], matched[:-2]):
+            if candidate in self.labels:
+                return self.labels[candidate]
+        return ("excluded", matched)
+
+    @staticmethod
+    def _dairy(matched):
+        return any(candidate in _DAIRY_WORDS for candidate in (matched, matched[:-1], matched[:-2]))
+
+    def find(self, text):
+        """Every (kind, constraint, matched text) mentioned in `text`, in order"""
+        if self._mention is None:
+            return []
+        lowered = text.lower()
+        found = []
+        for match in self._mention.finditer(lowered):
+            start, end = match.span()
+            window = max(0, start - _NEGATION_WINDOW)
+            if (_NEGATED_BEFORE.search(lowered, window, start) or _NEGATED_AFTER.match(lowered, end)
+                    or (_PLANT_BEFORE.search(lowered, window, start) and self._dairy(match.group()))):
+                continue
+            found.append((*self._label(match.group()), text[start:end]))
+        return found
+
+    def check_line(self, line):
+        """The first food in `line` the subscriber must not get, or None"""
+        found = self.find(line)
+        return found[0][2].lower() if found else None
+
+@functools.lru_cache(maxsize=1024)
+def _compiled(allergies, excluded_foods):
+    return ConstraintMatcher(allergies, excluded_foods)
+
+def compile_constraints(preferences):
+    """The (cached) matcher for a subscriber's allergies and excluded foods"""
+    return _compiled(
+        tuple(sorted({normalize_term(term) for term in preferences.get("allergies", [])})),
+        tuple(sorted({normalize_term(term) for term in preferences.get("excluded_foods", [])})),
+    )
+
+def _sections(plan_text):
+    """Parsed sections, plus the text of each one to search for allergens"""
+    if looks_like_json(plan_text):
+        try:
+            sections = nutrition_agent.plan_to_sections(parse_plan_json(plan_text))
+            return sections, lambda: {
+                title: "\n".join([title, *(value for kind, value in items if kind in (nutrition_agent.TEXT, nutrition_agent.TIP))])
+                for title, _, items in sections
+            }
+        except ValueError:
+            pass
+    return nutrition_agent.parse_diet_content(plan_text), lambda: _section_texts(plan_text)
+
+def _section_texts(plan_text):
+    """Raw lines of each text section, keyed like parse_diet_content (a repeated header restarts it)"""
+    texts = {}
+    lines = None
+    for line in plan_text.split("\n"):
+        line = line.strip()
+        if nutrition_agent.is_section_header(line):
+            lines = texts[line] = [line]
+        elif lines is not None:
+            lines.append(line)
+    return {title: "\n".join(lines) for title, lines in texts.items()}
+
+def _meal_numbers(items):
+    """(kcal, protein, carbs) for one section; the largest calorie line is taken as the meal total"""
+    kcal = protein = carbs = None
+    for kind, value in items:
+        if kind == nutrition_agent.CALORIES:
+            kcal = max(kcal or 0, int(value))
+        elif kind == nutrition_agent.MACROS and protein is None:
+            protein, carbs = int(value[0]), int(value[1])
+    return {"calories": kcal, "protein": protein, "carbs": carbs}
+
+def validate_plan(plan_text, preferences=None):
+    """Check a plan against a subscriber's allergies, exclusions and daily targets.
+
+    Allergen hits are attributed to the meal they appear in. Day totals of
+    calories, protein and carbs are compared with the targets within
+    VALIDATION_KCAL_TOLERANCE / VALIDATION_MACRO_TOLERANCE; a miss is pinned on
+    the meal that contributes most to it, with the amount that meal should
+    have instead. Plans without numbers skip the nutrient checks.
+    """
+    preferences = preferences or config.DIETARY_PREFERENCES
+    result = ValidationResult()
+    sections, section_texts = _sections(plan_text)
+    matcher = compile_constraints(preferences)
+
+    if matcher.find(plan_text):
+        # Rare, and followed by a model call, so attributing hits to meals need not be fast
+        for title, text in section_texts().items():
+            for kind, constraint, matched in matcher.find(text):
+                result.violations.append(Violation(kind, title, f"contains {matched!r} ({constraint})"))
+        if not result.violations and not sections:
+            # The raw text is sent when there are no sections, so only a full regeneration helps
+            kind, constraint, matched = matcher.find(plan_text)[0]
+            result.violations.append(Violation(kind, None, f"contains {matched!r} ({constraint})"))
+
+    meals = {title: _meal_numbers(items) for title, _, items in sections
+             if not title.upper().startswith(("HYDRATION", "WATER"))}
+    calories = int(preferences["calories_per_day"])
+    for nutrient, target_for in NUTRIENT_TARGETS.items():
+        values = {title: numbers[nutrient] for title, numbers in meals.items() if numbers[nutrient] is not None}
+        if not values:
+            continue
+        total = sum(values.values())
+        target = target_for(calories)
+        result.totals[nutrient] = total
+        tolerance = config.VALIDATION_KCAL_TOLERANCE if nutrient == "calories" else config.VALIDATION_MACRO_TOLERANCE
+        difference = total - target
+        if abs(difference) > tolerance * target:
+            # The biggest meal has the most room to absorb the difference either way
+            title = max(values, key=values.get)
+            result.violations.append(Violation(
+                nutrient, title, f"brings the day to {total} {_UNITS[nutrient]} against a target of {target:.0f}",
+                max(0, round(values[title] - difference)),
+            ))
+    for violation in result.violations:
+        metrics.VALIDATION_FAILURES.inc(kind=violation.kind)
+    return result
+
+def build_meal_prompt(preferences, title, problems, targets, structured=False):
+    """Prompt regenerating one meal of a plan, naming what was wrong with it"""
+    allergies = ", ".join(preferences["allergies"]) or "none"
+    excluded = ", ".join(preferences["excluded_foods"]) or "none"
+    target_list = ", ".join(f"{nutrient} about {value}" for nutrient, value in targets.items())
+    if structured:
+        output = (f'Reply with only a JSON object for this meal, with "name": "{title}", "items" (each with "name" '
+                  f'and "kcal"), "kcal", "protein", "carbs", "fiber" and "tips". No markdown or commentary.')
+    else:
+        output = (f'Reply with only this meal: a first line containing exactly "{title}", then the dishes, a '
+                  f'"Calories: N kcal" line, a "Protein: Ng | Carbs: Ng | Fiber: Ng" line and a "Tip:" line. '
+                  f'No other meals, comments or markdown.')
+    return (
+        f"Act as a certified nutritionist. Replace only the {title} of a daily Tamil Nadu style diet menu.\n"
+        f"Profile: diet {preferences['diet_type']}; allergies: {allergies}; exclude: {excluded}; "
+        f"complexity {preferences['meal_complexity']}\n"
+        f"The previous {title} was rejected because it {'; '.join(problems)}.\n"
+        f"Targets for the new {title}: {target_list or 'none beyond the profile'}\n"
+        f"{output}\n"
+    )
+
+def _replace_text_section(plan_text, title, replacement):
+    """Swap the lines of the (last) section titled `title` for `replacement`"""
+    lines = plan_text.split("\n")
+    start = max(index for index, line in enumerate(lines) if line.strip() == title)
+    end = next((index for index in range(start + 1, len(lines)) if nutrition_agent.is_section_header(lines[index].strip())),
+               len(lines))
+    new_lines = [line for line in replacement.strip().split("\n")]
+    # Keep the original title even if the model dropped or reworded it
+    if new_lines and nutrition_agent.is_section_header(new_lines[0].strip()):
+        new_lines = new_lines[1:]
+    trailing = [""] if end < len(lines) else []
+    return "\n".join(lines[:start + 1] + new_lines + trailing + lines[end:])
+
+def _replace_json_meal(plan_text, title, replacement):
+    plan = parse_plan_json(plan_text)
+    index = next(index for index, meal in enumerate(plan.meals) if meal.name == title)
+    plan.meals[index] = _meal(json.loads(replacement.strip().strip("`").removeprefix("json")), index)
+    return plan.to_json()
+
+def regenerate_meal(plan_text, title, violations, preferences, agent_instance=None):
+    """Ask the model for a new version of one meal and splice it into the plan"""
+    structured = looks_like_json(plan_text)
+    targets = {violation.kind: violation.target for violation in violations if violation.target is not None}
+    prompt = build_meal_prompt(preferences, title, [violation.detail for violation in violations], targets, structured)
+    replacement = (agent_instance or nutrition_agent.get_agent()).run(prompt).content
+    metrics.MEAL_REPAIRS.inc()
+    if structured:
+        return _replace_json_meal(plan_text, title, replacement)
+    return _replace_text_section(plan_text, title, replacement)
+
+def validate_and_repair(plan_text, preferences=None, agent_instance=None, plan_date=None):
+    """Return a plan that passes validation, regenerating only the failing meals.
+
+    Up to VALIDATION_MAX_REPAIRS rounds each regenerate every failing meal
+    (or the whole plan, when a problem is outside any meal). If allergens or
+    excluded foods remain after that, PlanValidationError is raised so the
+    plan is never sent; remaining nutrient misses are only logged.
+    """
+    preferences = preferences or config.DIETARY_PREFERENCES
+    result = validate_plan(plan_text, preferences)
+    for _ in range(config.VALIDATION_MAX_REPAIRS):
+        if result.ok:
+            return plan_text
+        if any(violation.meal is None for violation in result.violations):
+            print(f"Plan failed validation ({result.violations[0].detail}), regenerating it")
+            plan_text = nutrition_agent.generate_raw_plan(preferences, agent_instance, plan_date)
+        else:
+            by_meal = {}
+            for violation in result.violations:
+                by_meal.setdefault(violation.meal, []).append(violation)
+            for title, violations in by_meal.items():
+                print(f"{title} failed validation ({'; '.join(v.detail for v in violations)}), regenerating it")
+                try:
+                    plan_text = regenerate_meal(plan_text, title, violations, preferences, agent_instance)
+                except (ValueError, StopIteration) as e:
+                    print(f"Could not splice the regenerated {title}: {e}")
+        result = validate_plan(plan_text, preferences)
+    if result.unsafe:
+        raise PlanValidationError(f"plan still violates dietary constraints: {result.violations[0].detail}")
+    if not result.ok:
+        print(f"Sending plan despite nutrient targets missed: {'; '.join(v.detail for v in result.violations)}")
+    return plan_text
@@ -0,0 +1,119 @@
+import functools
+import re
+import sys
+from datetime import datetime
+
+# Import configuration
+import config
+import metrics
+from structured_plan import JSON_OUTPUT_INSTRUCTIONS
+
+# Identical for every plan request, so providers with prefix caching can reuse it across calls.
+# Everything that varies (profile, date, dishes to avoid) goes after it
+PLAN_INSTRUCTIONS = (
+    "Act as a certified nutritionist. Create a healthy one-day Tamil Nadu style diet menu for the profile and date below: "
+    "breakfast, morning snack, lunch, evening snack, dinner and hydration advice. Keep it balanced, whole-food based and "
+    "suited to weight management. Give each meal's approximate calories, protein, carbs and fiber in grams, and a "
+    "preparation tip. Avoid the allergies and excluded foods, and any recently served dishes listed.\n"
+)
+
+TEXT_OUTPUT_INSTRUCTIONS = (
+    "Output plain text without markdown, special characters, comments, introduction or conclusion. Put each meal's name "
+    'and HYDRATION in capitals on their own lines, each meal followed by its dishes, "Calories: N kcal", "Protein: Ng | Carbs: Ng | Fiber: Ng" and '
+    '"Tip: ...".\n'
+)
+
+# Roughly how tiktoken splits text before merging byte pairs: words with their leading space,
+# runs of up to three digits, punctuation runs and whitespace
+_PRETOKEN_RE = re.compile(r"'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+")
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    # tiktoken is imported on the first count, so importing this module stays cheap
+    try:
+        import tiktoken
+    except ImportError:  # Counts fall back to an approximation of the same pre-tokenizer
+        return None
+    return tiktoken.get_encoding(config.PROMPT_TOKENIZER)
+
+def tokenizer_name():
+    """The tokenizer `count_tokens` uses: a tiktoken encoding, or "approximate" without tiktoken"""
+    return config.PROMPT_TOKENIZER if _encoding() is not None else "approximate"
+
+def count_tokens(text):
+    """Tokens in `text` under PROMPT_TOKENIZER when tiktoken is installed, else an estimate.
+
+    The estimate counts pre-tokens, plus one for every further eight
+    characters of a long word. It tracks real counts closely enough to
+    compare prompts, not to bill them.
+    """
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return sum(1 + (len(piece) - 1) // 8 for piece in _PRETOKEN_RE.findall(text))
+
+@functools.lru_cache(maxsize=None)
+def _prefix_tokens(prefix):
+    return count_tokens(prefix)
+
+def instruction_prefix(structured=None):
+    """The shared, byte-identical start of every plan prompt"""
+    structured = config.STRUCTURED_PLAN_OUTPUT if structured is None else structured
+    return PLAN_INSTRUCTIONS + (JSON_OUTPUT_INSTRUCTIONS if structured else TEXT_OUTPUT_INSTRUCTIONS)
+
+def _listed(values):
+    return ", ".join(values) or "none"
+
+def profile_line(preferences):
+    """One profile's dietary preferences on a single line"""
+    return (
+        f"diet {preferences['diet_type']}; {preferences['calories_per_day']} kcal/day; "
+        f"allergies: {_listed(preferences['allergies'])}; exclude: {_listed(preferences['excluded_foods'])}; "
+        f"complexity {preferences['meal_complexity']}; protein focus {preferences['protein_focus']}"
+    )
+
+def profile_suffix(preferences=None, current_date=None, avoid_dishes=None):
+    """The per-request end of a plan prompt: profile, date and dishes not to repeat"""
+    preferences = preferences or config.DIETARY_PREFERENCES
+    current_date = current_date or datetime.now().strftime("%A, %B %d, %Y")
+    suffix = f"Profile: {profile_line(preferences)}\nDate: {current_date}\n"
+    if avoid_dishes:
+        suffix += f"Recently served: {'; '.join(avoid_dishes)}\n"
+    return suffix
+
+def build_prompt(preferences=None, current_date=None, avoid_dishes=None):
+    """The diet plan prompt: the shared instruction prefix, then this profile's suffix"""
+    prefix = instruction_prefix()
+    suffix = profile_suffix(preferences, current_date, avoid_dishes)
+    metrics.PROMPT_TOKENS.observe(_prefix_tokens(prefix), part="prefix")
+    metrics.PROMPT_TOKENS.observe(count_tokens(suffix), part="suffix")
+    return prefix + suffix
+
+def token_report(prompt):
+    """Characters and tokens of a prompt, split at the shared instruction prefix when it has one"""
+    prefix = next((prefix for prefix in map(instruction_prefix, (False, True)) if prompt.startswith(prefix)), "")
+    prefix_tokens = _prefix_tokens(prefix) if prefix else 0
+    total = count_tokens(prompt)
+    return {
+        "tokenizer": tokenizer_name(),
+        "chars": len(prompt),
+        "tokens": total,
+        "prefix_tokens": prefix_tokens,
+        "suffix_tokens": total - prefix_tokens,
+        "cacheable_share": prefix_tokens / total if total else 0.0,
+    }
+
+if __name__ == "__main__":
+    # Usage: python prompt_builder.py [--json]
+    structured = "--json" in sys.argv[1:]
+    config.STRUCTURED_PLAN_OUTPUT = structured or config.STRUCTURED_PLAN_OUTPUT
+    avoid_dishes = None
+    if config.PLAN_HISTORY_ENABLED:
+        from plan_history import recently_served
+        avoid_dishes = recently_served(config.DIETARY_PREFERENCES)
+    prompt = build_prompt(avoid_dishes=avoid_dishes)
+    print(prompt)
+    report = token_report(prompt)
+    print(f"--- {report['chars']} characters, {report['tokens']} tokens ({report['tokenizer']}): "
+          f"{report['prefix_tokens']} in the shared prefix ({report['cacheable_share']:.0%}), "
+          f"{report['suffix_tokens']} for this profile")
@@ -0,0 +1,299 @@
+import queue
+import re
+import smtplib
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Import configuration
+import config
+import metrics
+
+_STALE_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError, ssl.SSLError)
+_REJECTION_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException)
+_LEADING_DOT_RE = re.compile(rb"(?m)^\.")
+# Marks batch entries not yet sent, so a retry after a dropped connection resumes where it stopped
+_UNSENT = object()
+
+def _data_block(msg):
+    """A CRLF message as sent after DATA: leading dots doubled, then the terminating line"""
+    msg = _LEADING_DOT_RE.sub(b"..", msg)
+    if not msg.endswith(b"\r\n"):
+        msg += b"\r\n"
+    return msg + b".\r\n"
+
+class RateLimiter:
+    """Spaces calls out so no more than `max_per_second` go through"""
+
+    def __init__(self, max_per_second):
+        self.interval = 1.0 / max_per_second if max_per_second else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class SMTPConnectionPool:
+    """A small pool of authenticated SMTP connections reused across messages.
+
+    Connections are opened lazily up to `size`, handed out one per sender and
+    returned after each message. A connection that fails mid-send is discarded
+    and the message is retried once on a fresh one.
+    """
+
+    def __init__(self, host=None, port=None, username=None, password=None,
+                 size=None, use_ssl=None, max_per_second=None, timeout=30):
+        self.host = host or config.SMTP_HOST
+        self.port = port or config.SMTP_PORT
+        self.username = username if username is not None else config.EMAIL_SENDER
+        self.password = password if password is not None else config.EMAIL_PASSWORD
+        self.size = size or config.SMTP_POOL_SIZE
+        self.use_ssl = config.SMTP_USE_SSL if use_ssl is None else use_ssl
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(config.SMTP_MAX_PER_SECOND if max_per_second is None else max_per_second)
+        self.connections_opened = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._closed = False
+        # Whether the server advertises PIPELINING, learned from the first connection send_many uses
+        self._pipelining = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _connect(self):
+        with metrics.SMTP_SECONDS.time(phase="connect"):
+            if self.use_ssl:
+                server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout,
+                                          context=ssl.create_default_context())
+            else:
+                server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.username:
+            with metrics.SMTP_SECONDS.time(phase="login"):
+                server.login(self.username, self.password)
+        with self._lock:
+            self.connections_opened += 1
+        return server
+
+    @staticmethod
+    def _discard(server):
+        try:
+            server.close()
+        except Exception:
+            pass
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                return self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+
+    def _release(self, server):
+        if server is not None:
+            if self._closed:
+                self._discard(server)
+            else:
+                self._idle.put(server)
+        self._slots.release()
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        """Send one message over a pooled connection, reconnecting on failure"""
+        self.rate_limiter.wait()
+        server = self._acquire()
+        try:
+            try:
+                with metrics.SMTP_SECONDS.time(phase="send"):
+                    server.sendmail(from_addr, to_addrs, msg)
+            except _STALE_CONNECTION_ERRORS:
+                # The connection went stale while idle; retry once on a fresh one
+                metrics.SMTP_FAILURES.inc(reason="stale_connection")
+                self._discard(server)
+                server = None
+                server = self._connect()
+                with metrics.SMTP_SECONDS.time(phase="send"):
+                    server.sendmail(from_addr, to_addrs, msg)
+        except _REJECTION_ERRORS:
+            # The server refused this message but the connection is still usable
+            metrics.SMTP_FAILURES.inc(reason="rejected")
+            raise
+        except Exception:
+            metrics.SMTP_FAILURES.inc(reason="error")
+            if server is not None:
+                self._discard(server)
+                server = None
+            raise
+        finally:
+            self._release(server)
+
+    def supports_pipelining(self):
+        """Whether the server advertises PIPELINING; asked once, on a pooled connection"""
+        if self._pipelining is None:
+            server = self._acquire()
+            try:
+                server.ehlo_or_helo_if_needed()
+                self._pipelining = bool(server.has_extn("pipelining"))
+            except Exception:
+                self._discard(server)
+                server = None
+                raise
+            finally:
+                self._release(server)
+        return self._pipelining
+
+    def _send_one(self, from_addr, receiver, msg):
+        try:
+            self.sendmail(from_addr, receiver, msg)
+        except Exception as e:
+            return e
+        return None
+
+    def _send_sequential(self, server, from_addr, messages, results):
+        for index, (receiver, msg) in enumerate(messages):
+            if results[index] is not _UNSENT:
+                continue
+            self.rate_limiter.wait()
+            try:
+                server.sendmail(from_addr, receiver, msg)
+            except _REJECTION_ERRORS as e:
+                metrics.SMTP_FAILURES.inc(reason="rejected")
+                results[index] = e
+            else:
+                results[index] = None
+
+    def _send_pipelined(self, server, from_addr, messages, results):
+        """Send the unsent messages with RFC 2920 command pipelining.
+
+        A message's MAIL, RCPT and DATA go out in one write and its data in
+        the next, together with the following message's commands, so each
+        message costs one round trip instead of four.
+        """
+        envelopes = []
+        for index, (receiver, msg) in enumerate(messages):
+            if results[index] is not _UNSENT:
+                continue
+            try:
+                envelope = f"MAIL FROM:{smtplib.quoteaddr(from_addr)}\r\nRCPT TO:{smtplib.quoteaddr(receiver)}\r\nDATA\r\n"
+                envelopes.append((index, envelope.encode("ascii")))
+            except UnicodeEncodeError as e:
+                # Non-ASCII addresses need SMTPUTF8, which plain sendmail does not negotiate either
+                metrics.SMTP_FAILURES.inc(reason="rejected")
+                results[index] = e
+        if not envelopes:
+            return
+        self.rate_limiter.wait()
+        server.send(envelopes[0][1])
+        for position, (index, _) in enumerate(envelopes):
+            receiver, msg = messages[index]
+            mail, rcpt, data = server.getreply(), server.getreply(), server.getreply()
+            # After a refused DATA the transaction is reset before the next MAIL
+            out = _data_block(msg) if data[0] == 354 else b"RSET\r\n"
+            if position + 1 < len(envelopes):
+                self.rate_limiter.wait()
+                out += envelopes[position + 1][1]
+            server.send(out)
+            code, reply = server.getreply()
+            if mail[0] != 250:
+                error = smtplib.SMTPSenderRefused(mail[0], mail[1], from_addr)
+            elif rcpt[0] not in (250, 251):
+                error = smtplib.SMTPRecipientsRefused({receiver: rcpt})
+            elif data[0] != 354:
+                error = smtplib.SMTPDataError(*data)
+            elif code != 250:
+                error = smtplib.SMTPDataError(code, reply)
+            else:
+                error = None
+            if error is not None:
+                metrics.SMTP_FAILURES.inc(reason="rejected")
+            results[index] = error
+
+    def _send_batch(self, server, from_addr, messages, results):
+        server.ehlo_or_helo_if_needed()
+        with metrics.SMTP_SECONDS.time(phase="batch"):
+            if server.has_extn("pipelining"):
+                self._send_pipelined(server, from_addr, messages, results)
+            else:
+                self._send_sequential(server, from_addr, messages, results)
+
+    def send_batch(self, from_addr, messages):
+        """Send (recipient, message bytes) pairs back to back over one pooled connection.
+
+        Commands are pipelined when the server advertises PIPELINING. Returns
+        one entry per message: None once the server accepted it, or the
+        exception it failed with. A refused message does not stop the rest;
+        if the connection drops, every message not yet confirmed is retried
+        once on a fresh one.
+        """
+        results = [_UNSENT] * len(messages)
+        server = self._acquire()
+        try:
+            try:
+                self._send_batch(server, from_addr, messages, results)
+            except _STALE_CONNECTION_ERRORS:
+                metrics.SMTP_FAILURES.inc(reason="stale_connection")
+                self._discard(server)
+                server = None
+                server = self._connect()
+                self._send_batch(server, from_addr, messages, results)
+        except Exception as e:
+            metrics.SMTP_FAILURES.inc(reason="error")
+            if server is not None:
+                self._discard(server)
+                server = None
+            results = [e if result is _UNSENT else result for result in results]
+        finally:
+            self._release(server)
+        return results
+
+    def send_many(self, from_addr, messages, batch_size=None):
+        """Spread messages over the pool's connections in batches sent with `send_batch`; returns its results in order.
+
+        Without PIPELINING, batching saves nothing, so each message goes
+        through `sendmail` on whichever connection is free instead.
+        """
+        messages = list(messages)
+        if not messages:
+            return []
+        try:
+            pipelining = self.supports_pipelining()
+        except Exception as e:
+            # Like send_batch, a server that cannot be reached fails every message rather than the call
+            metrics.SMTP_FAILURES.inc(reason="error")
+            return [e] * len(messages)
+        if not pipelining:
+            with ThreadPoolExecutor(max_workers=min(self.size, len(messages))) as executor:
+                return list(executor.map(lambda message: self._send_one(from_addr, *message), messages))
+        batch_size = min(batch_size or config.SMTP_PIPELINE_BATCH, -(-len(messages) // self.size))
+        batches = [messages[offset:offset + batch_size] for offset in range(0, len(messages), batch_size)]
+        with ThreadPoolExecutor(max_workers=min(self.size, len(batches))) as executor:
+            return [result for results in executor.map(lambda batch: self.send_batch(from_addr, batch), batches)
+                    for result in results]
+
+    def close(self):
+        """Politely close every idle connection"""
+        self._closed = True
+        while True:
+            try:
+                server = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                server.quit()
+            except Exception:
+                self._discard(server)
@@ -0,0 +1,179 @@
+# Import configuration
+import config
+import metrics
+import nutrition_agent
+from plan_validator import compile_constraints
+
+class ConstraintViolation(Exception):
+    """A streamed plan mentioned a food the subscriber must not get"""
+
+    def __init__(self, term, line):
+        super().__init__(f"plan mentions {term!r}: {line}")
+        self.term = term
+        self.line = line
+
+class IncrementalRenderer:
+    """Parses a plan line by line as it streams in and renders each section as soon as it ends.
+
+    `feed(chunk)` returns the (title, html) fragments completed by that chunk;
+    a repeated header restarts its section, so a later fragment with the same
+    title replaces the earlier one. After `close()`, `html` is exactly what
+    `process_diet_content` returns for the full text, including the JSON and
+    no-header fallbacks, and `sections` what `plan_sections` returns. `check_line(line)`, if given, is called on every
+    completed line and its non-None result raises ConstraintViolation.
+    """
+
+    def __init__(self, check_line=None):
+        self.check_line = check_line
+        self.fragments = {}
+        self._sections = {}
+        self._chunks = []
+        self._pending = ""
+        self._title = None
+        self._items = None
+        self._json = None
+        self._html = None
+        self._parsed = None
+
+    @property
+    def text(self):
+        return "".join(self._chunks)
+
+    def feed(self, chunk):
+        self._chunks.append(chunk)
+        if self._json is None:
+            stripped = (self._pending + chunk).lstrip()
+            if len(stripped) < 3 and "```".startswith(stripped):
+                # Not enough text yet to tell a code fence from a plan
+                self._pending += chunk
+                return []
+            # Structured JSON output cannot be rendered before it is complete
+            self._json = nutrition_agent.looks_like_json(stripped)
+        lines = (self._pending + chunk).split("\n")
+        self._pending = lines.pop()
+        completed = []
+        for line in lines:
+            self._line(line, completed)
+        return completed
+
+    def close(self):
+        """Flush the last line and finish rendering; returns the final fragments"""
+        completed = []
+        self._line(self._pending, completed)
+        self._pending = ""
+        self._finish_section(completed)
+        text = self.text
+        if self._json or not self.fragments:
+            # Same fallbacks as process_diet_content: typed JSON plan, or the raw text
+            self._parsed = nutrition_agent.plan_sections(text)
+            self._html = nutrition_agent.process_diet_content(text, self._parsed)
+        else:
+            self._parsed = list(self._sections.values())
+            self._html = "".join(self.fragments.values())
+        return completed
+
+    @property
+    def html(self):
+        if self._html is None:
+            raise RuntimeError("close() the renderer before reading the final HTML")
+        return self._html
+
+    @property
+    def sections(self):
+        if self._parsed is None:
+            raise RuntimeError("close() the renderer before reading the parsed sections")
+        return self._parsed
+
+    def _line(self, line, completed):
+        line = line.strip()
+        if not line:
+            return
+        if self.check_line is not None:
+            term = self.check_line(line)
+            if term is not None:
+                raise ConstraintViolation(term, line)
+        if self._json:
+            return
+        if nutrition_agent.is_section_header(line):
+            self._finish_section(completed)
+            self._title, self._items = line, []
+        elif self._items is not None:
+            self._items.append(nutrition_agent.classify_line(line))
+
+    def _finish_section(self, completed):
+        if self._title is None:
+            return
+        section = (self._title, nutrition_agent.section_icon(self._title), self._items)
+        html = nutrition_agent.render_diet_content([section])
+        self.fragments[self._title] = html
+        self._sections[self._title] = section
+        completed.append((self._title, html))
+        self._title = self._items = None
+
+def _content_events(stream):
+    """Text deltas from an agno event stream (or any iterable of objects with `content`)"""
+    for event in stream:
+        # agno also sends start/completion events; the completion repeats the whole text
+        if getattr(event, "event", "RunContent") != "RunContent":
+            continue
+        content = getattr(event, "content", None)
+        if isinstance(content, str) and content:
+            yield content
+
+def stream_diet_plan(preferences=None, agent_instance=None, plan_date=None, on_fragment=None):
+    """Generate a plan from the model's token stream, rendering sections as they complete.
+
+    Returns the finished IncrementalRenderer, whose `text` is the plan and
+    `html` the rendered content. `on_fragment(title, html)` is called for each
+    section as soon as it ends. If the stream mentions one of the
+    subscriber's allergies or excluded foods, it is closed immediately so no
+    more tokens are spent, and ConstraintViolation is raised.
+    """
+    preferences = preferences or config.DIETARY_PREFERENCES
+    prompt = nutrition_agent.plan_prompt(preferences, plan_date)
+    agent_instance = agent_instance or nutrition_agent.get_agent()
+    if hasattr(agent_instance, "stream"):
+        stream = agent_instance.stream(prompt)
+    else:
+        stream = agent_instance.run(prompt, stream=True)
+    renderer = IncrementalRenderer(compile_constraints(preferences).check_line)
+    try:
+        for delta in _content_events(stream):
+            for title, html in renderer.feed(delta):
+                if on_fragment is not None:
+                    on_fragment(title, html)
+        for title, html in renderer.close():
+            if on_fragment is not None:
+                on_fragment(title, html)
+    except ConstraintViolation:
+        metrics.STREAM_ABORTS.inc()
+        raise
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    return renderer
+
+def generate_streaming(preferences=None, agent_instance=None, plan_date=None):
+    """Streaming counterpart of `generate_diet_plan`, returning the plan text.
+
+    The sections and HTML rendered while it streamed are handed to
+    `nutrition_agent.remember_rendered`, so the email for this text is built
+    without parsing or rendering it again. A stream aborted for breaking a
+    dietary constraint is restarted up to STREAM_MAX_RESTARTS times,
+    reminding the model of the food it used.
+    """
+    preferences = dict(preferences or config.DIETARY_PREFERENCES)
+    for attempt in range(config.STREAM_MAX_RESTARTS + 1):
+        try:
+            renderer = stream_diet_plan(preferences, agent_instance, plan_date)
+            nutrition_agent.remember_rendered(renderer.text, renderer.sections, renderer.html)
+            return renderer.text
+        except ConstraintViolation as e:
+            print(f"Stopped generation early: {e}")
+            if attempt == config.STREAM_MAX_RESTARTS:
+                raise
+            # Repeat the offending food as an exclusion so the retry steers clear of it
+            excluded = list(preferences.get("excluded_foods", []))
+            if e.term not in excluded:
+                preferences["excluded_foods"] = excluded + [e.term]
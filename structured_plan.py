@@ -0,0 +1,128 @@
+import json
+from dataclasses import asdict, dataclass, field
+
+# Appended to the prompt in place of the free-text output format when
+# STRUCTURED_PLAN_OUTPUT is enabled
+JSON_OUTPUT_INSTRUCTIONS = (
+    "Output only a JSON object, without markdown fences or commentary, like "
+    '{"meals":[{"name":"Breakfast","items":[{"name":"Ragi dosa with coconut chutney","kcal":300}],'
+    '"kcal":420,"protein":14,"carbs":62,"fiber":8,"tips":["Ferment the batter overnight"]}],'
+    '"hydration":["Drink 8 to 10 glasses of water"],"tips":["General advice for the day"]}\n'
+    "Meal names: Breakfast, Morning Snack, Lunch, Evening Snack, Dinner. "
+    "kcal, protein, carbs and fiber are whole numbers; grams for protein, carbs and fiber.\n"
+)
+
+@dataclass(slots=True)
+class MealItem:
+    name: str
+    kcal: int | None = None
+
+@dataclass(slots=True)
+class Meal:
+    name: str
+    items: list[MealItem]
+    kcal: int
+    protein: int
+    carbs: int
+    fiber: int
+    tips: list[str] = field(default_factory=list)
+
+@dataclass(slots=True)
+class DietPlan:
+    meals: list[Meal]
+    hydration: list[str] = field(default_factory=list)
+    tips: list[str] = field(default_factory=list)
+
+    @property
+    def total_kcal(self):
+        return sum(meal.kcal for meal in self.meals)
+
+    @property
+    def total_macros(self):
+        """(protein, carbs, fiber) in grams summed over all meals"""
+        return (
+            sum(meal.protein for meal in self.meals),
+            sum(meal.carbs for meal in self.meals),
+            sum(meal.fiber for meal in self.meals),
+        )
+
+    def to_json(self):
+        return json.dumps(asdict(self), separators=(",", ":"))
+
+def _number(value, name):
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be a number")
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        digits = value.strip().split()[0].rstrip("gG") if value.strip() else ""
+        try:
+            return int(float(digits))
+        except ValueError:
+            pass
+    raise ValueError(f"{name} must be a number, got {value!r}")
+
+def _strings(value, name):
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"{name} must be a list of strings")
+    return [item.strip() for item in value if item.strip()]
+
+def _meal(data, index):
+    if not isinstance(data, dict):
+        raise ValueError(f"meals[{index}] must be an object")
+    name = data.get("name")
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError(f"meals[{index}].name is required")
+    items = data.get("items") or []
+    if not isinstance(items, list):
+        raise ValueError(f"meals[{index}].items must be a list")
+    parsed_items = []
+    for item in items:
+        if isinstance(item, str):
+            parsed_items.append(MealItem(item.strip()))
+        elif isinstance(item, dict) and isinstance(item.get("name"), str):
+            kcal = item.get("kcal")
+            parsed_items.append(MealItem(item["name"].strip(), None if kcal is None else _number(kcal, "kcal")))
+        else:
+            raise ValueError(f"meals[{index}].items entries need a name")
+    return Meal(
+        name=name.strip(),
+        items=parsed_items,
+        kcal=_number(data.get("kcal"), f"meals[{index}].kcal"),
+        protein=_number(data.get("protein"), f"meals[{index}].protein"),
+        carbs=_number(data.get("carbs"), f"meals[{index}].carbs"),
+        fiber=_number(data.get("fiber"), f"meals[{index}].fiber"),
+        tips=_strings(data.get("tips"), f"meals[{index}].tips"),
+    )
+
+def looks_like_json(text):
+    stripped = text.lstrip()
+    return stripped.startswith("{") or stripped.startswith("```")
+
+def parse_plan_json(text):
+    """Validate a model response against the plan schema and return a DietPlan.
+
+    Raises ValueError when the response is not JSON or does not match the
+    schema, so callers can fall back to the free-text parser.
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        # Tolerate a fenced block despite the instructions
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"plan is not valid JSON: {e}") from None
+    if not isinstance(data, dict):
+        raise ValueError("plan must be a JSON object")
+    meals = data.get("meals")
+    if not isinstance(meals, list) or not meals:
+        raise ValueError("plan needs a non-empty meals list")
+    return DietPlan(
+        meals=[_meal(meal, index) for index, meal in enumerate(meals)],
+        hydration=_strings(data.get("hydration"), "hydration"),
+        tips=_strings(data.get("tips"), "tips"),
+    )
@@ -0,0 +1,101 @@
+import json
+import sqlite3
+import sys
+
+# Import configuration
+import config
+
+def merge_preferences(overrides=None):
+    """Fill in any preference a subscriber did not set from the global defaults"""
+    preferences = dict(config.DIETARY_PREFERENCES)
+    if overrides:
+        preferences.update(overrides)
+    return preferences
+
+class SubscriberRegistry:
+    """SQLite-backed registry of subscribers and their dietary preferences"""
+
+    def __init__(self, path=None):
+        self.path = path or config.SUBSCRIBERS_DB
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS subscribers (
+                email TEXT PRIMARY KEY,
+                preferences TEXT NOT NULL DEFAULT '{}',
+                active INTEGER NOT NULL DEFAULT 1,
+                send_time TEXT,
+                timezone TEXT
+            )"""
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(subscribers)")}
+        for column in ("send_time", "timezone"):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE subscribers ADD COLUMN {column} TEXT")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def add_subscriber(self, email, preferences=None, send_time=None, timezone=None):
+        """Add a subscriber, or replace the settings of an existing one.
+
+        `send_time` ("HH:MM") and `timezone` (an IANA name such as
+        "Asia/Kolkata") default to DAILY_SEND_TIME and DEFAULT_TIMEZONE.
+        """
+        self.conn.execute(
+            "INSERT OR REPLACE INTO subscribers (email, preferences, active, send_time, timezone) VALUES (?, ?, 1, ?, ?)",
+            (email, json.dumps(preferences or {}), send_time, timezone),
+        )
+        self.conn.commit()
+
+    def remove_subscriber(self, email):
+        """Deactivate a subscriber so they no longer receive plans"""
+        self.conn.execute("UPDATE subscribers SET active = 0 WHERE email = ?", (email,))
+        self.conn.commit()
+
+    def list_subscribers(self):
+        """Return all active subscribers with their preferences merged over the defaults"""
+        rows = self.conn.execute(
+            "SELECT email, preferences, send_time, timezone FROM subscribers WHERE active = 1 ORDER BY email"
+        )
+        return [
+            {
+                "email": email,
+                "preferences": merge_preferences(json.loads(preferences)),
+                "send_time": send_time or config.DAILY_SEND_TIME,
+                "timezone": timezone or config.DEFAULT_TIMEZONE,
+            }
+            for email, preferences, send_time, timezone in rows
+        ]
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM subscribers WHERE active = 1").fetchone()[0]
+
+if __name__ == "__main__":
+    # Usage:
+    #   python subscribers.py add EMAIL ['{"diet_type": "vegan"}'] [HH:MM] [TIMEZONE]
+    #   python subscribers.py remove EMAIL
+    #   python subscribers.py list
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    with SubscriberRegistry() as registry:
+        if command == "add" and len(sys.argv) > 2:
+            overrides = json.loads(sys.argv[3]) if len(sys.argv) > 3 else {}
+            send_time = sys.argv[4] if len(sys.argv) > 4 else None
+            timezone = sys.argv[5] if len(sys.argv) > 5 else None
+            registry.add_subscriber(sys.argv[2], overrides, send_time, timezone)
+            print(f"✓ Added {sys.argv[2]}")
+        elif command == "remove" and len(sys.argv) > 2:
+            registry.remove_subscriber(sys.argv[2])
+            print(f"✓ Removed {sys.argv[2]}")
+        else:
+            for subscriber in registry.list_subscribers():
+                prefs = subscriber["preferences"]
+                zone = subscriber["timezone"] or "local time"
+                print(f"{subscriber['email']}: {prefs['diet_type']}, {prefs['calories_per_day']} kcal at {subscriber['send_time']} {zone}")
+            print(f"{registry.count()} active subscribers")
@@ -0,0 +1,75 @@
+import http.client
+import json
+import socket
+
+import pytest
+
+import config
+from app import parse_preferences, start_server
+from nutrition_agent import get_html_template
+from plan_validator import PlanValidationError
+
+class FailingService:
+    """Stands in for PlanService; every plan fails validation"""
+
+    def plan_for(self, preferences, plan_date):
+        raise PlanValidationError("still lists peanuts")
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def server():
+    server = start_server(FailingService(), host="127.0.0.1", port=0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _request(server, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+    try:
+        connection.putrequest(method, path, skip_accept_encoding=True)
+        for name, value in (headers or {}).items():
+            connection.putheader(name, value)
+        connection.endheaders(body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+def test_validation_failure_is_unavailable_not_bad_request(server):
+    status, document = _request(server, "GET", "/plan?format=json")
+    assert status == 503
+    assert "still lists peanuts" in document["error"]
+
+@pytest.mark.parametrize("length", ["-1", "ten"])
+def test_post_rejects_invalid_content_length(server, length):
+    status, document = _request(server, "POST", "/plan", headers={"Content-Length": length})
+    assert status == 400
+    assert document == {"error": "invalid Content-Length"}
+
+@pytest.mark.parametrize("name", ["diet_type", "meal_complexity", "protein_focus"])
+def test_text_preferences_must_be_allowed_values(name):
+    with pytest.raises(ValueError):
+        parse_preferences({name: "<script>alert(1)</script>"})
+    assert parse_preferences({"diet_type": " Vegan "})["diet_type"] == "vegan"
+
+def test_rejected_preference_is_bad_request(server):
+    status, _ = _request(server, "GET", "/plan?format=html&diet_type=%3Cscript%3Ealert(1)%3C/script%3E")
+    assert status == 400
+
+def test_html_slots_are_escaped():
+    preferences = dict(config.DIETARY_PREFERENCES, diet_type="<script>alert(1)</script>")
+    html = get_html_template("<b>Monday</b>", "Breakfast: oats", preferences)
+    assert "<script>" not in html.lower() and "<b>Monday</b>" not in html
+    assert "&lt;Script&gt;" in html
+
+def test_post_to_unknown_path_does_not_parse_its_body_as_a_request(server):
+    body = b"GET /healthz HTTP/1.1\r\nHost: x\r\n\r\n"
+    with socket.create_connection(server.server_address[:2], timeout=5) as connection:
+        connection.sendall(b"POST /other HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+        received = b""
+        while chunk := connection.recv(65536):
+            received += chunk
+    assert received.startswith(b"HTTP/1.1 404")
+    assert received.count(b"HTTP/1.1 ") == 1
@@ -0,0 +1,34 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+import async_pipeline
+import config
+import delivery_queue
+
+SUBSCRIBERS = [{"email": "a@example.com", "preferences": dict(config.DIETARY_PREFERENCES)}]
+
+def test_deliveries_go_through_the_queue_when_it_is_enabled(monkeypatch):
+    calls = []
+    monkeypatch.setattr(config, "DELIVERY_QUEUE_ENABLED", True)
+    monkeypatch.setattr(delivery_queue, "run_queued", lambda subscribers, plan_date=None: calls.append(plan_date))
+
+    async def fanout(*args, **kwargs):
+        pytest.fail("sent around the delivery queue")
+
+    monkeypatch.setattr(async_pipeline, "run_async_fanout", fanout)
+    asyncio.run(async_pipeline.deliver_async(SUBSCRIBERS, date(2026, 5, 4)))
+    assert calls == [date(2026, 5, 4)]
+
+def test_deliveries_fan_out_without_the_queue(monkeypatch):
+    calls = []
+    monkeypatch.setattr(config, "DELIVERY_QUEUE_ENABLED", False)
+    monkeypatch.setattr(delivery_queue, "run_queued", lambda *args, **kwargs: pytest.fail("used the delivery queue"))
+
+    async def fanout(subscribers, plan_date=None):
+        calls.append(plan_date)
+
+    monkeypatch.setattr(async_pipeline, "run_async_fanout", fanout)
+    asyncio.run(async_pipeline.deliver_async(SUBSCRIBERS, date(2026, 5, 4)))
+    assert calls == [date(2026, 5, 4)]
@@ -0,0 +1,86 @@
+import os
+from datetime import date, timedelta
+
+import pytest
+
+import batch_generation
+import config
+from benchmarks.stubs import SAMPLE_PLAN, StubResponse
+from plan_cache import PlanCache, plan_fingerprint
+from subscribers import merge_preferences
+
+# Pregenerated plans are cached until their day is over, so plan for the future
+START = date.today() + timedelta(days=1)
+
+class RecordingAgent:
+    """Answers every prompt with the sample plan, once per requested day or profile"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def run(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        blocks = [line.split(":")[0] for line in prompt.splitlines() if line.startswith(("DAY ", "PROFILE "))]
+        if not blocks:
+            return StubResponse(SAMPLE_PLAN)
+        return StubResponse("".join(f"=== {block} ===\n{SAMPLE_PLAN}\n" for block in blocks))
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "VALIDATE_PLANS", False)
+    monkeypatch.setattr(config, "MEAL_LIBRARY_ENABLED", True)
+    monkeypatch.setattr(config, "PLAN_HISTORY_ENABLED", False)
+    monkeypatch.setattr(batch_generation, "harvest", lambda plan, preferences: 0)
+    with PlanCache(os.path.join(tmp_path, "plan_cache.db")) as cache:
+        yield cache
+
+def _subscribers(count):
+    return [{"email": f"user{i}@example.com", "preferences": merge_preferences({"calories_per_day": 1500 + i * 100})}
+            for i in range(count)]
+
+def test_pregenerate_takes_library_plans_before_calling_the_model(cache, monkeypatch):
+    subscribers = _subscribers(3)
+    covered = subscribers[0]["preferences"]["calories_per_day"]
+    monkeypatch.setattr(batch_generation, "plan_from_library", lambda preferences, plan_date:
+                        "LIBRARY PLAN" if preferences["calories_per_day"] == covered else None)
+    agent = RecordingAgent()
+    assert batch_generation.pregenerate(subscribers, START, days=1, agent_instance=agent, cache=cache) == 1
+    assert cache.get(plan_fingerprint(subscribers[0]["preferences"], START)) == "LIBRARY PLAN"
+    # Only the two profiles the library could not cover went to the model
+    assert sum(line.startswith("PROFILE ") for line in agent.prompts[0].splitlines()) == 2
+    for subscriber in subscribers[1:]:
+        assert cache.get(plan_fingerprint(subscriber["preferences"], START)) == SAMPLE_PLAN
+
+def test_pregenerate_week_only_asks_for_days_the_library_missed(cache, monkeypatch):
+    library_days = {START, START + timedelta(days=2)}
+    monkeypatch.setattr(batch_generation, "plan_from_library", lambda preferences, plan_date:
+                        "LIBRARY PLAN" if plan_date in library_days else None)
+    agent = RecordingAgent()
+    assert batch_generation.pregenerate(_subscribers(1), START, days=4, agent_instance=agent, cache=cache) == 1
+    [prompt] = agent.prompts
+    assert [line for line in prompt.splitlines() if line.startswith("DAY ")] == [
+        f"DAY {number}: {(START + timedelta(days=offset)).strftime('%A, %B %d, %Y')}"
+        for number, offset in ((1, 1), (2, 3))
+    ]
+
+def test_batched_prompts_list_each_profiles_recent_dishes(cache, monkeypatch):
+    import plan_history
+    monkeypatch.setattr(config, "PLAN_HISTORY_ENABLED", True)
+    monkeypatch.setattr(batch_generation, "plan_from_library", lambda preferences, plan_date: None)
+    monkeypatch.setattr(plan_history, "recently_served", lambda preferences, plan_date:
+                        [f"Dosa {preferences['calories_per_day']}", "Sambar"])
+    agent = RecordingAgent()
+    batch_generation.pregenerate(_subscribers(2), START, days=1, agent_instance=agent, cache=cache)
+    profiles = [line for line in agent.prompts[0].splitlines() if line.startswith("PROFILE ")]
+    assert [line.split("; recently served: ")[1] for line in profiles] == ["Dosa 1500; Sambar", "Dosa 1600; Sambar"]
+
+    agent = RecordingAgent()
+    batch_generation.generate_week(_subscribers(1)[0]["preferences"], START, 3, agent)
+    assert "Recently served: Dosa 1500; Sambar\n" in agent.prompts[0]
+
+def test_pregenerate_does_nothing_without_a_plan_cache(monkeypatch):
+    monkeypatch.setattr(config, "PLAN_CACHE_ENABLED", False)
+    monkeypatch.setattr(batch_generation, "PlanCache", lambda: pytest.fail("opened a plan cache"))
+    agent = RecordingAgent()
+    assert batch_generation.pregenerate(_subscribers(2), START, days=1, agent_instance=agent) == 0
+    assert agent.prompts == []
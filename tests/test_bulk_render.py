@@ -0,0 +1,19 @@
+import email
+
+import config
+from benchmarks.stubs import SAMPLE_PLAN
+from bulk_render import BulkRenderer
+from subscribers import merge_preferences
+
+def test_workers_render_with_the_parents_settings(monkeypatch):
+    monkeypatch.setattr(config, "EMAIL_COLOR_PRIMARY", "#123456")
+    monkeypatch.setattr(config, "EMAIL_SUBJECT_TEMPLATE", "Plan for {date}")
+    jobs = [(f"user{i}@example.com", SAMPLE_PLAN, merge_preferences(), "Monday, May 04, 2026", f"<{i}@test>")
+            for i in range(4)]
+    with BulkRenderer(processes=2, chunk_size=1, min_batch=0) as renderer:
+        messages = renderer.render(jobs)
+        assert renderer._executor._mp_context.get_start_method() != "fork"
+    for (receiver, *_), message in zip(jobs, messages):
+        parsed = email.message_from_bytes(message)
+        assert parsed["To"] == receiver and parsed["Subject"] == "Plan for Monday, May 04, 2026"
+        assert "#123456" in parsed.get_payload(1).get_payload(decode=True).decode("utf-8")
@@ -0,0 +1,45 @@
+import os
+import time
+from datetime import date
+
+import pytest
+
+import config
+from delivery_queue import SENT, DeliveryQueue, deliver_ready
+
+PLAN_DATE = date(2026, 5, 4)
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PLAN_HISTORY_ENABLED", False)
+    with DeliveryQueue(os.path.join(tmp_path, "queue.db"), lease_seconds=0.05) as queue:
+        queue.enqueue([{"email": "a@example.com", "preferences": dict(config.DIETARY_PREFERENCES)}], PLAN_DATE)
+        [item] = queue.claim("generate")
+        assert queue.complete(item, "plan")
+        yield queue
+
+def _steal(queue):
+    """Let every lease expire and hand the rows to a second worker"""
+    [item] = queue.claim("deliver")
+    time.sleep(0.1)
+    assert queue.recover() == 1
+    [other] = queue.claim("deliver")
+    return item, other
+
+def test_renew_drops_items_whose_lease_was_reclaimed(queue):
+    item, other = _steal(queue)
+    assert queue.renew([item]) == []
+    assert queue.renew([other]) == [other]
+    assert not queue.complete(item)
+    assert queue.complete(other)
+
+def test_lease_lost_during_send_is_not_counted_as_delivered(queue):
+    def slow_deliver(plan, email, preferences):
+        # Another worker reclaims the row while this send is in flight
+        time.sleep(0.1)
+        queue.recover()
+        queue.claim("deliver")
+        return True
+
+    assert deliver_ready(queue, slow_deliver) == (0, 0)
+    assert queue.counts()[SENT] == 0
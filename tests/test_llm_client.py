@@ -0,0 +1,48 @@
+import pytest
+
+from benchmarks.stubs import StubAgent
+from llm_client import CircuitOpenError, LLMClient, LLMTimeoutError
+
+class FailingAgent(StubAgent):
+    def run(self, prompt, stream=False, **kwargs):
+        raise ConnectionError("model unreachable")
+
+def _half_open_client(agent_factory, **kwargs):
+    """A client whose breaker opened on one failure and is ready for its trial call"""
+    failing = [True]
+    client = LLMClient(lambda: FailingAgent(latency=0) if failing[0] else agent_factory(), timeout=5, max_retries=0,
+                       requests_per_minute=0, tokens_per_minute=0, breaker_threshold=1, breaker_cooldown=0,
+                       hedge_after=0, **kwargs)
+    with pytest.raises(Exception):
+        client.run("plan")
+    failing[0] = False
+    client._idle_agents.queue.clear()
+    assert client.breaker.state == "half-open"
+    return client
+
+def test_stream_closed_early_frees_the_half_open_trial():
+    client = _half_open_client(lambda: StubAgent(latency=0))
+    stream = client.stream("plan")
+    next(stream)
+    stream.close()
+    assert client.run("plan").content
+    assert client.breaker.state == "closed"
+
+def test_stream_rate_limit_timeout_frees_the_half_open_trial():
+    client = _half_open_client(lambda: StubAgent(latency=0))
+    client.timeout = 0.05
+    client.requests.per_minute = client.requests.capacity = 1
+    client.requests.tokens = 0
+    with pytest.raises(LLMTimeoutError):
+        next(client.stream("plan"))
+    client.requests.per_minute = 0
+    assert client.run("plan").content
+    assert client.breaker.state == "closed"
+
+def test_open_breaker_rejects_until_cooldown():
+    client = LLMClient(lambda: FailingAgent(latency=0), timeout=5, max_retries=0, requests_per_minute=0,
+                       tokens_per_minute=0, breaker_threshold=1, breaker_cooldown=60, hedge_after=0)
+    with pytest.raises(Exception):
+        client.run("plan")
+    with pytest.raises(CircuitOpenError):
+        client.run("plan")
@@ -0,0 +1,28 @@
+import random
+import sqlite3
+
+from benchmarks.corpus import synthetic_plan
+from meal_library import MealLibrary
+from subscribers import merge_preferences
+
+BALANCED = merge_preferences({"protein_focus": "balanced"})
+HIGH_PROTEIN = merge_preferences({"protein_focus": "high"})
+
+def test_high_protein_requests_do_not_reuse_balanced_meals(tmp_path):
+    with MealLibrary(str(tmp_path / "meals.db")) as library:
+        assert sum(library.harvest(synthetic_plan(seed), BALANCED) for seed in range(20)) > 0
+        assert library._candidates(BALANCED, "LUNCH", random.Random(0))
+        assert library._candidates(HIGH_PROTEIN, "LUNCH", random.Random(0)) == []
+        assert library.assemble(HIGH_PROTEIN) is None
+
+def test_meals_stored_without_a_protein_focus_are_not_reused(tmp_path):
+    path = str(tmp_path / "meals.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("""CREATE TABLE meals (id TEXT PRIMARY KEY, slot TEXT NOT NULL, diet_type TEXT NOT NULL,
+                        complexity TEXT NOT NULL, body TEXT NOT NULL, kcal INTEGER NOT NULL, protein INTEGER NOT NULL,
+                        carbs INTEGER NOT NULL, fiber INTEGER NOT NULL, tags TEXT NOT NULL,
+                        uses INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, last_used_at REAL)""")
+        conn.execute("INSERT INTO meals VALUES ('old', 'LUNCH', 'balanced', 'medium', 'Sambar rice', 500, 15, 80, 6, ',', 0, 0, NULL)")
+    with MealLibrary(path) as library:
+        assert library.counts() == {("balanced", "medium", "", "LUNCH"): 1}
+        assert library._candidates(BALANCED, "LUNCH", random.Random(0)) == []
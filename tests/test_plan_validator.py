@@ -0,0 +1,42 @@
+import pytest
+
+import config
+from plan_validator import ConstraintMatcher, validate_plan
+
+DAIRY_FREE = dict(config.DIETARY_PREFERENCES, allergies=["dairy"], excluded_foods=[])
+
+@pytest.mark.parametrize("line", [
+    "Tip: Do not overcook the paneer",
+    "Replace rice with paneer bhurji",
+    "Paneer tikka with mint chutney",
+    "Lassi, not too sweet",
+    "Milk",
+])
+def test_dairy_is_found(line):
+    assert [constraint for _, constraint, _ in ConstraintMatcher(allergies=["dairy"]).find(line)] == ["dairy"]
+
+@pytest.mark.parametrize("line", [
+    "Almond milk",
+    "Coconut milk curry",
+    "Oat milk porridge",
+    "Soy milk",
+    "no paneer",
+    "Vegetable pulao (without paneer)",
+    "Paneer-free palak",
+    "Peanut butter toast",
+])
+def test_ruled_out_or_plant_based_dairy_is_ignored(line):
+    assert ConstraintMatcher(allergies=["dairy"]).find(line) == []
+
+def test_plant_milk_still_counts_for_its_own_allergen():
+    assert ConstraintMatcher(allergies=["nuts"]).find("Almond milk") == [("allergy", "nuts", "Almond")]
+
+@pytest.mark.parametrize("line", ["Tip: Do not overcook the paneer", "Replace rice with paneer bhurji"])
+def test_validate_plan_attributes_dairy_to_its_meal(line):
+    plan = f"BREAKFAST\nVegetable upma\n{line}\n\nLUNCH\nDal and rice\n"
+    result = validate_plan(plan, DAIRY_FREE)
+    assert [(violation.kind, violation.meal) for violation in result.violations] == [("allergy", "BREAKFAST")]
+
+def test_validate_plan_accepts_plant_milk_for_dairy_allergy():
+    plan = "BREAKFAST\nOats cooked in almond milk\nTip: coconut milk works too\n"
+    assert validate_plan(plan, DAIRY_FREE).ok
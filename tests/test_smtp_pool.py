@@ -0,0 +1,35 @@
+import socket
+
+import pytest
+
+from benchmarks.smtp_sink import SMTPSink
+from smtp_pool import SMTPConnectionPool
+
+MESSAGES = [(f"user{i}@example.com", f"Subject: plan {i}\r\n\r\nBody {i}\r\n".encode("ascii")) for i in range(12)]
+
+def _pool(sink):
+    return SMTPConnectionPool("127.0.0.1", sink.port, "sender@example.com", "password",
+                              size=3, use_ssl=False, max_per_second=0)
+
+@pytest.mark.parametrize("pipelining", [True, False])
+def test_send_many_delivers_every_message(pipelining):
+    with SMTPSink(pipelining=pipelining) as sink, _pool(sink) as pool:
+        assert pool.send_many("sender@example.com", MESSAGES) == [None] * len(MESSAGES)
+        assert pool.supports_pipelining() is pipelining
+        assert sink.messages == len(MESSAGES)
+
+def test_send_many_without_pipelining_uses_sendmail(monkeypatch):
+    with SMTPSink(pipelining=False) as sink, _pool(sink) as pool:
+        monkeypatch.setattr(pool, "send_batch", lambda *args: pytest.fail("batched without PIPELINING"))
+        assert pool.send_many("sender@example.com", MESSAGES) == [None] * len(MESSAGES)
+        assert pool.connections_opened <= pool.size
+
+def test_send_many_reports_a_refused_connection_per_message():
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+    with SMTPConnectionPool("127.0.0.1", port, "sender@example.com", "password",
+                            size=3, use_ssl=False, max_per_second=0, timeout=5) as pool:
+        results = pool.send_many("sender@example.com", MESSAGES)
+    assert len(results) == len(MESSAGES)
+    assert all(isinstance(result, ConnectionRefusedError) for result in results)
@@ -0,0 +1,31 @@
+import pytest
+
+import config
+import nutrition_agent
+from benchmarks.corpus import SAMPLE_PLAN, synthetic_json_plan, synthetic_plan
+from benchmarks.stubs import StubAgent
+from mime_batch import render_message
+from streaming import generate_streaming, stream_diet_plan
+
+@pytest.fixture(autouse=True)
+def no_history(monkeypatch):
+    monkeypatch.setattr(config, "PLAN_HISTORY_ENABLED", False)
+
+@pytest.mark.parametrize("plan", [SAMPLE_PLAN, synthetic_plan(3), synthetic_json_plan(3), "Eat well today."])
+def test_streamed_sections_match_the_buffered_parse(plan):
+    renderer = stream_diet_plan(None, StubAgent(latency=0, content=plan))
+    assert renderer.sections == nutrition_agent.plan_sections(plan)
+    assert renderer.html == nutrition_agent.process_diet_content(plan)
+
+def test_email_reuses_the_render_done_while_streaming(monkeypatch):
+    plan = synthetic_plan(7)
+    buffered = nutrition_agent.get_html_template("Monday, May 04, 2026", plan)
+    text = generate_streaming(None, StubAgent(latency=0, content=plan))
+
+    def fail(*args):
+        pytest.fail("the streamed plan was parsed or rendered again")
+
+    monkeypatch.setattr(nutrition_agent, "parse_diet_content", fail)
+    monkeypatch.setattr(nutrition_agent, "render_diet_content", fail)
+    assert nutrition_agent.get_html_template("Monday, May 04, 2026", text) == buffered
+    assert b"Content-Type: text/html" in render_message(text, "a@example.com", None, "Monday, May 04, 2026")
@@ -0,0 +1,128 @@
+import asyncio
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from timer_scheduler import DeliveryScheduler, TimerScheduler, local_date, next_daily_run
+
+UTC = ZoneInfo("UTC")
+
+def utc(*args):
+    return datetime(*args, tzinfo=UTC).timestamp()
+
+def wall(timestamp, timezone_name):
+    return datetime.fromtimestamp(timestamp, ZoneInfo(timezone_name))
+
+class FakeClock:
+    """Sleeping just advances time"""
+
+    def __init__(self, start):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def test_next_daily_run_later_today():
+    due = next_daily_run("07:30", "Europe/London", utc(2026, 1, 10, 6, 0))
+    assert due == utc(2026, 1, 10, 7, 30)
+
+def test_next_daily_run_is_strictly_after():
+    after = utc(2026, 1, 10, 7, 30)
+    assert next_daily_run("07:30", "Europe/London", after) == utc(2026, 1, 11, 7, 30)
+    assert next_daily_run("07:30", "Europe/London", after - 1) == after
+
+@pytest.mark.parametrize("timezone_name, expected", [
+    ("Asia/Kolkata", utc(2026, 6, 1, 1, 30)),        # UTC+5:30
+    ("Europe/London", utc(2026, 6, 1, 6, 0)),        # BST, UTC+1
+    ("America/New_York", utc(2026, 6, 1, 11, 0)),    # EDT, UTC-4
+    ("Australia/Sydney", utc(2026, 6, 1, 21, 0)),    # AEST, UTC+10, already June 2 there
+])
+def test_next_daily_run_per_timezone(timezone_name, expected):
+    assert next_daily_run("07:00", timezone_name, utc(2026, 6, 1, 0, 0)) == expected
+
+def test_next_daily_run_keeps_wall_time_across_spring_forward():
+    # US clocks jump from 02:00 to 03:00 on 8 March 2026
+    first = next_daily_run("06:00", "America/New_York", utc(2026, 3, 7, 5, 0))
+    second = next_daily_run("06:00", "America/New_York", first)
+    assert (wall(first, "America/New_York").hour, wall(second, "America/New_York").hour) == (6, 6)
+    assert second - first == 23 * 3600
+
+def test_next_daily_run_keeps_wall_time_across_fall_back():
+    # UK clocks go back from 02:00 to 01:00 on 25 October 2026
+    first = next_daily_run("06:00", "Europe/London", utc(2026, 10, 24, 0, 0))
+    second = next_daily_run("06:00", "Europe/London", first)
+    assert (wall(first, "Europe/London").hour, wall(second, "Europe/London").hour) == (6, 6)
+    assert second - first == 25 * 3600
+
+def test_next_daily_run_in_skipped_hour_still_fires_that_day():
+    # 02:30 does not exist in New York on 8 March 2026
+    due = next_daily_run("02:30", "America/New_York", utc(2026, 3, 8, 5, 0))
+    assert wall(due, "America/New_York").date() == date(2026, 3, 8)
+    assert due > utc(2026, 3, 8, 5, 0)
+
+def test_local_date_differs_by_timezone():
+    instant = utc(2026, 6, 1, 22, 0)
+    assert local_date(instant, "America/Los_Angeles") == date(2026, 6, 1)
+    assert local_date(instant, "Australia/Sydney") == date(2026, 6, 2)
+
+def test_timer_runs_jobs_in_order_on_time():
+    clock = FakeClock(utc(2026, 1, 1))
+    ran = []
+    timer = TimerScheduler(clock=clock.time, sleep=clock.sleep,
+                           dispatch=lambda callback, due: ran.append((callback(due), clock.time() - due)))
+    timer.schedule_at(clock.time() + 30, lambda due: "b")
+    timer.schedule_at(clock.time() + 10, lambda due: "a")
+    cancelled = timer.schedule_at(clock.time() + 20, lambda due: "cancelled")
+    timer.cancel(cancelled)
+    timer.run_until(clock.time() + 60)
+    assert ran == [("a", 0), ("b", 0)]
+    assert clock.time() == utc(2026, 1, 1) + 60
+
+def test_delivery_scheduler_uses_each_group_send_time_and_local_date():
+    clock = FakeClock(utc(2026, 3, 7, 0, 0))
+    timer = TimerScheduler(clock=clock.time, sleep=clock.sleep)
+    subscribers = [
+        {"email": "ny@example.com", "send_time": "06:00", "timezone": "America/New_York"},
+        {"email": "syd@example.com", "send_time": "06:00", "timezone": "Australia/Sydney"},
+        {"email": "ind@example.com", "send_time": "08:15", "timezone": "Asia/Kolkata"},
+    ]
+    delivered, pregenerated = [], []
+
+    def deliver(members, plan_date):
+        delivered.extend((member["email"], plan_date, clock.time()) for member in members)
+
+    def pregenerate(members, plan_date):
+        pregenerated.extend((member["email"], plan_date, clock.time()) for member in members)
+
+    scheduler = DeliveryScheduler(timer, lambda: subscribers, deliver, pregenerate, lead_minutes=30)
+    assert scheduler.start(refresh_minutes=60) == 3
+    timer.run_until(clock.time() + 2 * 86400)
+
+    timezones = {subscriber["email"]: subscriber["timezone"] for subscriber in subscribers}
+    sends = [(email, plan_date, wall(at, timezones[email])) for email, plan_date, at in delivered]
+    # Sydney (UTC+11) is already past 06:00 on 7 March when the clock starts
+    assert sorted((email, plan_date) for email, plan_date, _ in sends) == [
+        ("ind@example.com", date(2026, 3, 7)), ("ind@example.com", date(2026, 3, 8)),
+        ("ny@example.com", date(2026, 3, 7)), ("ny@example.com", date(2026, 3, 8)),
+        ("syd@example.com", date(2026, 3, 8)), ("syd@example.com", date(2026, 3, 9)),
+    ]
+    for email, plan_date, sent in sends:
+        assert sent.date() == plan_date
+        assert (sent.hour, sent.minute) == ((8, 15) if email == "ind@example.com" else (6, 0))
+    # Every delivery was preceded by pregeneration for the same local date, 30 minutes earlier
+    pregenerated_at = {(email, plan_date): at for email, plan_date, at in pregenerated}
+    for email, plan_date, at in delivered:
+        assert at - pregenerated_at[email, plan_date] == 30 * 60
+
+def test_run_forever_async_until_stopped():
+    clock = FakeClock(utc(2026, 1, 1))
+    timer = TimerScheduler(clock=clock.time)
+    ran = []
+    timer.schedule_at(clock.time() - 1, lambda due: ran.append("late"))
+    timer.schedule_at(clock.time(), lambda due: timer.stop())
+    asyncio.run(asyncio.wait_for(timer.run_forever_async(), 5))
+    assert ran == ["late"]
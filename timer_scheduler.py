@@ -0,0 +1,221 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+# Import configuration
+import config
+
+def next_daily_run(send_time, timezone_name, after):
+    """Timestamp of the next "HH:MM" in `timezone_name` strictly after `after`.
+
+    An empty timezone means server local time. Wall-clock arithmetic keeps
+    the send time stable across DST changes.
+    """
+    zone = ZoneInfo(timezone_name) if timezone_name else None
+    hour, minute = (int(part) for part in send_time.split(":"))
+    candidate = datetime.fromtimestamp(after, zone).replace(hour=hour, minute=minute, second=0, microsecond=0)
+    while candidate.timestamp() <= after:
+        candidate += timedelta(days=1)
+    return candidate.timestamp()
+
+def local_date(timestamp, timezone_name):
+    """The calendar date at `timestamp` in `timezone_name` (empty for local time)"""
+    return datetime.fromtimestamp(timestamp, ZoneInfo(timezone_name) if timezone_name else None).date()
+
+class Job:
+    """A callback due at a timestamp, optionally recurring via `recurrence(previous_due)`"""
+
+    __slots__ = ("due", "callback", "recurrence", "cancelled")
+
+    def __init__(self, due, callback, recurrence=None):
+        self.due = due
+        self.callback = callback
+        self.recurrence = recurrence
+        self.cancelled = False
+
+class TimerScheduler:
+    """Heap-based scheduler that sleeps exactly until the next job is due.
+
+    `clock` and `sleep` default to real time; pass a fake clock's methods to
+    drive it deterministically. With the real clock, adding a job wakes a
+    sleeping `run_forever` so an earlier deadline is never missed. `dispatch`
+    runs each due callback and defaults to calling it inline.
+    """
+
+    def __init__(self, clock=None, sleep=None, dispatch=None):
+        self.clock = clock or time.time
+        self._sleep = sleep
+        self.dispatch = dispatch or (lambda callback, due: callback(due))
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for _, _, job in self._heap if not job.cancelled)
+
+    def schedule_at(self, due, callback, recurrence=None):
+        """Run `callback(due)` at timestamp `due`, then again at `recurrence(due)` if given"""
+        job = Job(due, callback, recurrence)
+        self._push(job)
+        return job
+
+    def schedule_daily(self, send_time, timezone_name, callback, lead_seconds=0):
+        """Run `callback(due)` every day `lead_seconds` before `send_time` in `timezone_name`"""
+        def recurrence(previous_due):
+            return next_daily_run(send_time, timezone_name, previous_due + lead_seconds) - lead_seconds
+        first = next_daily_run(send_time, timezone_name, self.clock() + lead_seconds) - lead_seconds
+        return self.schedule_at(first, callback, recurrence)
+
+    def schedule_every(self, seconds, callback):
+        """Run `callback(due)` every `seconds`, starting one interval from now"""
+        return self.schedule_at(self.clock() + seconds, callback, lambda previous_due: previous_due + seconds)
+
+    @staticmethod
+    def cancel(job):
+        job.cancelled = True
+
+    def _push(self, job):
+        with self._lock:
+            heapq.heappush(self._heap, (job.due, next(self._counter), job))
+        self._wakeup.set()
+
+    def next_due(self):
+        """Timestamp of the earliest pending job, or None"""
+        with self._lock:
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def run_pending(self):
+        """Run every job due by now; returns how many ran"""
+        ran = 0
+        now = self.clock()
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, _, job = heapq.heappop(self._heap)
+            if job.cancelled:
+                continue
+            try:
+                self.dispatch(job.callback, job.due)
+            except Exception as e:
+                print(f"Scheduled job failed: {e}")
+            ran += 1
+            if job.recurrence is not None:
+                job.due = job.recurrence(job.due)
+                self._push(job)
+        return ran
+
+    def _wait(self, seconds):
+        if self._sleep is not None:
+            self._sleep(seconds)
+        else:
+            self._wakeup.wait(seconds)
+            self._wakeup.clear()
+
+    def run_until(self, deadline):
+        """Run jobs in order until the clock reaches `deadline` (useful with a fake clock)"""
+        while True:
+            self.run_pending()
+            due = self.next_due()
+            if due is None or due > deadline:
+                remaining = deadline - self.clock()
+                if remaining > 0:
+                    self._wait(remaining)
+                return
+            self._wait(max(0.0, due - self.clock()))
+
+    def run_forever(self):
+        """Sleep until the next due job, run it, repeat until `stop()`"""
+        self._running = True
+        while self._running:
+            self.run_pending()
+            due = self.next_due()
+            # With no jobs, sleep until something is scheduled
+            self._wait(max(0.0, due - self.clock()) if due is not None else 3600)
+
+    async def run_forever_async(self):
+        """`run_forever` on an event loop: awaits the next due job instead of blocking the thread.
+
+        Each wait is capped at a minute so a wall-clock jump (suspend, NTP
+        step) or a `stop()` from outside the loop is noticed; jobs are added
+        from the loop's own thread.
+        """
+        self._running = True
+        while True:
+            self.run_pending()
+            if not self._running:
+                return
+            due = self.next_due()
+            await asyncio.sleep(min(60.0, max(0.0, due - self.clock())) if due is not None else 60.0)
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+class DeliveryScheduler:
+    """Keeps one daily pregeneration and one delivery job per (send time, timezone) group.
+
+    Subscribers sharing a send time and timezone are served together, so the
+    heap holds one entry per distinct group rather than per subscriber. The
+    registry is reread every SCHEDULER_REFRESH_MINUTES to pick up changes.
+    `deliver(subscribers, plan_date)` and `pregenerate(subscribers, plan_date)`
+    do the actual work.
+    """
+
+    def __init__(self, timer, load_subscribers, deliver, pregenerate=None, lead_minutes=None):
+        self.timer = timer
+        self.load_subscribers = load_subscribers
+        self.deliver = deliver
+        self.pregenerate = pregenerate
+        lead_minutes = config.PREGENERATE_LEAD_MINUTES if lead_minutes is None else lead_minutes
+        self.lead_seconds = lead_minutes * 60
+        self.groups = {}
+        self._jobs = {}
+
+    def refresh(self, _due=None):
+        """Regroup subscribers and add or cancel jobs for groups that appeared or vanished"""
+        groups = {}
+        for subscriber in self.load_subscribers():
+            groups.setdefault((subscriber["send_time"], subscriber["timezone"]), []).append(subscriber)
+        self.groups = groups
+        for key in list(self._jobs):
+            if key not in groups:
+                for job in self._jobs.pop(key):
+                    self.timer.cancel(job)
+        for key in groups:
+            if key not in self._jobs:
+                self._jobs[key] = self._schedule_group(key)
+        return len(groups)
+
+    def _schedule_group(self, key):
+        send_time, timezone_name = key
+
+        def deliver(due):
+            members = self.groups.get(key)
+            if members:
+                self.deliver(members, local_date(due, timezone_name))
+
+        jobs = [self.timer.schedule_daily(send_time, timezone_name, deliver)]
+        if self.pregenerate is not None and self.lead_seconds:
+            def pregenerate(due):
+                members = self.groups.get(key)
+                if members:
+                    self.pregenerate(members, local_date(due + self.lead_seconds, timezone_name))
+            jobs.append(self.timer.schedule_daily(send_time, timezone_name, pregenerate, self.lead_seconds))
+        return jobs
+
+    def start(self, refresh_minutes=None):
+        """Schedule all current groups and the periodic registry refresh"""
+        count = self.refresh()
+        refresh_minutes = refresh_minutes or config.SCHEDULER_REFRESH_MINUTES
+        self.timer.schedule_every(refresh_minutes * 60, self.refresh)
+        return count
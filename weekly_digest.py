@@ -0,0 +1,280 @@
+import sys
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+# Import configuration
+import config
+import metrics
+from mime_batch import alternative_body
+from plan_history import get_history
+from plan_validator import NUTRIENT_TARGETS
+
+NUTRIENTS = ("calories", "protein", "carbs", "fiber")
+_UNITS = ("kcal", "g", "g", "g")
+# Midpoint of the 25-30 g fiber goal shown in the daily email
+FIBER_TARGET = 27.5
+# Calorie trends smaller than this many kcal per day are reported as steady
+_STEADY_KCAL_PER_DAY = 25
+
+def daily_totals(columns, days):
+    """A (subscribers, days, nutrients) array of day totals from `PlanHistory.nutrient_columns`.
+
+    Each plan's meals are summed once, however many subscribers it went
+    to; days without a plan, or whose plan had no numbers, are NaN.
+    """
+    meals = np.frombuffer(columns["meals"], dtype=np.int32)
+    values = np.frombuffer(columns["nutrients"], dtype=np.uint16).reshape(-1, len(NUTRIENTS))
+    # Per-plan sums as differences of a running total, which also handles plans without meals
+    running = np.zeros((len(values) + 1, len(NUTRIENTS)), dtype=np.int64)
+    np.cumsum(values, axis=0, out=running[1:])
+    ends = np.cumsum(meals)
+    plan_totals = (running[ends] - running[ends - meals]).astype(np.float32)
+    plan_totals[meals == 0] = np.nan
+    daily = np.full((len(columns["emails"]), days, len(NUTRIENTS)), np.nan, dtype=np.float32)
+    daily[np.frombuffer(columns["subscriber"], dtype=np.int32), np.frombuffer(columns["day"], dtype=np.int32)] = (
+        plan_totals[np.frombuffer(columns["plan"], dtype=np.int32)]
+    )
+    return daily
+
+def targets_for(calories):
+    """Daily (kcal, protein, carbs, fiber) targets for an array of calorie goals, as printed in the email"""
+    calories = np.asarray(calories, dtype=np.float64)
+    return np.stack([NUTRIENT_TARGETS[nutrient](calories) for nutrient in NUTRIENTS[:3]]
+                    + [np.full_like(calories, FIBER_TARGET)], axis=1)
+
+def aggregate(daily, targets, tolerance=None):
+    """Weekly statistics for every subscriber at once, from day totals and daily targets.
+
+    Returns per-subscriber arrays: `days_logged`, `totals` and `mean` (per
+    day logged) per nutrient, `deviation` of the mean from the target as a
+    fraction, `on_target_days` (calories within `tolerance` of the goal)
+    and `kcal_trend`, the least-squares slope of daily calories in kcal per
+    day (NaN with fewer than two days).
+    """
+    tolerance = config.VALIDATION_KCAL_TOLERANCE if tolerance is None else tolerance
+    logged = ~np.isnan(daily[..., 0])
+    days_logged = logged.sum(axis=1)
+    values = np.where(logged[..., None], daily, 0).astype(np.float64)
+    totals = values.sum(axis=1)
+    kcal = values[..., 0]
+    goal = targets[:, :1]
+    on_target_days = (logged & (np.abs(kcal - goal) <= tolerance * goal)).sum(axis=1)
+    # Weighted least squares over the logged days only
+    x = np.arange(daily.shape[1], dtype=np.float64)
+    weights = logged.astype(np.float64)
+    sum_x, sum_xx = weights @ x, weights @ (x * x)
+    sum_y, sum_xy = kcal.sum(axis=1), kcal @ x
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = totals / days_logged[:, None]
+        deviation = mean / targets - 1
+        denominator = days_logged * sum_xx - sum_x * sum_x
+        kcal_trend = np.where(days_logged > 1, (days_logged * sum_xy - sum_x * sum_y) / denominator, np.nan)
+    return {"days_logged": days_logged, "totals": totals, "mean": mean, "deviation": deviation,
+            "on_target_days": on_target_days, "kcal_trend": kcal_trend}
+
+@dataclass(slots=True)
+class WeeklyReport:
+    """One week of every subscriber's plans against their targets, one array row per subscriber.
+
+    `daily` holds the day totals (NaN when nothing was logged), `targets`
+    the daily goals, and the remaining fields the results of `aggregate`.
+    """
+
+    first_date: date
+    emails: list
+    daily: np.ndarray
+    targets: np.ndarray
+    days_logged: np.ndarray
+    totals: np.ndarray
+    mean: np.ndarray
+    deviation: np.ndarray
+    on_target_days: np.ndarray
+    kcal_trend: np.ndarray
+
+    def __len__(self):
+        return len(self.emails)
+
+    @property
+    def last_date(self):
+        return self.first_date + timedelta(days=self.daily.shape[1] - 1)
+
+    def summary(self):
+        """Averages across subscribers: deviation from target per nutrient, days on target and trend"""
+        if not len(self):
+            return {"subscribers": 0}
+        with np.errstate(invalid="ignore"):
+            deviation = np.nanmean(self.deviation, axis=0)
+        summary = {"subscribers": len(self), "days_logged": float(self.days_logged.mean()),
+                   "on_target_days": float(self.on_target_days.mean())}
+        summary.update({f"{nutrient}_deviation": float(value) for nutrient, value in zip(NUTRIENTS, deviation)})
+        summary["kcal_trend"] = float(np.nanmean(self.kcal_trend)) if np.isfinite(self.kcal_trend).any() else 0.0
+        return summary
+
+def weekly_report(week_end=None, history=None, preferences=None, days=None):
+    """The report for the `days` (DIGEST_DAYS) ending on `week_end`, yesterday by default.
+
+    Targets come from each subscriber's preferences in `preferences` (email
+    to preferences, read from the subscriber registry by default);
+    addresses without any get the configured defaults.
+    """
+    days = days or config.DIGEST_DAYS
+    last_date = week_end or date.today() - timedelta(days=1)
+    first_date = last_date - timedelta(days=days - 1)
+    columns = (history or get_history()).nutrient_columns(first_date, last_date)
+    if preferences is None:
+        from subscribers import SubscriberRegistry
+        with SubscriberRegistry() as registry:
+            preferences = {subscriber["email"].strip().lower(): subscriber["preferences"]
+                           for subscriber in registry.list_subscribers()}
+    default = config.DIETARY_PREFERENCES["calories_per_day"]
+    calories = np.fromiter(
+        (preferences[email]["calories_per_day"] if email in preferences else default for email in columns["emails"]),
+        dtype=np.float64, count=len(columns["emails"]),
+    )
+    daily = daily_totals(columns, days)
+    targets = targets_for(calories)
+    return WeeklyReport(first_date, columns["emails"], daily, targets, **aggregate(daily, targets))
+
+def _amount(value, unit):
+    return "–" if np.isnan(value) else f"{value:,.0f} {unit}"
+
+def _difference(value):
+    if np.isnan(value):
+        return "–"
+    return f"{value:+.0%}" if abs(value) >= 0.005 else "0%"
+
+def _trend(kcal_per_day):
+    if np.isnan(kcal_per_day):
+        return "Not enough days logged to show a trend yet."
+    if abs(kcal_per_day) < _STEADY_KCAL_PER_DAY:
+        return "Your calories held steady through the week."
+    direction = "rose" if kcal_per_day > 0 else "fell"
+    return f"Your calories {direction} by about {abs(kcal_per_day):.0f} kcal a day through the week."
+
+def render_digest(report, row):
+    """The plain-text and HTML bodies of one subscriber's weekly digest"""
+    period = f"{report.first_date.strftime('%B %d')} - {report.last_date.strftime('%B %d, %Y')}"
+    days = report.daily.shape[1]
+    logged = f"{report.days_logged[row]} of {days} days logged, calories on target on {report.on_target_days[row]}"
+    trend = _trend(report.kcal_trend[row])
+    rows = [(nutrient.title(), _amount(report.mean[row, index], unit), _amount(report.targets[row, index], unit),
+             _difference(report.deviation[row, index]))
+            for index, (nutrient, unit) in enumerate(zip(NUTRIENTS, _UNITS))]
+    day_dates = [report.first_date + timedelta(days=offset) for offset in range(days)]
+    kcal = report.daily[row, :, 0]
+
+    text = "\n".join((
+        f"Your Weekly Nutrition Digest\n{period}\n",
+        f"{logged}.",
+        trend,
+        "\nDaily average vs target:",
+        *(f"   {name}: {average} (target {target}, {difference})" for name, average, target, difference in rows),
+        "\nCalories by day:",
+        *(f"   {day.strftime('%a %d')}: {_amount(value, 'kcal')}" for day, value in zip(day_dates, kcal)),
+        "\nGenerated by AI Nutritionist Assistant. Please consult with a healthcare professional for personalized advice.\n",
+    ))
+
+    peak = np.nanmax(kcal) if np.isfinite(kcal).any() else 1.0
+    primary, secondary = config.EMAIL_COLOR_PRIMARY, config.EMAIL_COLOR_SECONDARY
+    table = "".join(
+        f'<tr><td style="padding:6px 10px">{name}</td><td style="padding:6px 10px;text-align:right">{average}</td>'
+        f'<td style="padding:6px 10px;text-align:right">{target}</td>'
+        f'<td style="padding:6px 10px;text-align:right">{difference}</td></tr>'
+        for name, average, target, difference in rows
+    )
+    bars = "".join(
+        f'<tr><td style="padding:2px 10px;white-space:nowrap">{day.strftime("%a %d")}</td><td style="width:100%">'
+        + ("" if np.isnan(value) else
+           f'<div style="background:{secondary};height:14px;width:{max(1, int(value / peak * 100))}%"></div>')
+        + f'</td><td style="padding:2px 10px;text-align:right;white-space:nowrap">{_amount(value, "kcal")}</td></tr>'
+        for day, value in zip(day_dates, kcal)
+    )
+    html = f"""<!DOCTYPE html>
+<html>
+<head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"></head>
+<body style="margin:0;background:#f9f9f9;font-family:'Segoe UI',Tahoma,Geneva,Verdana,sans-serif;color:#333">
+<div style="max-width:800px;margin:0 auto;padding:20px">
+<div style="background:white;border-radius:8px;overflow:hidden">
+<div style="background:linear-gradient(135deg, {primary} 0%, {secondary} 100%);color:white;padding:24px">
+<h1 style="margin:0;font-size:24px">Your Weekly Nutrition Digest</h1><p style="margin:4px 0 0">{period}</p>
+</div>
+<div style="padding:20px">
+<p>{logged}.</p>
+<p>{trend}</p>
+<h2 style="color:{primary};font-size:18px">Daily average vs target</h2>
+<table style="width:100%;border-collapse:collapse">
+<tr style="background:#f1f8f3"><th style="padding:6px 10px;text-align:left">Nutrient</th><th style="padding:6px 10px;text-align:right">Average</th><th style="padding:6px 10px;text-align:right">Target</th><th style="padding:6px 10px;text-align:right">Difference</th></tr>
+{table}
+</table>
+<h2 style="color:{primary};font-size:18px">Calories by day</h2>
+<table style="width:100%;border-collapse:collapse">{bars}</table>
+</div>
+<div style="padding:16px 20px;font-size:12px;color:#777;border-top:1px solid #eee">
+Generated by AI Nutritionist Assistant. Please consult with a healthcare professional for personalized advice.
+</div>
+</div>
+</div>
+</body>
+</html>
+"""
+    return text, html
+
+def digest_message(report, row):
+    """Ready-to-send bytes of one subscriber's digest"""
+    subject = config.DIGEST_SUBJECT_TEMPLATE.format(start=report.first_date.strftime("%B %d"),
+                                                    end=report.last_date.strftime("%B %d, %Y"))
+    text, html = render_digest(report, row)
+    return alternative_body(subject, text, html).message_for(report.emails[row])
+
+def send_digests(report, pool=None):
+    """Email a digest to every subscriber with at least one day logged, DIGEST_SEND_CHUNK at a time.
+
+    Returns (sent, failed).
+    """
+    from smtp_pool import SMTPConnectionPool
+    owns_pool = pool is None
+    pool = pool or SMTPConnectionPool()
+    rows = np.flatnonzero(report.days_logged).tolist()
+    sent = failed = 0
+    try:
+        for start in range(0, len(rows), config.DIGEST_SEND_CHUNK):
+            # Rendered per chunk, so memory stays bounded however many subscribers there are
+            chunk = rows[start:start + config.DIGEST_SEND_CHUNK]
+            messages = [(report.emails[row], digest_message(report, row)) for row in chunk]
+            for (receiver, _), error in zip(messages, pool.send_many(config.EMAIL_SENDER, messages)):
+                if error is None:
+                    sent += 1
+                else:
+                    failed += 1
+                    print(f"Could not send the weekly digest to {receiver}: {error}")
+                metrics.DELIVERIES.inc(result="sent" if error is None else "failed")
+    finally:
+        if owns_pool:
+            pool.close()
+    return sent, failed
+
+if __name__ == "__main__":
+    # Usage:
+    #   python weekly_digest.py report [YYYY-MM-DD]      # week ending that day (default: yesterday)
+    #   python weekly_digest.py show EMAIL [YYYY-MM-DD]  # print one subscriber's digest
+    #   python weekly_digest.py send [YYYY-MM-DD]        # email every subscriber their digest
+    command = sys.argv[1] if len(sys.argv) > 1 else "report"
+    arguments = sys.argv[2:]
+    email = arguments.pop(0).strip().lower() if command == "show" else None
+    week_end = date.fromisoformat(arguments[0]) if arguments else None
+    report = weekly_report(week_end)
+    if command == "show":
+        if email not in report.emails:
+            print(f"No plans archived for {email} between {report.first_date} and {report.last_date}")
+            sys.exit(1)
+        print(render_digest(report, report.emails.index(email))[0])
+    elif command == "send":
+        with metrics.job("weekly_digest"):
+            sent, failed = send_digests(report)
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Weekly digests: {sent} sent, {failed} failed")
+    else:
+        print(f"Week {report.first_date} to {report.last_date}")
+        for name, value in report.summary().items():
+            print(f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}")